@@ -4,7 +4,7 @@ from datetime import datetime
 # from dotenv import load_dotenv
 import pandas as pd
 
-from src.data import load_raw_data, transform_raw_data_into_ts_data
+from src.data import load_ts_data
 from src.config import FEATURE_GROUP_METADATA 
 from src.feature_store_api import feature_group_insert, get_or_create_feature_group
 from src.logger import get_logger
@@ -12,9 +12,14 @@ from src.logger import get_logger
 logger = get_logger()
 
 
-def get_historical_rides() -> pd.DataFrame:
+def get_historical_ts_data() -> pd.DataFrame:
     """
-    Download historical rides from the NYC Taxi dataset
+    Download historical rides from the NYC Taxi dataset and aggregate them
+    into hourly time-series data
+
+    Monthly aggregates are cached, so only months that are new or changed since
+    the last backfill are aggregated, and at most one month of raw rides is in
+    memory at a time.
     """
     # TODO: implement new backfill, maybe get from_year from the command line
     from_year = 2022
@@ -22,25 +27,13 @@ def get_historical_rides() -> pd.DataFrame:
     to_year = datetime.now().year
     print(f'Downloading raw data from {from_year} to {to_year}')
 
-    rides = pd.DataFrame()
-    for year in range(from_year, to_year+1):
-        
-        # download data for the whole year
-        rides_one_year = load_raw_data(year)
-        
-        # append rows
-        rides = pd.concat([rides, rides_one_year])
-
-    return rides
+    return load_ts_data(list(range(from_year, to_year+1)))
 
 
 def run():
 
-    logger.info('Fetching raw data from data warehouse')
-    rides = get_historical_rides()
-
-    logger.info('Transforming raw data into time-series data')
-    ts_data = transform_raw_data_into_ts_data(rides)
+    logger.info('Fetching raw data from data warehouse and transforming it into time-series data')
+    ts_data = get_historical_ts_data()
 
     # add new column with the timestamp in Unix seconds
     ts_data['pickup_hour'] = pd.to_datetime(ts_data['pickup_hour'], utc=True)    
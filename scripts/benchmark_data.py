@@ -0,0 +1,186 @@
+"""
+Benchmarks the hot paths of `src.data` on synthetic rides, offline, and
+writes the timings and memory peaks to a JSON file.
+
+    python scripts/benchmark_data.py --months 1 3 --locations 50 265
+    python scripts/benchmark_data.py --baseline old.json --output new.json
+
+With `--baseline`, it exits with status 1 if any step got slower than
+`--max_slowdown` times its baseline timing for the same size.
+"""
+import gc
+import json
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import src.data
+from src import config
+from src.data import (
+    add_missing_slots,
+    load_raw_data,
+    transform_raw_data_into_ts_data,
+    transform_ts_data_into_features_and_target,
+)
+from src.paths import DATA_CACHE_DIR
+from src.synthetic_data import write_raw_data_files
+
+YEAR = 2023
+
+
+def benchmark(
+    n_months: int,
+    n_locations: int,
+    rides_per_location_per_hour: float,
+    repeat: int,
+    seed: int,
+) -> List[Dict]:
+    """Generates `n_months` of synthetic rides for `n_locations` and measures
+    every step of the pipeline on them"""
+    months = list(range(1, n_months + 1))
+    results = []
+
+    with tempfile.TemporaryDirectory() as data_dir, _raw_data_dir(Path(data_dir)):
+        write_raw_data_files(data_dir, YEAR, months, n_locations, rides_per_location_per_hour, seed)
+
+        def measure(step: str, n_rows: int, fn: Callable, *args, **kwargs):
+            output, metrics = _measure(fn, repeat, *args, **kwargs)
+            results.append({
+                'step': step,
+                'n_months': n_months,
+                'n_locations': n_locations,
+                'n_rows': n_rows,
+                **metrics,
+            })
+            return output
+
+        rides = measure('load_raw_data', None, load_raw_data, YEAR, months)
+        results[-1]['n_rows'] = len(rides)
+
+        ts_data = measure('transform_raw_data_into_ts_data', len(rides),
+                          lambda: transform_raw_data_into_ts_data(rides.copy()))
+
+        sparse_ts_data = ts_data[ts_data['rides'] > 0].reset_index(drop=True)
+        measure('add_missing_slots', len(sparse_ts_data), add_missing_slots, sparse_ts_data)
+
+        # same column the feature pipeline adds before building features
+        ts_data['pickup_ts'] = ts_data['pickup_hour'].astype(int) // 10**6
+        measure('transform_ts_data_into_features_and_target', len(ts_data),
+                transform_ts_data_into_features_and_target,
+                ts_data, n_features=config.N_FEATURES, step_size=config.STEP_SIZE)
+
+    return results
+
+
+@contextmanager
+def _raw_data_dir(data_dir: Path):
+    """Points `src.data` to `data_dir` instead of the real raw data directory"""
+    raw_data_dir = src.data.RAW_DATA_DIR
+    src.data.RAW_DATA_DIR = data_dir
+    try:
+        yield
+    finally:
+        src.data.RAW_DATA_DIR = raw_data_dir
+
+
+def _measure(fn: Callable, repeat: int, *args, **kwargs) -> Tuple[object, Dict]:
+    """
+    Best wall time out of `repeat` runs of `fn`, plus one more run under
+    tracemalloc for the peak memory, which would slow down the timed runs
+    """
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        output = fn(*args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+        del output
+
+    gc.collect()
+    tracemalloc.start()
+    output = fn(*args, **kwargs)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return output, {
+        'seconds': min(seconds),
+        'mean_seconds': float(np.mean(seconds)),
+        'peak_memory_mb': peak_memory / 2**20,
+        # high-water mark of the whole process so far, kilobytes on Linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+    }
+
+
+def _find_regressions(results: List[Dict], baseline: Dict, max_slowdown: float) -> List[str]:
+    """Steps that got more than `max_slowdown` times slower than in `baseline`"""
+    baseline_seconds = {
+        (r['step'], r['n_months'], r['n_locations']): r['seconds'] for r in baseline['results']
+    }
+    regressions = []
+    for r in results:
+        key = (r['step'], r['n_months'], r['n_locations'])
+        if key in baseline_seconds and r['seconds'] > max_slowdown * baseline_seconds[key]:
+            regressions.append(
+                f'{r["step"]} ({r["n_months"]} months, {r["n_locations"]} locations): '
+                f'{baseline_seconds[key]:.3f}s -> {r["seconds"]:.3f}s'
+            )
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--months', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--locations', type=int, nargs='+', default=[50, 265])
+    parser.add_argument('--rides_per_location_per_hour', type=float, default=2.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=Path, default=DATA_CACHE_DIR / 'benchmark_data.json')
+    parser.add_argument('--baseline', type=Path, default=None,
+                        help='JSON file of a previous run to compare against')
+    parser.add_argument('--max_slowdown', type=float, default=1.5)
+    args = parser.parse_args()
+
+    results = []
+    for n_months in args.months:
+        for n_locations in args.locations:
+            results += benchmark(n_months, n_locations, args.rides_per_location_per_hour,
+                                 args.repeat, args.seed)
+
+    print(pd.DataFrame(results).to_string(index=False, float_format='{:,.3f}'.format))
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'data_backend': config.DATA_BACKEND,
+        'n_features': config.N_FEATURES,
+        'step_size': config.STEP_SIZE,
+        'rides_per_location_per_hour': args.rides_per_location_per_hour,
+        'seed': args.seed,
+        'results': results,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results saved to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = _find_regressions(results, json.load(f), args.max_slowdown)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,63 @@
+"""
+Compares the throughput of the data backends in `src.data_backends` when
+loading and aggregating a full year of raw rides.
+
+    python scripts/benchmark_data_backends.py --year 2023
+"""
+import importlib.util
+import time
+from argparse import ArgumentParser
+from typing import List
+
+import pandas as pd
+
+from src.data import download_raw_data, load_raw_data, transform_raw_data_into_ts_data
+from src.data_backends import BACKENDS
+
+
+def benchmark(year: int, backends: List[str]) -> pd.DataFrame:
+    """Times `load_raw_data` and `transform_raw_data_into_ts_data` for every
+    backend, and returns the rows/sec each of them processes"""
+    # download outside of the timed section
+    download_raw_data(year, list(range(1, 13)))
+
+    results = []
+    for backend in backends:
+        start = time.perf_counter()
+        rides = load_raw_data(year, backend=backend)
+        load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ts_data = transform_raw_data_into_ts_data(rides, backend=backend)
+        transform_seconds = time.perf_counter() - start
+
+        results.append({
+            'backend': backend,
+            'rides': len(rides),
+            'ts_rows': len(ts_data),
+            'load_seconds': load_seconds,
+            'transform_seconds': transform_seconds,
+            'load_rows_per_sec': len(rides) / load_seconds,
+            'transform_rows_per_sec': len(rides) / transform_seconds,
+            'total_rows_per_sec': len(rides) / (load_seconds + transform_seconds),
+        })
+
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--year', type=int, default=2023)
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=None)
+    args = parser.parse_args()
+
+    backends = args.backends
+    if backends is None:
+        # skip polars if it is not installed
+        backends = ['pandas', 'arrow']
+        if importlib.util.find_spec('polars') is not None:
+            backends.append('polars')
+
+    results = benchmark(args.year, backends)
+    print(results.to_string(index=False, float_format='{:,.2f}'.format))
@@ -0,0 +1,101 @@
+"""
+Measures the Hopsworks calls one pipeline run makes with and without reusing
+the session in `src.hopsworks_session`, against a local stub of the hopsworks
+client that sleeps a fixed latency per call:
+
+    python scripts/benchmark_hopsworks_session.py --login_ms 2000 --call_ms 200
+"""
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from types import SimpleNamespace
+from typing import Optional
+
+import pandas as pd
+
+from src import config
+import src.hopsworks_session as hopsworks_session
+from src.feature_store_api import get_or_create_feature_group, get_or_create_feature_view
+from src.model_registry_api import get_model_registry
+
+
+class StubClient:
+    """Stand-in for `hopsworks.login` that counts and delays every call"""
+
+    def __init__(self, login_seconds: float, call_seconds: float):
+        self.login_seconds = login_seconds
+        self.call_seconds = call_seconds
+        self.calls = Counter()
+
+    def login(self, **kwargs):
+        self._call('login', None, self.login_seconds)
+        return SimpleNamespace(
+            get_feature_store=lambda: self._call('get_feature_store', self._feature_store()),
+            get_model_registry=lambda: self._call('get_model_registry', SimpleNamespace()),
+        )
+
+    def _feature_store(self):
+        feature_group = SimpleNamespace(select_all=lambda: None)
+        return SimpleNamespace(
+            get_feature_group=lambda **kwargs: self._call('get_feature_group', feature_group),
+            get_or_create_feature_group=lambda **kwargs: self._call('get_or_create_feature_group', feature_group),
+            create_feature_view=lambda **kwargs: self._call('create_feature_view', None),
+            get_feature_view=lambda **kwargs: self._call('get_feature_view', SimpleNamespace()),
+        )
+
+    def _call(self, name: str, result, seconds: Optional[float] = None):
+        self.calls[name] += 1
+        time.sleep(self.call_seconds if seconds is None else seconds)
+        return result
+
+
+def run_pipelines(reuse_session: bool) -> None:
+    """Hopsworks pointers requested by one feature, training and inference
+    pipeline run. Without `reuse_session`, every request logs in again, as
+    before the session was shared (feature views even logged in twice)"""
+    for get_pointer in [
+        # feature pipeline
+        lambda: get_or_create_feature_group(config.FEATURE_GROUP_METADATA),
+        # training pipeline
+        lambda: get_or_create_feature_view(config.FEATURE_VIEW_METADATA),
+        get_model_registry,
+        # inference pipeline
+        lambda: get_or_create_feature_view(config.FEATURE_VIEW_METADATA),
+        get_model_registry,
+        lambda: get_or_create_feature_group(config.FEATURE_GROUP_PREDICTIONS_METADATA),
+    ]:
+        if not reuse_session:
+            hopsworks_session.invalidate()
+        get_pointer()
+
+
+def benchmark(login_seconds: float, call_seconds: float) -> pd.DataFrame:
+    results = []
+    for reuse_session in (False, True):
+        client = StubClient(login_seconds, call_seconds)
+        hopsworks_session.set_login(client.login)
+
+        start = time.perf_counter()
+        run_pipelines(reuse_session)
+        seconds = time.perf_counter() - start
+
+        results.append({
+            'session': 'shared' if reuse_session else 'login per call',
+            'logins': client.calls['login'],
+            'calls': sum(client.calls.values()),
+            'seconds': seconds,
+        })
+
+    hopsworks_session.set_login(None)
+    return pd.DataFrame(results)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--login_ms', type=float, default=2000)
+    parser.add_argument('--call_ms', type=float, default=200)
+    args = parser.parse_args()
+
+    results = benchmark(args.login_ms / 1000, args.call_ms / 1000)
+    print(results.to_string(index=False, float_format='{:,.2f}'.format))
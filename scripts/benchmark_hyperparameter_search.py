@@ -0,0 +1,127 @@
+"""
+Compares the serial hyperparameter search of the training pipeline with the
+parallel one over a memory-mapped matrix, on synthetic features:
+
+    python scripts/benchmark_hyperparameter_search.py --n_rows 20000 --n_trials 8 --n_workers 4
+
+Every mode runs in a fresh process, so their measurements do not mix. The
+memory of a search is the peak of the PSS (proportional set size) of the
+process and its workers, sampled while it runs, so pages of the shared matrix
+are counted once however many workers read them. It needs Linux's /proc.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src import config
+from src.hyperparameter_search import find_best_hyperparameters
+from src.paths import PARENT_DIR
+from src.training_matrix import TrainingMatrix
+
+
+def benchmark(n_rows: int, n_trials: int, n_workers: int, seed: int) -> pd.DataFrame:
+    results = []
+    for mode, workers in [('serial', 1), ('parallel', n_workers)]:
+        output = subprocess.run(
+            [sys.executable, __file__, '--run', '--n_rows', str(n_rows), '--n_trials', str(n_trials),
+             '--n_workers', str(workers), '--seed', str(seed)],
+            cwd=PARENT_DIR, capture_output=True, text=True, check=True,
+        )
+        results.append({'mode': mode, 'workers': workers, **json.loads(output.stdout.strip().splitlines()[-1])})
+    return pd.DataFrame(results)
+
+
+def run(n_rows: int, n_trials: int, n_workers: int, seed: int) -> dict:
+    """Runs one search in this process and returns its measurements"""
+    train_data = TrainingMatrix.from_frame(*_make_features_and_target(np.random.default_rng(seed), n_rows))
+    pss_before_search_mb = _get_pss_mb([os.getpid()])
+
+    peak_pss_mb = [pss_before_search_mb]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.05):
+            peak_pss_mb[0] = max(peak_pss_mb[0], _get_pss_mb(_get_process_tree(os.getpid())))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    find_best_hyperparameters(train_data, n_trials=n_trials, n_workers=n_workers)
+    seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    return {
+        'trials_per_hour': 3600 * n_trials / seconds,
+        'seconds': seconds,
+        'data_mb': train_data.X.nbytes / 2**20,
+        'peak_pss_mb': peak_pss_mb[0],
+        'search_pss_increase_mb': peak_pss_mb[0] - pss_before_search_mb,
+    }
+
+
+def _get_process_tree(pid: int) -> list:
+    """`pid` and all its descendants"""
+    children = {}
+    for stat_file in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            # the command name in parentheses may contain spaces
+            fields = stat_file.read_text().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat_file.parent.name))
+
+    tree = [pid]
+    for parent in tree:
+        tree.extend(children.get(parent, []))
+    return tree
+
+
+def _get_pss_mb(pids: list) -> float:
+    pss_kb = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/smaps_rollup') as f:
+                pss_kb += next(int(line.split()[1]) for line in f if line.startswith('Pss:'))
+        except (OSError, StopIteration):
+            # the process exited in the meantime
+            continue
+    return pss_kb / 2**10
+
+
+def _make_features_and_target(rng: np.random.Generator, n_rows: int):
+    features = pd.DataFrame(
+        rng.poisson(5, (n_rows, config.N_FEATURES)).astype(np.float32),
+        columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(config.N_FEATURES))],
+    )
+    features['pickup_hour'] = pd.Timestamp('2024-01-01') \
+        + pd.to_timedelta(np.sort(rng.integers(0, 24 * 365, n_rows)), unit='h')
+    features['pickup_location_id'] = rng.integers(1, 266, n_rows)
+    target = 0.5 * features['rides_previous_1_hour'] + 0.5 * features['rides_previous_168_hour'] \
+        + rng.normal(0, 1, n_rows)
+    return features, target
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--n_rows', type=int, default=20_000)
+    parser.add_argument('--n_trials', type=int, default=8)
+    parser.add_argument('--n_workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--run', action='store_true', help='Run a single search and print its results')
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.n_rows, args.n_trials, args.n_workers, args.seed)))
+    else:
+        results = benchmark(args.n_rows, args.n_trials, args.n_workers, args.seed)
+        print(results.to_string(index=False, float_format='{:,.1f}'.format))
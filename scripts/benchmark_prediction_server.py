@@ -0,0 +1,126 @@
+"""
+Measures the latency of the prediction server against a local, file-backed
+store of features, and compares it with one cold run of the inference steps
+(load features, predict).
+
+    python scripts/benchmark_prediction_server.py --n_requests 2000
+"""
+import http.client
+import json
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable, List
+
+import numpy as np
+import pandas as pd
+
+from src import config
+from src.inference import get_model_predictions
+from src.model import get_pipeline
+from src.prediction_server import PredictionService, serve
+
+N_LOCATIONS = 265
+
+
+def benchmark(n_requests: int, seed: int) -> pd.DataFrame:
+    """p50/p99 latencies of single-location and all-locations requests"""
+    rng = np.random.default_rng(seed)
+    current_date = pd.Timestamp('2024-01-10 10:00')
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        features_file = Path(data_dir) / 'feature_group.parquet'
+        _make_features(rng, current_date).to_parquet(features_file)
+        model = _make_model(rng, current_date)
+
+        def load_features(date: pd.Timestamp) -> pd.DataFrame:
+            features = pd.read_parquet(features_file)
+            features['pickup_hour'] = date
+            return features
+
+        # one cold run of the inference steps, for reference
+        start = time.perf_counter()
+        get_model_predictions(model, load_features(current_date))
+        cold_seconds = time.perf_counter() - start
+
+        service = PredictionService(
+            load_features=load_features,
+            load_model=lambda version: None if version else ('1', model),
+        )
+        service.refresh(current_date)
+
+        server = serve(service, '127.0.0.1', 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1])
+
+        all_locations = ','.join(map(str, range(1, N_LOCATIONS + 1)))
+        results = {
+            'single location': _time_requests(
+                connection, n_requests,
+                lambda i: f'/predict?location_id={i % N_LOCATIONS + 1}'),
+            f'{N_LOCATIONS} locations': _time_requests(
+                connection, n_requests,
+                lambda i: f'/predict?location_id={all_locations}'),
+        }
+
+        connection.close()
+        server.shutdown()
+        server.server_close()
+
+    return pd.DataFrame([
+        {
+            'request': request,
+            'p50_ms': 1000 * np.percentile(seconds, 50),
+            'p99_ms': 1000 * np.percentile(seconds, 99),
+            'mean_ms': 1000 * np.mean(seconds),
+            'cold_inference_ms': 1000 * cold_seconds,
+        }
+        for request, seconds in results.items()
+    ])
+
+
+def _time_requests(
+    connection: http.client.HTTPConnection,
+    n_requests: int,
+    get_path: Callable[[int], str],
+) -> List[float]:
+    seconds = []
+    for i in range(n_requests):
+        start = time.perf_counter()
+        connection.request('GET', get_path(i))
+        response = connection.getresponse()
+        body = response.read()
+        seconds.append(time.perf_counter() - start)
+        assert response.status == 200, body
+    json.loads(body)
+    return seconds
+
+
+def _make_features(rng: np.random.Generator, current_date: pd.Timestamp) -> pd.DataFrame:
+    features = pd.DataFrame(
+        rng.poisson(5, (N_LOCATIONS, config.N_FEATURES)).astype(np.float32),
+        columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(config.N_FEATURES))],
+    )
+    features['pickup_hour'] = current_date
+    features['pickup_location_id'] = np.arange(1, N_LOCATIONS + 1)
+    return features
+
+
+def _make_model(rng: np.random.Generator, current_date: pd.Timestamp):
+    """Small model with the same inputs as the production one"""
+    features = _make_features(rng, current_date)
+    target = features['rides_previous_1_hour'] + rng.normal(0, 1, N_LOCATIONS)
+    return get_pipeline(n_estimators=50, verbose=-1).fit(features, target)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--n_requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = benchmark(args.n_requests, args.seed)
+    print(results.to_string(index=False, float_format='{:,.3f}'.format))
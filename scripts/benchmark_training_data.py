@@ -0,0 +1,165 @@
+"""
+Compares the peak memory and time of building the training data and fitting
+a model with the DataFrames the training pipeline used before, with the
+float32 `TrainingMatrix`, and with the `TrainingShards` of its streaming
+mode, on synthetic time-series data:
+
+    python scripts/benchmark_training_data.py --n_locations 265 --n_days 365
+
+Every mode runs in a fresh process, so their peaks do not mix. The peak RSS
+is the process's high-water mark (VmHWM in Linux's /proc, else the peak RSS
+`getrusage` reports). It includes the pages of memory-mapped shards, which
+are page cache the kernel drops under memory pressure, so the peak of the
+anonymous RSS is sampled too, where /proc is available.
+"""
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src import config
+from src.data import transform_ts_data_into_features_and_target
+from src.data_split import train_test_split
+from src.model import get_pipeline
+from src.paths import PARENT_DIR
+from src.training_matrix import TrainingMatrix, TrainingShards, fit_pipeline
+
+# small, to measure the data path more than the training itself
+N_ESTIMATORS = 10
+
+MODES = ('dataframe', 'matrix', 'shards')
+
+
+def benchmark(n_locations: int, n_days: int, seed: int) -> pd.DataFrame:
+    results = []
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--run', mode, '--n_locations', str(n_locations),
+             '--n_days', str(n_days), '--seed', str(seed)],
+            cwd=PARENT_DIR, capture_output=True, text=True, check=True,
+        )
+        results.append({'mode': mode, **json.loads(output.stdout.strip().splitlines()[-1])})
+    return pd.DataFrame(results)
+
+
+def run(mode: str, n_locations: int, n_days: int, seed: int) -> dict:
+    """Builds the training data and fits a model in this process, the way
+    `mode` does, and returns its measurements"""
+    ts_data = _make_ts_data(np.random.default_rng(seed), n_locations, n_days)
+    cutoff_date = ts_data['pickup_hour'].max() - pd.Timedelta(days=config.CUTOFF_DATE)
+    peak_rss_before_mb = _get_peak_rss_mb()
+
+    peak_anon_rss_mb = [_get_anon_rss_mb()]
+    done = threading.Event()
+
+    def sample():
+        while peak_anon_rss_mb[0] is not None and not done.wait(0.05):
+            peak_anon_rss_mb[0] = max(peak_anon_rss_mb[0], _get_anon_rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    shards_dir = tempfile.TemporaryDirectory()
+
+    start = time.perf_counter()
+    if mode == 'dataframe':
+        features, targets = transform_ts_data_into_features_and_target(
+            ts_data, n_features=config.N_FEATURES, step_size=config.STEP_SIZE,
+        )
+        features_and_target = features.copy()
+        features_and_target['target_rides_next_hour'] = targets
+        del features, targets
+        X_train, y_train, X_test, y_test = train_test_split(
+            features_and_target, cutoff_date, target_column_name='target_rides_next_hour',
+        )
+        data_seconds = time.perf_counter() - start
+        data_mb = features_and_target.memory_usage(deep=True).sum() / 2**20
+        get_pipeline(n_estimators=N_ESTIMATORS).fit(X_train, y_train)
+        n_rows = len(features_and_target)
+    else:
+        if mode == 'matrix':
+            training_data = TrainingMatrix.from_ts_data(
+                ts_data, n_features=config.N_FEATURES, step_size=config.STEP_SIZE,
+            )
+        else:
+            training_data = TrainingShards.write(
+                ts_data, n_features=config.N_FEATURES, step_size=config.STEP_SIZE,
+                directory=shards_dir.name,
+            )
+        train_data, test_data = training_data.split_by_date(cutoff_date)
+        data_seconds = time.perf_counter() - start
+        data_mb = training_data.shape[0] * (training_data.shape[1] + 1) * 4 / 2**20
+        # as the training pipeline does, see `find_best_hyperparameters`
+        hyperparams = {'subsample_for_bin': config.STREAMING_SUBSAMPLE_FOR_BIN} if mode == 'shards' else {}
+        fit_pipeline(get_pipeline(n_estimators=N_ESTIMATORS, **hyperparams), train_data)
+        n_rows = len(training_data)
+
+    seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    shards_dir.cleanup()
+
+    return {
+        'rows': n_rows,
+        'data_mb': data_mb,
+        'data_seconds': data_seconds,
+        'seconds': seconds,
+        'peak_rss_mb': _get_peak_rss_mb(),
+        'peak_rss_increase_mb': _get_peak_rss_mb() - peak_rss_before_mb,
+        'peak_anon_rss_mb': peak_anon_rss_mb[0],
+    }
+
+
+def _get_anon_rss_mb() -> Optional[float]:
+    """RSS of the process not backed by files, None without /proc"""
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('RssAnon:')) / 2**10
+    except (OSError, StopIteration):
+        return None
+
+
+def _get_peak_rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:')) / 2**10
+    except (OSError, StopIteration):
+        import resource
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak_rss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def _make_ts_data(rng: np.random.Generator, n_locations: int, n_days: int) -> pd.DataFrame:
+    """Hourly rides of `n_locations` locations over `n_days` days, as in the
+    feature group"""
+    pickup_hours = pd.date_range('2024-01-01', periods=24 * n_days, freq='H', tz='UTC')
+    ts_data = pd.DataFrame({
+        'pickup_hour': np.tile(pickup_hours, n_locations),
+        'rides': rng.poisson(5, len(pickup_hours) * n_locations).astype(np.int32),
+        'pickup_location_id': np.repeat(np.arange(1, n_locations + 1), len(pickup_hours)),
+    })
+    ts_data['pickup_ts'] = ts_data['pickup_hour'].astype('int64') // 10**6
+    return ts_data
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--n_locations', type=int, default=265)
+    parser.add_argument('--n_days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--run', choices=MODES, help='Run a single mode and print its results')
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run(args.run, args.n_locations, args.n_days, args.seed)))
+    else:
+        results = benchmark(args.n_locations, args.n_days, args.seed)
+        print(results.to_string(index=False, float_format='{:,.1f}'.format))
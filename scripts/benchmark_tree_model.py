@@ -0,0 +1,118 @@
+"""
+Compares the pickled sklearn pipeline with its export to `src.tree_model`:
+
+- cold start: a fresh Python process importing what it needs and loading the
+  model from disk
+- per-batch latency: predicting one batch of features, one row per location
+
+    python scripts/benchmark_tree_model.py --n_estimators 100 --num_leaves 64
+"""
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src import config
+from src.model import get_pipeline
+from src.paths import PARENT_DIR
+from src.tree_model import TreeModel, export_pipeline
+
+N_LOCATIONS = 265
+
+# run in a fresh interpreter, prints the seconds it took to import and load.
+# numpy and pandas are imported by the inference pipeline anyway, so they are
+# left out of the timing
+COLD_START_PICKLE = '''
+import numpy, pandas
+import time; start = time.perf_counter()
+import pickle
+with open({path!r}, 'rb') as f:
+    model = pickle.load(f)
+print(time.perf_counter() - start)
+'''
+COLD_START_TREE_MODEL = '''
+import numpy, pandas
+import time; start = time.perf_counter()
+from src.tree_model import TreeModel
+model = TreeModel.load({path!r})
+print(time.perf_counter() - start)
+'''
+
+
+def benchmark(n_estimators: int, num_leaves: int, n_runs: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    features = _make_features(rng, n_rows=20 * N_LOCATIONS)
+    target = 0.5 * features['rides_previous_1_hour'] + 0.5 * features['rides_previous_168_hour'] \
+        + rng.normal(0, 1, len(features))
+    pipeline = get_pipeline(n_estimators=n_estimators, num_leaves=num_leaves, verbose=-1)
+    pipeline.fit(features, target)
+
+    batch = _make_features(rng, n_rows=N_LOCATIONS)
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        pickle_file = Path(model_dir) / 'model.pkl'
+        with open(pickle_file, 'wb') as f:
+            pickle.dump(pipeline, f)
+        tree_model_file = Path(model_dir) / 'model.npz'
+        export_pipeline(pipeline, tree_model_file, validation_features=batch)
+
+        results = []
+        for name, model, cold_start_code, model_file in [
+            ('pickled pipeline', pipeline, COLD_START_PICKLE, pickle_file),
+            ('tree model', TreeModel.load(tree_model_file), COLD_START_TREE_MODEL, tree_model_file),
+        ]:
+            cold_start_seconds = [
+                _run_cold_start(cold_start_code.format(path=str(model_file))) for _ in range(n_runs)
+            ]
+            batch_seconds = []
+            for _ in range(n_runs):
+                start = time.perf_counter()
+                model.predict(batch)
+                batch_seconds.append(time.perf_counter() - start)
+
+            results.append({
+                'model': name,
+                'file_kb': model_file.stat().st_size / 2**10,
+                'cold_start_ms': 1000 * np.median(cold_start_seconds),
+                'batch_p50_ms': 1000 * np.percentile(batch_seconds, 50),
+                'batch_p99_ms': 1000 * np.percentile(batch_seconds, 99),
+            })
+
+    return pd.DataFrame(results)
+
+
+def _run_cold_start(code: str) -> float:
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=PARENT_DIR, capture_output=True, text=True, check=True,
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def _make_features(rng: np.random.Generator, n_rows: int) -> pd.DataFrame:
+    features = pd.DataFrame(
+        rng.poisson(5, (n_rows, config.N_FEATURES)).astype(np.float32),
+        columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(config.N_FEATURES))],
+    )
+    features['pickup_hour'] = pd.Timestamp('2024-01-01') \
+        + pd.to_timedelta(rng.integers(0, 24 * 28, n_rows), unit='h')
+    features['pickup_location_id'] = np.arange(n_rows) % N_LOCATIONS + 1
+    return features
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--n_estimators', type=int, default=100)
+    parser.add_argument('--num_leaves', type=int, default=64)
+    parser.add_argument('--n_runs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = benchmark(args.n_estimators, args.num_leaves, args.n_runs, args.seed)
+    print(results.to_string(index=False, float_format='{:,.2f}'.format))
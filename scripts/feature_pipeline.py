@@ -1,24 +1,34 @@
+import atexit
+import json
 from datetime import datetime, timedelta
 from argparse import ArgumentParser
 from typing import Optional
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 from src import config
 
 from src.data import (
     fetch_ride_events_from_data_warehouse,
-    load_raw_data,
     transform_raw_data_into_ts_data,
     transform_ts_data_into_features_and_target,
 )
+from src.atomic_write import atomic_write
+from src.demand_cube import HourlyDemandCube
+from src.rolling_window import RollingWindow
 from src.feature_store_api import feature_group_insert, get_or_create_feature_group
+from src.paths import DATA_CACHE_DIR
 
+from src.instrumentation import write_metrics
 from src.logger import get_logger
 
 logger = get_logger()
 
+# last pickup_hour processed by the incremental feature pipeline
+WATERMARK_FILE = DATA_CACHE_DIR / 'feature_pipeline_watermark.json'
+
 
 def run(date: datetime):
     """_summary_
@@ -77,29 +87,9 @@ def _transform_raw_data_into_ts_data(current_date: datetime) -> pd.DataFrame:
     """
     from_date=(current_date - timedelta(days=config.CUTOFF_DATE))
     to_date=current_date
-
-    from_date_ = from_date - timedelta(days=config.PREVIOUS_YEAR)
-    to_date_ = to_date - timedelta(days=config.PREVIOUS_YEAR)
     logger.info(f'Fetching ride events from {from_date} to {to_date}')
-    
-    if (from_date_.year == to_date_.year) and (from_date_.month == to_date_.month):
-    # download 1 file of data only
-        rides = load_raw_data(year=from_date_.year, months=from_date_.month)
-        rides = rides[rides.pickup_datetime >= from_date_]
-        rides = rides[rides.pickup_datetime < to_date_]
 
-    else:
-        # download 2 files from website
-        rides = load_raw_data(year=from_date_.year, months=from_date_.month)
-        rides = rides[rides.pickup_datetime >= from_date_]
-        rides_2 = load_raw_data(year=to_date_.year, months=to_date_.month)
-        rides_2 = rides_2[rides_2.pickup_datetime < to_date_]
-        rides = pd.concat([rides, rides_2])
-
-    # shift the pickup_datetime back 1 year ahead, to simulate production data
-    # using its 7*52-days-ago value
-    rides['pickup_datetime'] += timedelta(days=config.PREVIOUS_YEAR)
-    rides.sort_values(by=['pickup_location_id', 'pickup_datetime'], inplace=True)
+    rides = fetch_ride_events_from_data_warehouse(from_date=from_date, to_date=to_date)
 
     # transform raw data into time-series data by aggregating rides per
     # pickup location and hour
@@ -120,6 +110,128 @@ def _transform_raw_data_into_ts_data(current_date: datetime) -> pd.DataFrame:
     return features
 
 
+def run_incremental(current_date: datetime):
+    """
+    Incremental version of `run`. It only fetches and aggregates the rides after
+    the watermark left by the previous run, plus `config.LATE_DATA_LOOKBACK_HOURS`
+    hours before it to pick up late rides, and upserts those hours into the
+    feature group. The first run, without a watermark, processes the whole
+    `config.CUTOFF_DATE` days window.
+    """
+    watermark = _load_watermark()
+    window_start = current_date - timedelta(days=config.CUTOFF_DATE)
+    if watermark is None:
+        logger.info('No watermark found, processing the whole window')
+        from_date = window_start
+    else:
+        logger.info(f'Last processed pickup_hour was {watermark}')
+        from_date = min(watermark + timedelta(hours=1), current_date) \
+            - timedelta(hours=config.LATE_DATA_LOOKBACK_HOURS)
+        from_date = max(from_date, window_start)
+    to_date = current_date
+
+    logger.info('Fetching raw data from data warehouse')
+    rides = fetch_ride_events_from_data_warehouse(from_date=from_date, to_date=to_date)
+    if rides.empty:
+        logger.info(f'No rides found from {from_date} to {to_date}, keeping the watermark')
+        return
+
+    # transform raw data into time-series data by aggregating rides per
+    # pickup location and hour, with 0s for every hour of the window without rides
+    logger.info('Transforming raw data into time-series data')
+    ts_data = transform_raw_data_into_ts_data(rides)
+    new_ts_data = HourlyDemandCube.from_ts_data(ts_data, from_hour=from_date, to_hour=to_date)
+
+    ts_store = None
+    if config.SAVE_FEATURE_GROUP == 'local':
+        # upsert the new hours into the local time-series data, keeping only
+        # the window the model needs
+        if HourlyDemandCube.exists(config.TS_DATA_CUBE):
+            ts_store = HourlyDemandCube.load(config.TS_DATA_CUBE, mmap_mode=None)
+            ts_store = ts_store.upsert(new_ts_data, max_hours=config.CUTOFF_DATE * 24)
+        else:
+            ts_store = new_ts_data
+        ts_store.save(config.TS_DATA_CUBE)
+        logger.info(f'Upserted {new_ts_data.n_hours} hours into the local time-series data')
+
+        # the inference pipeline only needs the features for `current_date`
+        features = _get_batch_of_features(ts_store, current_date)
+        if features is None:
+            logger.info(f'Not enough history yet to generate features for {current_date}')
+        else:
+            feature_group_insert(features)
+    elif config.SAVE_FEATURE_GROUP == 'feature_store':
+        # add new column with the timestamp in Unix seconds
+        ts_data = new_ts_data.to_ts_data()
+        ts_data['pickup_hour'] = pd.to_datetime(ts_data['pickup_hour'], utc=True)
+        ts_data['pickup_ts'] = ts_data['pickup_hour'].astype(int) // 10**6
+
+        # the feature group primary key is (pickup_location_id, pickup_ts), so
+        # re-processed hours are updated instead of duplicated
+        logger.info(f'Upserting {new_ts_data.n_hours} hours into the feature group...')
+        feature_group = get_or_create_feature_group(config.FEATURE_GROUP_METADATA)
+        feature_group.insert(ts_data, write_options={"wait_for_job": False})
+        logger.info('Finished job to insert data into feature group')
+    else:
+        logger.info("Create an .env file on the project root with the SAVE_FEATURE_GROUP. Values accepted: 'local' or 'feature_store'.")
+        return
+
+    # move the rolling window the inference pipeline reads forward
+    _update_rolling_window(new_ts_data, ts_store)
+
+    last_processed_hour = to_date - timedelta(hours=1)
+    _save_watermark(last_processed_hour if watermark is None else max(watermark, last_processed_hour))
+
+
+def _get_batch_of_features(
+    ts_store: HourlyDemandCube,
+    current_date: datetime,
+) -> Optional[pd.DataFrame]:
+    """Features for `current_date`, one row per location, or `None` if
+    `ts_store` holds less than `config.N_FEATURES` hours before it"""
+    window = ts_store.slice_hours(current_date - timedelta(hours=config.N_FEATURES), current_date)
+    if window.n_hours < config.N_FEATURES:
+        return None
+
+    features = pd.DataFrame(
+        window.rides.astype(np.float32),
+        columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(config.N_FEATURES))]
+    )
+    features['pickup_hour'] = current_date
+    features['pickup_location_id'] = window.location_ids
+
+    return features
+
+
+def _update_rolling_window(
+    new_ts_data: HourlyDemandCube,
+    ts_store: Optional[HourlyDemandCube] = None,
+) -> None:
+    """Writes the new hours into the rolling window of the last
+    `config.N_FEATURES` hours, creating it from `ts_store` if given, or
+    `new_ts_data`, the first time"""
+    if RollingWindow.exists(config.ROLLING_WINDOW):
+        window = RollingWindow.load(config.ROLLING_WINDOW).update(new_ts_data)
+    else:
+        window = RollingWindow.from_cube(ts_store or new_ts_data, n_hours=config.N_FEATURES)
+    window.save(config.ROLLING_WINDOW)
+    logger.info(f'Rolling window now ends at {window.hour_end}')
+
+
+def _load_watermark() -> Optional[pd.Timestamp]:
+    """Last pickup_hour processed by `run_incremental`, if any"""
+    if not WATERMARK_FILE.exists():
+        return None
+    with open(WATERMARK_FILE) as f:
+        return pd.Timestamp(json.load(f)['last_processed_hour'])
+
+
+def _save_watermark(last_processed_hour: pd.Timestamp) -> None:
+    # replaced at once, so a run killed while writing never leaves a truncated file
+    with atomic_write(WATERMARK_FILE, 'w') as f:
+        json.dump({'last_processed_hour': pd.Timestamp(last_processed_hour).isoformat()}, f)
+
+
 if __name__ == '__main__':
     # TODO: try out different dates from command line
     # parse command line arguments
@@ -127,6 +239,9 @@ if __name__ == '__main__':
     parser.add_argument('--datetime',
                         type=lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S'),
                         help='Datetime argument in the format of YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='Process only the hours after the last run, see `run_incremental`')
     args = parser.parse_args()
 
     # if args.datetime was provided, use it as the current_date, otherwise
@@ -137,6 +252,12 @@ if __name__ == '__main__':
         current_date = pd.to_datetime(datetime.utcnow()).floor('H')
     
     logger.info(f'Running feature pipeline for {current_date=}')
+
+    # also records the stages of failed runs
+    atexit.register(write_metrics, 'feature_pipeline')
     # current_date = pd.to_datetime(datetime.strptime('2023-09-03 00:00:00', '%Y-%m-%d %H:%M:%S')).floor('H')
     
-    run(current_date)
+    if args.incremental:
+        run_incremental(current_date)
+    else:
+        run(current_date)
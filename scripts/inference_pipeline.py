@@ -1,4 +1,7 @@
-from typing import Optional
+import atexit
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 from datetime import datetime
 from argparse import ArgumentParser
 
@@ -9,16 +12,24 @@ from src import config
 
 from src.inference import (
     load_batch_of_features_from_store,
+    load_batches_of_features_from_store,
     get_model_predictions
 )
 from src.feature_store_api import get_or_create_feature_group
 from src.model_registry_api import get_latest_model_from_registry
+from src.instrumentation import instrumented, write_metrics
 from src.logger import get_logger
 from src.config import FEATURE_GROUP_PREDICTIONS_METADATA, MODEL_NAME
-from src.paths import DATA_CACHE_DIR
+from src.predictions_store import save_predictions
 
 logger = get_logger()
 
+# predictions are saved in the background by a single thread, so writes keep
+# their order and the pipeline does not wait for them
+_predictions_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='predictions-writer')
+_pending_writes: List[Future] = []
+
+@instrumented('save_predictions')
 @retry(RestAPIError, tries=3, delay=60)
 def save_predictions_to_feature_store(predictions: pd.DataFrame) -> None:
     """
@@ -28,9 +39,7 @@ def save_predictions_to_feature_store(predictions: pd.DataFrame) -> None:
     of too many concurrent jobs.
     """
     if config.SAVE_FEATURE_GROUP == 'local':
-        local_file = DATA_CACHE_DIR / 'predictions.parquet'
-        predictions.to_parquet(local_file)
-        logger.info(f'Saved predictions to local file at {local_file}')
+        save_predictions(predictions)
     elif config.SAVE_FEATURE_GROUP == 'feature_store':
         logger.info('Getting pointer to the feature group for model predictions')
         feature_group = get_or_create_feature_group(FEATURE_GROUP_PREDICTIONS_METADATA)
@@ -45,35 +54,132 @@ def save_predictions_to_feature_store(predictions: pd.DataFrame) -> None:
             raise e
         
 
+def save_predictions_in_background(predictions: pd.DataFrame) -> Future:
+    """Queues `predictions` to be saved by `save_predictions_to_feature_store`
+    and returns right away. The future's result is the seconds the write took.
+    Call `flush_predictions` to wait for the writes"""
+    def save() -> float:
+        start = time.perf_counter()
+        save_predictions_to_feature_store(predictions)
+        seconds = time.perf_counter() - start
+        logger.info(f'Saved {len(predictions)} predictions in {seconds:.1f} seconds')
+        return seconds
+
+    future = _predictions_writer.submit(save)
+    _pending_writes.append(future)
+    return future
+
+
+def flush_predictions() -> List[float]:
+    """Waits for the queued predictions to be saved and returns the seconds
+    each write took. Raises the first error of a failed write"""
+    seconds, errors = [], []
+    while _pending_writes:
+        future = _pending_writes.pop(0)
+        error = future.exception()
+        if error is not None:
+            logger.error(f'Failed to save predictions: {error!r}')
+            errors.append(error)
+        else:
+            seconds.append(future.result())
+    if errors:
+        raise errors[0]
+    return seconds
+
+
 def _load_batch_of_features_from_store():
     pass 
 
 
+def _load_features_and_model(
+    load_features: Callable[[], pd.DataFrame],
+    timings: Dict[str, float],
+) -> Tuple[pd.DataFrame, object]:
+    """Loads the features and the production model at the same time, as both
+    wait on the network most of the time"""
+    def timed(stage: str, load: Callable):
+        start = time.perf_counter()
+        result = load()
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix='inference-load') as executor:
+        features = executor.submit(timed, 'load_features', load_features)
+        model = executor.submit(
+            timed, 'load_model',
+            lambda: get_latest_model_from_registry(model_name=MODEL_NAME, status='Production')
+        )
+        features, model = features.result(), model.result()
+    timings['load'] = time.perf_counter() - start
+
+    return features, model
+
+
+def _log_timings(timings: Dict[str, float]) -> None:
+    logger.info('Stage timings: ' + ', '.join(
+        f'{stage}={1000 * seconds:,.0f}ms' for stage, seconds in timings.items()
+    ))
+
+
 def inference(
     current_date: Optional[pd.Timestamp] = pd.to_datetime(datetime.utcnow()).floor('H'),
-) -> None:
-    """"""
+) -> Dict[str, float]:
+    """Predicts the demand at `current_date` and queues the predictions to be
+    saved. Returns the seconds each stage took"""
     logger.info(f'Running inference pipeline for {current_date}')
-    
+    timings: Dict[str, float] = {}
 
-    features = load_batch_of_features_from_store(current_date)
-
-    model = get_latest_model_from_registry(
-        model_name=MODEL_NAME,
-        status='Production'
+    features, model = _load_features_and_model(
+        lambda: load_batch_of_features_from_store(current_date), timings
     )
 
     logger.info('Generating predictions')
+    start = time.perf_counter()
     predictions = get_model_predictions(model, features)
+    timings['predict'] = time.perf_counter() - start
     
     # add `pickup_hour` and `pickup_ts` columns
     predictions['pickup_hour'] = current_date
     predictions['pickup_ts'] = predictions['pickup_hour'].astype(int) // 10**6
 
-    logger.info('Saving predictions to the feature store')
-    save_predictions_to_feature_store(predictions)
+    save_predictions_in_background(predictions)
+    logger.info('Queued predictions to be saved to the feature store')
 
     logger.info('Inference DONE!')
+    return timings
+
+
+def inference_range(
+    from_date: pd.Timestamp,
+    to_date: pd.Timestamp,
+) -> Dict[str, float]:
+    """
+    Backfills the predictions for every hour in [`from_date`, `to_date`), with
+    one feature load, one call to the model and one write to the feature store
+    """
+    logger.info(f'Running inference pipeline from {from_date} to {to_date}')
+    timings: Dict[str, float] = {}
+
+    features, model = _load_features_and_model(
+        lambda: load_batches_of_features_from_store(from_date, to_date), timings
+    )
+
+    logger.info(f'Generating predictions for {len(features)} (hour, location) pairs')
+    start = time.perf_counter()
+    predictions = get_model_predictions(model, features)
+    timings['predict'] = time.perf_counter() - start
+
+    # add `pickup_hour` and `pickup_ts` columns
+    predictions['pickup_hour'] = features['pickup_hour'].values
+    predictions['pickup_ts'] = predictions['pickup_hour'].astype(int) // 10**6
+
+    save_predictions_in_background(predictions)
+    logger.info('Queued predictions to be saved to the feature store')
+
+    logger.info('Inference DONE!')
+    return timings
+
 
 if __name__ == '__main__':
 
@@ -82,13 +188,53 @@ if __name__ == '__main__':
     parser.add_argument('--datetime',
                         type=lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S'),
                         help='Datetime argument in the format of YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--from',
+                        dest='from_date',
+                        type=lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S'),
+                        help='First hour to predict in a backfill, in the format of YYYY-MM-DD HH:MM:SS')
+    parser.add_argument('--to',
+                        dest='to_date',
+                        type=lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S'),
+                        help='Hour right after the last one to predict in a backfill, in the format of YYYY-MM-DD HH:MM:SS')
     args = parser.parse_args()
-    
-    if args.datetime:
-        current_date = pd.to_datetime(args.datetime)
-    else:
-        current_date = pd.to_datetime(datetime.utcnow()).floor('H')
 
-    # current_date = pd.to_datetime(datetime.strptime('2023-09-03 00:00:00', '%Y-%m-%d %H:%M:%S')).floor('H')
+    if (args.from_date is None) != (args.to_date is None):
+        parser.error('--from and --to must be given together')
+    # compared as the hours they are floored to, to backfill at least one
+    if args.from_date is not None and \
+            pd.to_datetime(args.from_date).floor('H') >= pd.to_datetime(args.to_date).floor('H'):
+        parser.error('--from must be before --to')
+
+    # also records the stages of failed runs
+    atexit.register(write_metrics, 'inference_pipeline')
     
-    inference(current_date)
\ No newline at end of file
+    try:
+        if args.from_date is not None:
+            timings = inference_range(pd.to_datetime(args.from_date).floor('H'), pd.to_datetime(args.to_date).floor('H'))
+        else:
+            if args.datetime:
+                current_date = pd.to_datetime(args.datetime)
+            else:
+                current_date = pd.to_datetime(datetime.utcnow()).floor('H')
+
+            # current_date = pd.to_datetime(datetime.strptime('2023-09-03 00:00:00', '%Y-%m-%d %H:%M:%S')).floor('H')
+
+            timings = inference(current_date)
+    except BaseException:
+        # the queued writes still finish, but an error of theirs must not
+        # replace the one of the run
+        try:
+            flush_predictions()
+        except Exception:
+            logger.exception('Failed to save the predictions of the failed run')
+        raise
+
+    # here rather than at exit, where handlers run in reverse order and
+    # `write_metrics` would run before the writes it measures are done
+    start = time.perf_counter()
+    save_seconds = flush_predictions()
+    wait_for_save_seconds = time.perf_counter() - start
+
+    timings['save'] = sum(save_seconds)
+    timings['wait_for_save'] = wait_for_save_seconds
+    _log_timings(timings)
\ No newline at end of file
@@ -0,0 +1,39 @@
+"""
+Serves the predictions of the production model over HTTP, see
+`src.prediction_server`.
+
+    python scripts/prediction_server.py --port 8000
+    curl 'localhost:8000/predict?location_id=43,48'
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+
+import pandas as pd
+
+from src.prediction_server import PredictionService, serve, start_reloading
+from src.logger import get_logger
+
+logger = get_logger()
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser()
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--reload_interval', type=float, default=60,
+                        help='Seconds between checks for new features and model versions')
+    parser.add_argument('--max_hours', type=int, default=24,
+                        help='Number of hours of predictions kept in memory')
+    args = parser.parse_args()
+
+    service = PredictionService(max_hours=args.max_hours)
+    service.refresh(pd.Timestamp(datetime.utcnow()))
+    start_reloading(service, args.reload_interval)
+
+    server = serve(service, args.host, args.port)
+    logger.info(f'Serving predictions on {args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
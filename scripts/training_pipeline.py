@@ -1,25 +1,25 @@
+import atexit
 import os
+import tempfile
 from datetime import date, timedelta
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Union
 from pathlib import Path
 
 from comet_ml import Experiment
 from dotenv import load_dotenv
 import pandas as pd
-import numpy as np
-from sklearn.model_selection import TimeSeriesSplit
 from sklearn.metrics import mean_absolute_error
-import optuna
 
-from src.data import transform_ts_data_into_features_and_target
 from src import config
 from src.paths import PARENT_DIR, DATA_CACHE_DIR
-from src.config import FEATURE_VIEW_METADATA, N_HYPERPARAMETER_SEARCH_TRIALS
-from src.data_split import train_test_split
+from src.config import FEATURE_VIEW_METADATA, N_HYPERPARAMETER_SEARCH_TRIALS, N_HYPERPARAMETER_SEARCH_WORKERS
 from src.feature_store_api import get_or_create_feature_view
 from src.model_registry_api import push_model_to_registry
 from src.model import get_pipeline
+from src.hyperparameter_search import find_best_hyperparameters
+from src.training_matrix import TrainingMatrix, TrainingShards, fit_pipeline, predict_pipeline
 # from src.discord import send_message_to_channel
+from src.instrumentation import write_metrics
 from src.logger import get_logger
 
 logger = get_logger()
@@ -27,14 +27,19 @@ logger = get_logger()
 # load variables from .env file as environment variables
 load_dotenv(PARENT_DIR / '.env')
 
+# test rows the model exported to the registry is checked against
+N_VALIDATION_ROWS = 10_000
+
+
 def fetch_features_and_targets_from_store(
     from_date: pd.Timestamp,
     to_date: pd.Timestamp,
     step_size: int,
-) -> pd.DataFrame:
+    shards_dir: Optional[Path] = None,
+) -> Union[TrainingMatrix, TrainingShards]:
     """
     Fetches time-series data from the store, transforms it into features and
-    targets and returns it as a pandas DataFrame.
+    targets and returns them, see `transform_ts_data_into_training_data`.
     """
     # get pointer to featurew view
     logger.info('Getting pointer to feature view...')
@@ -59,91 +64,51 @@ def fetch_features_and_targets_from_store(
 
     # transform time-series data from the feature store into features and targets
     # for supervised learning
-    features, targets = transform_ts_data_into_features_and_target(
+    return transform_ts_data_into_training_data(ts_data, step_size, shards_dir)
+
+
+def transform_ts_data_into_training_data(
+    ts_data: pd.DataFrame,
+    step_size: int,
+    shards_dir: Optional[Path] = None,
+) -> Union[TrainingMatrix, TrainingShards]:
+    """
+    Features and targets of `ts_data`, in memory, or written to shards in
+    `shards_dir` a chunk of rows at a time, for histories whose features do
+    not fit in memory.
+    """
+    if shards_dir is not None:
+        logger.info(f'Writing features and targets to shards at {shards_dir}')
+        return TrainingShards.write(
+            ts_data,
+            n_features=config.N_FEATURES, # one month
+            step_size=step_size,
+            directory=shards_dir,
+        )
+
+    return TrainingMatrix.from_ts_data(
         ts_data,
         n_features=config.N_FEATURES, # one month
         step_size=step_size,
     )
-    
-    features_and_target = features.copy()
-    features_and_target['target_rides_next_hour'] = targets
-
-    return features_and_target
 
 
 def split_data(
-    features_and_target: pd.DataFrame,
+    training_data: Union[TrainingMatrix, TrainingShards],
     cutoff_date: pd.Timestamp,
-) -> Tuple[pd.DataFrame, pd.Series, pd.DataFrame, pd.Series]:
-    
-    X_train, y_train, X_test, y_test = train_test_split(
-        features_and_target,
-        cutoff_date,
-        target_column_name='target_rides_next_hour'   
-    )
-    logger.info(f'{X_train.shape=}')
-    logger.info(f'{y_train.shape=}')
-    logger.info(f'{X_test.shape=}')
-    logger.info(f'{y_test.shape=}')
-    
-    return X_train, y_train, X_test, y_test
-
-
-def find_best_hyperparameters(
-    X_train: pd.DataFrame,
-    y_train: pd.Series,
-    n_trials: Optional[int] = 10,    
-) -> dict:
-    """"""
-    
-    def objective(trial: optuna.trial.Trial) -> float:
-        """
-        Given a set of hyper-parameters, it trains a model and computes an average
-        validation error based on a TimeSeriesSplit
-        """
-        # pick hyper-parameters
-        hyperparams = {
-            "metric": 'mae',
-            "verbose": -1,
-            "num_leaves": trial.suggest_int("num_leaves", 2, 256),
-            "feature_fraction": trial.suggest_float("feature_fraction", 0.2, 1.0),
-            "bagging_fraction": trial.suggest_float("bagging_fraction", 0.2, 1.0),
-            "min_child_samples": trial.suggest_int("min_child_samples", 3, 100),   
-        }
-        
-        tss = TimeSeriesSplit(n_splits=2)
-        scores = []
-        for train_index, val_index in tss.split(X_train):
-
-            # split data for training and validation
-            X_train_, X_val_ = X_train.iloc[train_index, :].copy(), X_train.iloc[val_index,:].copy()
-            y_train_, y_val_ = y_train.iloc[train_index].copy(), y_train.iloc[val_index].copy()
-            
-            # train the model
-            pipeline = get_pipeline(**hyperparams)
-            pipeline.fit(X_train_, y_train_)
-            
-            # evaluate the model
-            y_pred = pipeline.predict(X_val_)
-            mae = mean_absolute_error(y_val_, y_pred)
-
-            scores.append(mae)
+) -> Tuple[Union[TrainingMatrix, TrainingShards], Union[TrainingMatrix, TrainingShards]]:
+    """Rows before and from `cutoff_date`, as views of `training_data`"""
+    train_data, test_data = training_data.split_by_date(cutoff_date)
+    logger.info(f'{train_data.shape=}')
+    logger.info(f'{test_data.shape=}')
     
-        # Return the mean score
-        return np.array(scores).mean()
-
-    study = optuna.create_study(direction="minimize")
-    study.optimize(objective, n_trials=n_trials)
-
-    best_params = study.best_trial.params
-    logger.info(f'{best_params=}')
-
-    return best_params
+    return train_data, test_data
 
 
 def load_features_and_target(
     local_path_features_and_target: Optional[Path] = None,
-) -> pd.DataFrame:
+    shards_dir: Optional[Path] = None,
+) -> Union[TrainingMatrix, TrainingShards]:
     
     if local_path_features_and_target:
         logger.info('Loading features_and_target from local file')
@@ -152,25 +117,26 @@ def load_features_and_target(
         # transform time-series data from the feature store into features and targets
         # for supervised learning
         # ts_data.drop('pickup_ts', axis=1, inplace=True)
-        features, targets = transform_ts_data_into_features_and_target(
-            feature_group,
-            n_features=config.N_FEATURES, # one month
-            step_size=config.STEP_SIZE,
+        features_and_target = transform_ts_data_into_training_data(
+            feature_group, step_size=config.STEP_SIZE, shards_dir=shards_dir,
         )
-        
-        features_and_target = features.copy()
-        features_and_target['target_rides_next_hour'] = targets
     else:
         logger.info('Fetching features and targets from the feature store')
         from_date = pd.to_datetime(date.today() - timedelta(days=52*7))
         to_date = pd.to_datetime(date.today())
-        features_and_target = fetch_features_and_targets_from_store(from_date,to_date, step_size=config.STEP_SIZE)
+        features_and_target = fetch_features_and_targets_from_store(
+            from_date,to_date, step_size=config.STEP_SIZE, shards_dir=shards_dir,
+        )
 
-    # save features_and_target to local file
+    if shards_dir is not None:
+        # already saved as shards
+        return features_and_target
+
+    # save features_and_target to local .npy files
     try:
-        local_file = DATA_CACHE_DIR / 'features_and_target.parquet'
-        features_and_target.to_parquet(local_file)
-        logger.info(f'Saved features_and_target with shape={features_and_target.shape} to local file at {local_file}')
+        local_dir = DATA_CACHE_DIR / 'training_matrix'
+        features_and_target.save(local_dir)
+        logger.info(f'Saved features_and_target with shape={features_and_target.X.shape} to local files at {local_dir}')
     except:
         logger.info('Could not save features_and_target to local file')
         pass
@@ -180,11 +146,31 @@ def load_features_and_target(
 
 def train(
     local_path_features_and_target: Optional[Path] = None,
+    streaming: Optional[bool] = False,
 ) -> None:
     """
     Trains model and pushes it to the model registry if it meets the minimum
     performance threshold.
+
+    With `streaming`, the features are written to shards on disk and the model
+    is trained from them, with about one shard of them in memory at a time,
+    see `src.training_matrix.TrainingShards`.
     """
+    if not streaming:
+        return _train(local_path_features_and_target)
+
+    # one directory per run, so concurrent runs never touch each other's
+    # shards, and removed with them once the run is over
+    with tempfile.TemporaryDirectory(prefix='training_shards_', dir=DATA_CACHE_DIR) as shards_dir:
+        return _train(local_path_features_and_target, Path(shards_dir))
+
+
+def _train(
+    local_path_features_and_target: Optional[Path] = None,
+    shards_dir: Optional[Path] = None,
+) -> None:
+    """`train`, with the features in shards in `shards_dir` if given"""
+    streaming = shards_dir is not None
     # local_path_features_and_target = 'data/cache/feature_group copy.parquet'
     logger.info('Start model training...')
     logger.info(f'Local path {local_path_features_and_target}...')
@@ -198,37 +184,44 @@ def train(
     )
 
     # load features and targets
-    features_and_target = load_features_and_target(local_path_features_and_target)
-    experiment.log_dataset_hash(features_and_target)
+    features_and_target = load_features_and_target(local_path_features_and_target, shards_dir)
+    # the target only, if hashing the features would read all shards into memory
+    experiment.log_dataset_hash(features_and_target.y if streaming else features_and_target.X)
+    experiment.log_parameter('streaming', streaming)
 
     # split the data into training and validation sets
     cutoff_date = pd.to_datetime(date.today() - timedelta(days=config.CUTOFF_DATE), utc=True)
     logger.info(f'Splitting data into training and test sets with {cutoff_date=}')
-    X_train, y_train, X_test, y_test = split_data(
+    train_data, test_data = split_data(
         features_and_target,
         cutoff_date=cutoff_date
     )
     experiment.log_parameters({
-        'X_train_shape': X_train.shape,
-        'y_train_shape': y_train.shape,
-        'X_test_shape': X_test.shape,
-        'y_test_shape': y_test.shape,
+        'X_train_shape': train_data.shape,
+        'y_train_shape': train_data.y.shape,
+        'X_test_shape': test_data.shape,
+        'y_test_shape': test_data.y.shape,
     })
     
     # find the best hyperparameters using time-based cross-validation
     logger.info('Finding best hyperparameters...')
-    best_hyperparameters = find_best_hyperparameters(X_train, y_train, n_trials=N_HYPERPARAMETER_SEARCH_TRIALS)
+    best_hyperparameters = find_best_hyperparameters(
+        train_data,
+        n_trials=N_HYPERPARAMETER_SEARCH_TRIALS,
+        n_workers=N_HYPERPARAMETER_SEARCH_WORKERS,
+    )
     experiment.log_parameters(best_hyperparameters)
     experiment.log_parameter('N_HYPERPARAMETER_SEARCH_TRIALS', N_HYPERPARAMETER_SEARCH_TRIALS)
+    experiment.log_parameter('HYPERPARAMETER_SEARCH_PRUNER', config.HYPERPARAMETER_SEARCH_PRUNER)
 
-    # train the model using the best hyperparameters
+    # train the model using the best hyperparameters, including the number of
+    # boosting rounds early stopping found
     logger.info('Training model using the best hyperparameters...')
-    pipeline = get_pipeline(**best_hyperparameters)
-    pipeline.fit(X_train, y_train)
+    pipeline = fit_pipeline(get_pipeline(**best_hyperparameters), train_data)
 
-    # evalute the model on test data
-    predictions = pipeline.predict(X_test)
-    test_mae = mean_absolute_error(y_test, predictions)
+    # evalute the model on test data, which already has the engineered features
+    predictions = predict_pipeline(pipeline, test_data)
+    test_mae = mean_absolute_error(test_data.y, predictions)
     logger.info(f'{test_mae=:.4f}')
     experiment.log_metric('test_mae', test_mae)
 
@@ -239,6 +232,7 @@ def train(
         model_version = push_model_to_registry(
             pipeline,
             model_name=config.MODEL_NAME,
+            validation_features=test_data.to_frame(slice(0, N_VALIDATION_ROWS)),
         )
         logger.info(f'Model version {model_version} pushed to the model registry.')
 
@@ -255,4 +249,7 @@ def train(
 if __name__ == '__main__':
 
     from fire import Fire
+
+    # also records the stages of failed runs
+    atexit.register(write_metrics, 'training_pipeline')
     Fire(train)
\ No newline at end of file
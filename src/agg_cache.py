@@ -0,0 +1,88 @@
+"""
+Cache of the hourly aggregates (pickup_hour, pickup_location_id, rides) of
+each raw monthly file, stored in DATA_CACHE_DIR.
+
+Every entry records the size, modification time and SHA-256 of the raw file it
+was computed from, and is ignored as soon as the raw file changes.
+"""
+import hashlib
+import json
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from src.atomic_write import atomic_write
+from src.paths import DATA_CACHE_DIR
+from src.logger import get_logger
+
+logger = get_logger()
+
+AGG_CACHE_DIR = DATA_CACHE_DIR / 'agg_rides'
+
+# bump it whenever the format of the cached aggregates changes
+CACHE_VERSION = 1
+
+
+def load_cached_aggregate(raw_file: Path) -> Optional[pd.DataFrame]:
+    """Returns the cached aggregate of `raw_file`, or `None` if there is no
+    entry for it or the file changed since the entry was saved"""
+    agg_file, metadata_file = _get_cache_files(raw_file)
+    if not (agg_file.exists() and metadata_file.exists()):
+        return None
+
+    with open(metadata_file) as f:
+        metadata = json.load(f)
+
+    stat = raw_file.stat()
+    if metadata.get('version') != CACHE_VERSION or metadata['size'] != stat.st_size:
+        return None
+
+    if metadata['mtime_ns'] != stat.st_mtime_ns:
+        # same size but touched, e.g. downloaded again. Only the content hash
+        # can tell whether it really changed
+        if metadata['sha256'] != _sha256(raw_file):
+            return None
+        metadata['mtime_ns'] = stat.st_mtime_ns
+        with atomic_write(metadata_file, 'w') as f:
+            json.dump(metadata, f)
+
+    return pd.read_parquet(agg_file)
+
+
+def save_aggregate(raw_file: Path, agg_rides: pd.DataFrame) -> None:
+    """Caches `agg_rides`, the hourly aggregate of `raw_file`"""
+    agg_file, metadata_file = _get_cache_files(raw_file)
+    AGG_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+
+    stat = raw_file.stat()
+    metadata = {
+        'version': CACHE_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': _sha256(raw_file),
+    }
+
+    # write the aggregate before its metadata, so a crash in between leaves
+    # an entry that does not validate instead of a wrong one
+    if metadata_file.exists():
+        metadata_file.unlink()
+    with atomic_write(agg_file) as f:
+        agg_rides.to_parquet(f, index=False)
+    with atomic_write(metadata_file, 'w') as f:
+        json.dump(metadata, f)
+
+    logger.info(f'Cached hourly aggregate of {raw_file.name} at {agg_file}')
+
+
+def _get_cache_files(raw_file: Path):
+    agg_file = AGG_CACHE_DIR / raw_file.name
+    return agg_file, agg_file.with_suffix('.json')
+
+
+def _sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
@@ -0,0 +1,28 @@
+"""
+Writes files so that readers see either their previous or their new content,
+never a partially written file.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator, Union
+
+
+@contextmanager
+def atomic_write(path: Union[str, Path], mode: str = 'wb') -> Iterator[IO]:
+    """Opens a temporary file next to `path`, which replaces `path` at once if
+    the block exits without an error, and is removed otherwise.
+
+    The temporary file is named after the process and thread, so concurrent
+    writers of the same `path` never write into each other's file. The last
+    one to finish wins.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -15,6 +15,9 @@ try:
 except:
     raise Exception('Create an .env file on the project root with the HOPSWORKS_API_KEY and HOPSWORKS_PROJECT_NAME')
 
+# engine used to read and aggregate raw data: 'pandas', 'arrow' or 'polars'
+DATA_BACKEND = os.environ.get('DATA_BACKEND', 'pandas')
+
 # TODO: get version dinamically
 FEATURE_GROUP_METADATA = FeatureGroupConfig(
     name='time_series_hourly_feature_group',
@@ -39,8 +42,24 @@ FEATURE_GROUP_PREDICTIONS_METADATA = FeatureGroupConfig(
     event_time='pickup_ts',
 )
 
-# number of iterations we want Optuna to pefrom to find the best hyperparameters
-N_HYPERPARAMETER_SEARCH_TRIALS = 1
+# number of iterations we want Optuna to pefrom to find the best hyperparameters.
+# Set the N_HYPERPARAMETER_SEARCH_TRIALS environment variable to run more, once
+# they are known to fit the time budget of the training job
+N_HYPERPARAMETER_SEARCH_TRIALS = int(os.environ.get('N_HYPERPARAMETER_SEARCH_TRIALS', 1))
+
+# Optuna pruner stopping unpromising trials early: 'median',
+# 'successive_halving' or 'none'
+HYPERPARAMETER_SEARCH_PRUNER = 'median'
+
+# boosting rounds of the hyperparameter search stop once the validation MAE
+# has not improved for EARLY_STOPPING_ROUNDS rounds, or after MAX_N_ESTIMATORS,
+# the 100 rounds of LightGBM's default, so no trial costs more than a full fit
+EARLY_STOPPING_ROUNDS = 20
+MAX_N_ESTIMATORS = 100
+
+# processes running the trials of the hyperparameter search in parallel.
+# 1 runs them one after the other, in the training process
+N_HYPERPARAMETER_SEARCH_WORKERS = 1
 
 # number of historical values our model needs to generate predictions
 N_FEATURES = 24 * 28
@@ -52,6 +71,38 @@ MODEL_NAME = "lightgbm_taxi_demand_predictor"
 
 STEP_SIZE = 23
 
+# rows per .npy shard the streaming training mode writes and trains from. The
+# training pipeline holds about one shard of raw features in memory at a time
+TRAINING_SHARD_SIZE = 20_000
+
+# rows LightGBM samples to bin the features in the streaming training mode,
+# instead of its default of 200,000. It holds the sample in memory, as float64
+STREAMING_SUBSAMPLE_FOR_BIN = 50_000
+
 CUTOFF_DATE = 120
 
-PREVIOUS_YEAR = 7*52
\ No newline at end of file
+PREVIOUS_YEAR = 7*52
+
+# hours before the watermark that the incremental feature pipeline re-processes,
+# to pick up rides that reach the data warehouse late
+LATE_DATA_LOOKBACK_HOURS = 3
+
+# name of the local time-series data kept by the incremental feature pipeline
+TS_DATA_CUBE = 'ts_data_cube'
+
+# file with the last N_FEATURES hours per location, moved forward by the
+# incremental feature pipeline and read by the inference pipeline
+ROLLING_WINDOW = 'rolling_window.npz'
+
+# monthly Parquet files with historical taxi rides from the NYC website
+RAW_DATA_URL = 'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{year}-{month:02d}.parquet'
+
+# maximum number of monthly files we download at the same time
+MAX_CONCURRENT_DOWNLOADS = 4
+
+# number of model versions kept in the local model cache
+MODEL_CACHE_SIZE = 3
+
+# seconds during which the latest model version looked up in the registry is
+# reused instead of asking the registry again
+MODEL_VERSION_TTL_SECONDS = 300
@@ -1,14 +1,18 @@
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Union
 # from pdb import set_trace as stop
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
-import requests
-from tqdm import tqdm
 
 from src.paths import RAW_DATA_DIR
+from src.demand_cube import HourlyDemandCube
+from src.data_backends import check_backend, read_raw_data_file, aggregate_rides, aggregate_raw_data_file
+from src.agg_cache import load_cached_aggregate, save_aggregate
+from src.download import download_file, download_files, FileNotAvailableError
+from src.instrumentation import instrumented
 import src.config as config
 
 
@@ -17,15 +21,46 @@ def download_one_file_of_raw_data(year: int, month: int) -> Path:
     Downloads Parquet file with historical taxi rides for the given `year` and
     `month`
     """
-    URL = f'https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{year}-{month:02d}.parquet'
-    response = requests.get(URL)
+    URL = config.RAW_DATA_URL.format(year=year, month=month)
+    path = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
+    return download_file(URL, path)
 
-    if response.status_code == 200:
-        path = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
-        open(path, "wb").write(response.content)
-        return path
-    else:
-        raise Exception(f'{URL} is not available')
+
+def download_raw_data(year: int, months: List[int]) -> List[int]:
+    """
+    Downloads concurrently the Parquet files for the given `year` and `months`
+    that are not in local storage yet, and returns the months whose file is
+    available locally
+
+    Months the NYC website does not publish are skipped. Any other download
+    error is raised once the retries are exhausted.
+    """
+    missing_months = []
+    for month in months:
+        if (RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet').exists():
+            print(f'File {year}-{month:02d} was already in local storage')
+        else:
+            print(f'Downloading file {year}-{month:02d}')
+            missing_months.append(month)
+
+    errors = download_files(
+        [(config.RAW_DATA_URL.format(year=year, month=month),
+          RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet')
+         for month in missing_months],
+        max_workers=config.MAX_CONCURRENT_DOWNLOADS,
+    )
+
+    available_months = []
+    for month in months:
+        error = errors.get(RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet')
+        if isinstance(error, FileNotAvailableError):
+            print(f'{year}-{month:02d} file is not available')
+        elif error is not None:
+            raise error
+        else:
+            available_months.append(month)
+
+    return available_months
 
 
 def validate_raw_data(
@@ -53,38 +88,76 @@ def fetch_ride_events_from_data_warehouse(
     This function is used to simulate production data by sampling historical data
     from 52 weeks ago (i.e. 1 year)
     """
-    # TODO: implement my own function here
-    
     from_date_ = from_date - timedelta(days=config.PREVIOUS_YEAR)
     to_date_ = to_date - timedelta(days=config.PREVIOUS_YEAR)
     print(f'Fetching ride events from {from_date} to {to_date}')
 
-    if (from_date_.year == to_date_.year) and (from_date_.month == to_date_.month):
-        # download 1 file of data only
-        rides = load_raw_data(year=from_date_.year, months=from_date_.month)
-        rides = rides[rides.pickup_datetime >= from_date_]
-        rides = rides[rides.pickup_datetime < to_date_]
-
-    else:
-        # download 2 files from website
-        rides = load_raw_data(year=from_date_.year, months=from_date_.month)
-        rides = rides[rides.pickup_datetime >= from_date_]
-        rides_2 = load_raw_data(year=to_date_.year, months=to_date_.month)
-        rides_2 = rides_2[rides_2.pickup_datetime < to_date_]
-        rides = pd.concat([rides, rides_2])
+    rides = load_raw_data_between(from_date_, to_date_)
 
     # shift the pickup_datetime back 1 year ahead, to simulate production data
-    # using its 7*52-days-ago value
-    rides['pickup_datetime'] += timedelta(days=config.PREVIOUS_YEAR)
+    # using its 7*52-days-ago value. Only this column is replaced.
+    rides['pickup_datetime'] = rides['pickup_datetime'] + pd.Timedelta(days=config.PREVIOUS_YEAR)
 
     rides.sort_values(by=['pickup_location_id', 'pickup_datetime'], inplace=True)
 
     return rides
 
 
+def load_raw_data_between(
+    from_date: datetime,
+    to_date: datetime,
+    backend: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Loads the rides with `from_date` <= pickup_datetime < `to_date`, whatever
+    number of months that window spans. Every monthly file is read at most once,
+    and only its row groups inside the window are decoded.
+
+    Returns:
+        pd.DataFrame: same columns as `load_raw_data`
+    """
+    from_date = _to_naive_timestamp(from_date)
+    to_date = _to_naive_timestamp(to_date)
+
+    # months overlapping [from_date, to_date), grouped by year
+    months = pd.period_range(from_date, to_date - pd.Timedelta(1, 'ns'), freq='M') \
+        if from_date < to_date else pd.PeriodIndex([], freq='M')
+
+    rides = []
+    for year in sorted(set(months.year)):
+        rides_one_year = load_raw_data(
+            year=year,
+            months=[month.month for month in months if month.year == year],
+            from_date=from_date,
+            to_date=to_date,
+            backend=backend,
+        )
+        if not rides_one_year.empty:
+            rides.append(rides_one_year)
+
+    if not rides:
+        # no data, but keep the columns so callers can still transform it
+        return pd.DataFrame({
+            'pickup_datetime': pd.Series(dtype='datetime64[ns]'),
+            'pickup_location_id': pd.Series(dtype='int64'),
+        })
+
+    return pd.concat(rides, ignore_index=True)
+
+
+def _to_naive_timestamp(date: datetime) -> pd.Timestamp:
+    """Raw files store naive timestamps, so tz-aware dates are moved to UTC first"""
+    date = pd.Timestamp(date)
+    return date.tz_convert(None) if date.tz is not None else date
+
+
+@instrumented('load_raw_data')
 def load_raw_data(
     year: int,
-    months: Optional[List[int]] = None
+    months: Optional[List[int]] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    backend: Optional[str] = None,
 ) -> pd.DataFrame:
     """
     Loads raw data from local storage or downloads it from the NYC website, and
@@ -93,15 +166,21 @@ def load_raw_data(
     Args:
         year: year of the data to download
         months: months of the data to download. If `None`, download all months
+        from_date: if given, load only rides with pickup_datetime >= `from_date`
+        to_date: if given, load only rides with pickup_datetime < `to_date`
+        backend: engine reading the files, see `src.data_backends`. If `None`,
+        use `config.DATA_BACKEND`
 
     Returns:
         pd.DataFrame: DataFrame with the following columns:
             - pickup_datetime: datetime of the pickup
             - pickup_location_id: ID of the pickup location
-    """  
-    # TODO: implement my own function here or read with polars
-    rides = pd.DataFrame()
-    
+    """
+    backend = backend or config.DATA_BACKEND
+    # before any file is downloaded
+    check_backend(backend)
+    rides = []
+
     if months is None:
         # download data for the entire year (all months)
         months = list(range(1, 13))
@@ -109,35 +188,34 @@ def load_raw_data(
         # download data only for the month specified by the int `month`
         months = [months]
 
+    # keep only rides for each month that are inside [from_date, to_date)
+    windows = {}
     for month in months:
-        
-        local_file = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
-        if not local_file.exists():
-            try:
-                # download the file from the NYC website
-                print(f'Downloading file {year}-{month:02d}')
-                download_one_file_of_raw_data(year, month)
-            except:
-                print(f'{year}-{month:02d} file is not available')
-                continue
-        else:
-            print(f'File {year}-{month:02d} was already in local storage') 
+        this_month_start = pd.Timestamp(year=year, month=month, day=1)
+        next_month_start = this_month_start + pd.offsets.MonthBegin(1)
+        if from_date is not None:
+            this_month_start = max(this_month_start, _to_naive_timestamp(from_date))
+        if to_date is not None:
+            next_month_start = min(next_month_start, _to_naive_timestamp(to_date))
+        if this_month_start < next_month_start:
+            windows[month] = (this_month_start, next_month_start)
 
-        # load the file into Pandas
-        rides_one_month = pd.read_parquet(local_file)
+    # download the files missing from local storage, all at once
+    available_months = download_raw_data(year, list(windows))
 
-        # rename columns
-        rides_one_month = rides_one_month[['tpep_pickup_datetime', 'PULocationID']]
-        rides_one_month.rename(columns={
-            'tpep_pickup_datetime': 'pickup_datetime',
-            'PULocationID': 'pickup_location_id',
-        }, inplace=True)
+    for month, (this_month_start, next_month_start) in windows.items():
 
-        # validate the file
-        rides_one_month = validate_raw_data(rides_one_month, year, month)
+        if month not in available_months:
+            continue
+
+        # load the file into Pandas, decoding only the rows we keep
+        local_file = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
+        rides_one_month = read_raw_data_file(local_file, this_month_start, next_month_start, backend)
 
         # append to existing data
-        rides = pd.concat([rides, rides_one_month])
+        rides.append(rides_one_month)
+
+    rides = pd.concat(rides) if rides else pd.DataFrame()
 
     if rides.empty:
         # no data, so we return an empty dataframe
@@ -154,50 +232,30 @@ def add_missing_slots(ts_data: pd.DataFrame) -> pd.DataFrame:
     has a complete list of
     - pickup_hours
     - pickup_location_ids
+
+    The full (pickup_location_id x pickup_hour) grid is built in one pass as an
+    HourlyDemandCube, so locations without any rides get a full series of 0s.
     """
-    location_ids = range(1, ts_data['pickup_location_id'].max() + 1)
+    if ts_data.empty:
+        return pd.DataFrame(columns=['pickup_hour', 'rides', 'pickup_location_id'])
 
-    full_range = pd.date_range(ts_data['pickup_hour'].min(),
-                               ts_data['pickup_hour'].max(),
-                               freq='H')
-    output = pd.DataFrame()
-    
-    for location_id in tqdm(location_ids):
-
-        # keep only rides for this 'location_id'
-        ts_data_i = ts_data.loc[ts_data.pickup_location_id == location_id, ['pickup_hour', 'rides']]
-        
-        if ts_data_i.empty:
-            # add a dummy entry with a 0
-            ts_data_i = pd.DataFrame.from_dict([
-                {'pickup_hour': ts_data['pickup_hour'].max(), 'rides': 0}
-            ])
-
-        # quick way to add missing dates with 0 in a Series
-        # taken from https://stackoverflow.com/a/19324591
-        ts_data_i.set_index('pickup_hour', inplace=True)
-        ts_data_i.index = pd.DatetimeIndex(ts_data_i.index)
-        ts_data_i = ts_data_i.reindex(full_range, fill_value=0)
-        
-        # add back `location_id` columns
-        ts_data_i['pickup_location_id'] = location_id
-
-        output = pd.concat([output, ts_data_i])
-    
-    # move the pickup_hour from the index to a dataframe column
-    output = output.reset_index().rename(columns={'index': 'pickup_hour'})
-    
-    return output
+    location_ids = np.arange(1, ts_data['pickup_location_id'].max() + 1)
+
+    return HourlyDemandCube.from_ts_data(ts_data, location_ids=location_ids).to_ts_data()
 
 
+@instrumented('transform_raw_data_into_ts_data')
 def transform_raw_data_into_ts_data(
-    rides: pd.DataFrame
+    rides: pd.DataFrame,
+    backend: Optional[str] = None,
 ) -> pd.DataFrame:
-    """"""
+    """
+    Aggregates raw rides into hourly time-series data, with one row per
+    (pickup_hour, pickup_location_id) slot. `backend` is the engine doing the
+    aggregation, see `src.data_backends`. If `None`, use `config.DATA_BACKEND`.
+    """
     # sum rides per location and pickup_hour
-    rides['pickup_hour'] = rides['pickup_datetime'].dt.floor('H')
-    agg_rides = rides.groupby(['pickup_hour', 'pickup_location_id']).size().reset_index()
-    agg_rides.rename(columns={0: 'rides'}, inplace=True)
+    agg_rides = aggregate_rides(rides, backend or config.DATA_BACKEND)
 
     # add rows for (locations, pickup_hours)s with 0 rides
     agg_rides_all_slots = add_missing_slots(agg_rides)
@@ -205,6 +263,63 @@ def transform_raw_data_into_ts_data(
     return agg_rides_all_slots
 
 
+def load_ts_data(
+    years: Union[int, List[int]],
+    months: Optional[List[int]] = None,
+    backend: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Same as `transform_raw_data_into_ts_data(load_raw_data(...))` for all the
+    given `years` and `months`, but the hourly aggregate of every monthly raw
+    file is cached in DATA_CACHE_DIR. Only new or changed months are
+    aggregated, one at a time, and the cached partials are stitched together.
+
+    Args:
+        years: years of the data to load
+        months: months of the data to load for every year. If `None`, load all
+        months
+        backend: engine aggregating the raw files, see `src.data_backends`. If
+        `None`, use `config.DATA_BACKEND`
+
+    Returns:
+        pd.DataFrame: time-series data with one row per (pickup_hour,
+        pickup_location_id) slot
+    """
+    backend = backend or config.DATA_BACKEND
+    # before any file is downloaded
+    check_backend(backend)
+    years = [years] if isinstance(years, int) else years
+    months = list(range(1, 13)) if months is None else \
+        [months] if isinstance(months, int) else months
+
+    agg_rides = []
+    for year in years:
+        for month in download_raw_data(year, months):
+            raw_file = RAW_DATA_DIR / f'rides_{year}-{month:02d}.parquet'
+
+            agg_rides_one_month = load_cached_aggregate(raw_file)
+            if agg_rides_one_month is None:
+                print(f'Aggregating rides of {year}-{month:02d}')
+                this_month_start = pd.Timestamp(year=year, month=month, day=1)
+                next_month_start = this_month_start + pd.offsets.MonthBegin(1)
+                agg_rides_one_month = aggregate_raw_data_file(
+                    raw_file, this_month_start, next_month_start, backend
+                )
+                save_aggregate(raw_file, agg_rides_one_month)
+
+            agg_rides.append(agg_rides_one_month)
+
+    if not agg_rides:
+        return pd.DataFrame(columns=['pickup_hour', 'rides', 'pickup_location_id'])
+
+    # months do not overlap, so their aggregates are just stacked
+    agg_rides = pd.concat(agg_rides, ignore_index=True)
+
+    # add rows for (locations, pickup_hours)s with 0 rides
+    return add_missing_slots(agg_rides)
+
+
+@instrumented('transform_ts_data_into_features_and_target')
 def transform_ts_data_into_features_and_target(
     ts_data: pd.DataFrame,
     n_features: int,
@@ -213,84 +328,100 @@ def transform_ts_data_into_features_and_target(
     """
     Slices and transposes data from time-series format into a (features, target)
     format that we can use to train Supervised ML models
+
+    The rides of all locations are sorted into one contiguous array, and every
+    (features, target) window is read from a zero-copy strided view over it, so
+    features and targets are built with a single allocation for all locations.
     """
-    import time
-    assert set(ts_data.columns) == {'pickup_hour', 'rides', 'pickup_location_id', 'pickup_ts'}
+    rides, window_starts, example_rows, example_location_ids = get_feature_and_target_windows(
+        ts_data, n_features, step_size
+    )
+
+    # slice features and target of every window out of a strided view
+    if len(window_starts) > 0:
+        windows = sliding_window_view(rides, n_features + 1)
+        x_and_y = windows[window_starts]
+    else:
+        x_and_y = np.empty(shape=(0, n_features + 1), dtype=np.float32)
+    x = x_and_y[:, :n_features]
+    y = x_and_y[:, n_features]
 
-    location_ids = ts_data['pickup_location_id'].unique() # len(location_ids)=265
-    features = pd.DataFrame()
-    targets = pd.DataFrame()
-    
-    # TODO: improve here, very slow
-    for location_id in location_ids:
-    
-        #iteration_start_time = time.time()
-        # keep only ts data for this `location_id`
-        ts_data_one_location = ts_data.loc[
-            ts_data.pickup_location_id == location_id, 
-            ['pickup_hour', 'rides']
-        ].sort_values(by=['pickup_hour'])
-
-        # pre-compute cutoff indices to split dataframe rows
-        indices = get_cutoff_indices_features_and_target(
-            ts_data_one_location,
-            n_features,
-            step_size
-        )
+    # numpy -> pandas
+    features = pd.DataFrame(
+        x,
+        columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(n_features))]
+    )
+    features['pickup_hour'] = ts_data['pickup_hour'].take(example_rows).reset_index(drop=True)
+    features['pickup_location_id'] = example_location_ids
 
-        # slice and transpose data into numpy arrays for features and targets
-        n_examples = len(indices)
-        x = np.ndarray(shape=(n_examples, n_features), dtype=np.float32)
-        y = np.ndarray(shape=(n_examples), dtype=np.float32)
-        pickup_hours = []
-        for i, idx in enumerate(indices):
-            x[i, :] = ts_data_one_location.iloc[idx[0]:idx[1]]['rides'].values
-            y[i] = ts_data_one_location.iloc[idx[1]:idx[2]]['rides'].values[0]
-            pickup_hours.append(ts_data_one_location.iloc[idx[1]]['pickup_hour'])
-
-        # numpy -> pandas
-        features_one_location = pd.DataFrame(
-            x,
-            columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(n_features))]
-        )
-        features_one_location['pickup_hour'] = pickup_hours
-        features_one_location['pickup_location_id'] = location_id
+    targets = pd.Series(y, name='target_rides_next_hour')
 
-        # numpy -> pandas
-        targets_one_location = pd.DataFrame(y, columns=[f'target_rides_next_hour'])
+    return features, targets
 
-        # concatenate results
-        features = pd.concat([features, features_one_location])
-        targets = pd.concat([targets, targets_one_location])
 
-        # iteration_end_time = time.time()
-        # iteration_time = iteration_end_time - iteration_start_time
-        # print(f"Iteration for location_id {location_id} took {iteration_time:.2f} seconds")
+def get_feature_and_target_windows(
+    ts_data: pd.DataFrame,
+    n_features: int,
+    step_size: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Windows of `n_features` + 1 consecutive hours of rides, every `step_size`
+    hours, for all locations, without copying any of them.
 
-    features.reset_index(inplace=True, drop=True)
-    targets.reset_index(inplace=True, drop=True)
+    Returns:
+        rides: float32 rides of all locations, each one a contiguous series
+        window_starts: window i is rides[window_starts[i]:window_starts[i] + n_features + 1],
+            with the features first and the target last
+        example_rows: position in `ts_data` of the target hour of every window
+        example_location_ids: pickup_location_id of every window
+    """
+    assert set(ts_data.columns) == {'pickup_hour', 'rides', 'pickup_location_id', 'pickup_ts'}
+
+    # sort rows by location (in order of appearance) and then by time, so the
+    # series of each location is a contiguous block of `rides`
+    location_codes, location_ids = pd.factorize(ts_data['pickup_location_id'])
+    pickup_hours = pd.to_datetime(ts_data['pickup_hour']).to_numpy(dtype='datetime64[ns]')
+    order = np.lexsort((pickup_hours, location_codes))
+    rides = ts_data['rides'].to_numpy(dtype=np.float32)[order]
+
+    # pre-compute cutoff indices of all windows, for all locations
+    series_lengths = np.bincount(location_codes, minlength=len(location_ids))
+    series_starts = np.cumsum(series_lengths) - series_lengths
+    indices_per_location = [
+        start + get_cutoff_indices_features_and_target(
+            rides[start:start + length],
+            n_features,
+            step_size
+        )
+        for start, length in zip(series_starts, series_lengths)
+    ]
+    n_examples_per_location = [len(indices) for indices in indices_per_location]
+    indices = np.concatenate(indices_per_location) if indices_per_location \
+        else np.empty(shape=(0, 3), dtype=np.int64)
 
-    return features, targets['target_rides_next_hour']
+    return (
+        rides,
+        indices[:, 0],
+        order[indices[:, 1]],
+        np.repeat(location_ids.to_numpy(), n_examples_per_location),
+    )
 
 
 def get_cutoff_indices_features_and_target(
-    data: pd.DataFrame,
+    data: Union[pd.DataFrame, np.ndarray],
     n_features: int,
     step_size: int
-    ) -> list:
-
-        stop_position = len(data) - 1
-        
-        # Start the first sub-sequence at index position 0
-        subseq_first_idx = 0
-        subseq_mid_idx = n_features
-        subseq_last_idx = n_features + 1
-        indices = []
-        
-        while subseq_last_idx <= stop_position:
-            indices.append((subseq_first_idx, subseq_mid_idx, subseq_last_idx))
-            subseq_first_idx += step_size
-            subseq_mid_idx += step_size
-            subseq_last_idx += step_size
-
-        return indices
+    ) -> np.ndarray:
+    """
+    Returns an array with one row of (first, mid, last) indices per window,
+    where `data[first:mid]` are the features and `data[mid:last]` the target
+    """
+    stop_position = len(data) - 1
+
+    # sub-sequences start every `step_size` positions, and must end no later
+    # than `stop_position`
+    subseq_first_idx = np.arange(0, stop_position - n_features, step_size)
+    subseq_mid_idx = subseq_first_idx + n_features
+    subseq_last_idx = subseq_first_idx + n_features + 1
+
+    return np.stack([subseq_first_idx, subseq_mid_idx, subseq_last_idx], axis=1)
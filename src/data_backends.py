@@ -0,0 +1,194 @@
+"""
+Execution backends for reading raw ride files and aggregating them into
+hourly time-series data. They all take and return pandas DataFrames, so
+callers do not depend on the engine doing the work:
+
+- `pandas`: Arrow scan of the Parquet file, group-by in pandas
+- `arrow`: Arrow scan and multi-threaded group-by with pyarrow.compute
+- `polars`: lazy, multi-threaded scan and group-by with polars (optional
+  dependency, `poetry install --extras polars`)
+"""
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+BACKENDS = ('pandas', 'arrow', 'polars')
+
+
+def read_raw_data_file(
+    local_file: Path,
+    from_date: datetime,
+    to_date: datetime,
+    backend: str,
+) -> pd.DataFrame:
+    """
+    Reads the pickup datetime and location of the rides in `local_file` with
+    `from_date` <= pickup_datetime < `to_date`
+
+    Only the 2 columns we need are read, and the time bounds are pushed down to
+    the Parquet reader, so row groups outside of them are never decoded.
+    """
+    check_backend(backend)
+    if backend == 'polars':
+        rides = _scan_raw_data_file_with_polars(local_file, from_date, to_date).collect().to_pandas()
+    else:
+        rides = _scan_raw_data_file_with_arrow(local_file, from_date, to_date).to_pandas()
+
+    return rides.rename(columns={
+        'tpep_pickup_datetime': 'pickup_datetime',
+        'PULocationID': 'pickup_location_id',
+    })
+
+
+def aggregate_rides(rides: pd.DataFrame, backend: str) -> pd.DataFrame:
+    """
+    Counts rides per pickup_hour and pickup_location_id
+
+    Returns:
+        pd.DataFrame: columns `pickup_hour`, `pickup_location_id` and `rides`,
+        sorted by pickup_hour and pickup_location_id
+    """
+    check_backend(backend)
+    if backend == 'pandas':
+        rides['pickup_hour'] = rides['pickup_datetime'].dt.floor('H')
+        agg_rides = rides.groupby(['pickup_hour', 'pickup_location_id']).size().reset_index()
+        agg_rides.rename(columns={0: 'rides'}, inplace=True)
+        return agg_rides
+
+    elif backend == 'arrow':
+        table = pa.Table.from_pandas(
+            rides[['pickup_datetime', 'pickup_location_id']], preserve_index=False
+        )
+        return _aggregate_table_with_arrow(table, 'pickup_datetime', 'pickup_location_id')
+
+    pl = _import_polars()
+    return _aggregate_frame_with_polars(
+        pl.from_pandas(rides[['pickup_datetime', 'pickup_location_id']]).lazy(),
+        'pickup_datetime',
+        'pickup_location_id',
+    )
+
+
+def aggregate_raw_data_file(
+    local_file: Path,
+    from_date: datetime,
+    to_date: datetime,
+    backend: str,
+) -> pd.DataFrame:
+    """
+    Same as `aggregate_rides(read_raw_data_file(...))`, but the arrow and polars
+    backends run the scan and the group-by in a single pass, without
+    materializing the individual rides as a pandas DataFrame
+    """
+    check_backend(backend)
+    if backend == 'arrow':
+        table = _scan_raw_data_file_with_arrow(local_file, from_date, to_date)
+        return _aggregate_table_with_arrow(table, 'tpep_pickup_datetime', 'PULocationID')
+
+    elif backend == 'polars':
+        return _aggregate_frame_with_polars(
+            _scan_raw_data_file_with_polars(local_file, from_date, to_date),
+            'tpep_pickup_datetime',
+            'PULocationID',
+        )
+
+    return aggregate_rides(read_raw_data_file(local_file, from_date, to_date, backend), backend)
+
+
+def check_backend(backend: str) -> None:
+    """Raises a ValueError if `backend` is not one of BACKENDS"""
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown data backend {backend}, expected one of {BACKENDS}')
+
+
+def _scan_raw_data_file_with_arrow(
+    local_file: Path,
+    from_date: datetime,
+    to_date: datetime,
+) -> pa.Table:
+    dataset = ds.dataset(local_file, format='parquet')
+
+    # compare timestamps using the same type the file stores them with
+    pickup_datetime = ds.field('tpep_pickup_datetime')
+    timestamp_type = dataset.schema.field('tpep_pickup_datetime').type
+
+    return dataset.to_table(
+        columns=['tpep_pickup_datetime', 'PULocationID'],
+        filter=(pickup_datetime >= pa.scalar(from_date, type=timestamp_type)) &
+               (pickup_datetime < pa.scalar(to_date, type=timestamp_type)),
+    )
+
+
+def _aggregate_table_with_arrow(
+    table: pa.Table,
+    datetime_column: str,
+    location_column: str,
+) -> pd.DataFrame:
+    table = pa.table({
+        'pickup_hour': pc.floor_temporal(table[datetime_column], unit='hour'),
+        'pickup_location_id': table[location_column],
+    })
+    agg_rides = table.group_by(['pickup_hour', 'pickup_location_id']).aggregate([([], 'count_all')])
+    agg_rides = pa.table({
+        'pickup_hour': agg_rides['pickup_hour'],
+        'pickup_location_id': agg_rides['pickup_location_id'],
+        'rides': agg_rides['count_all'],
+    }).sort_by([('pickup_hour', 'ascending'), ('pickup_location_id', 'ascending')])
+
+    return _to_pandas(agg_rides.to_pandas())
+
+
+def _scan_raw_data_file_with_polars(
+    local_file: Path,
+    from_date: datetime,
+    to_date: datetime,
+):
+    pl = _import_polars()
+    pickup_datetime = pl.col('tpep_pickup_datetime')
+    from_date = pd.Timestamp(from_date).to_pydatetime()
+    to_date = pd.Timestamp(to_date).to_pydatetime()
+
+    return pl.scan_parquet(local_file) \
+        .select([pickup_datetime, pl.col('PULocationID')]) \
+        .filter((pickup_datetime >= from_date) & (pickup_datetime < to_date))
+
+
+def _aggregate_frame_with_polars(
+    lazy_frame,
+    datetime_column: str,
+    location_column: str,
+) -> pd.DataFrame:
+    pl = _import_polars()
+
+    agg_rides = lazy_frame \
+        .select([
+            pl.col(datetime_column).dt.truncate('1h').alias('pickup_hour'),
+            pl.col(location_column).alias('pickup_location_id'),
+        ]) \
+        .group_by(['pickup_hour', 'pickup_location_id']) \
+        .agg(pl.len().cast(pl.Int64).alias('rides')) \
+        .sort(['pickup_hour', 'pickup_location_id']) \
+        .collect()
+
+    return _to_pandas(agg_rides.to_pandas())
+
+
+def _to_pandas(agg_rides: pd.DataFrame) -> pd.DataFrame:
+    """Same dtypes the pandas backend returns"""
+    return agg_rides.astype({
+        'pickup_hour': 'datetime64[ns]',
+        'pickup_location_id': 'int64',
+        'rides': 'int64',
+    })
+
+
+def _import_polars():
+    try:
+        import polars
+    except ImportError:
+        raise ImportError("The 'polars' data backend needs polars, install it with `poetry install --extras polars`")
+    return polars
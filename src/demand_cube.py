@@ -0,0 +1,240 @@
+import json
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+
+from src.atomic_write import atomic_write
+from src.paths import DATA_CACHE_DIR
+
+ONE_HOUR = pd.Timedelta(hours=1)
+
+
+@dataclass
+class HourlyDemandCube:
+    """Dense (pickup_location_id x pickup_hour) matrix with the number of rides
+    per location and hour.
+
+    Row `i` holds the series of `location_ids[i]` and column `j` the rides at
+    `hour_origin + j hours`, so slicing by time or by location, and cutting
+    sliding windows, are array views instead of DataFrame scans.
+    """
+    rides: np.ndarray
+    hour_origin: pd.Timestamp
+    location_ids: np.ndarray
+
+    @property
+    def n_locations(self) -> int:
+        return self.rides.shape[0]
+
+    @property
+    def n_hours(self) -> int:
+        return self.rides.shape[1]
+
+    @property
+    def pickup_hours(self) -> pd.DatetimeIndex:
+        return pd.date_range(self.hour_origin, periods=self.n_hours, freq='H')
+
+    @property
+    def hour_end(self) -> pd.Timestamp:
+        """First pickup_hour after the last column"""
+        return self.hour_origin + self.n_hours * ONE_HOUR
+
+    def hour_index(self, pickup_hour: pd.Timestamp) -> int:
+        """Column of `pickup_hour`, which may be outside of [0, n_hours)"""
+        return int((pd.Timestamp(pickup_hour) - self.hour_origin) // ONE_HOUR)
+
+    def location_index(self, location_id: int) -> int:
+        """Row of `location_id`"""
+        i = int(np.searchsorted(self.location_ids, location_id))
+        if i == self.n_locations or self.location_ids[i] != location_id:
+            raise KeyError(f'pickup_location_id={location_id} is not in the cube')
+        return i
+
+    def location(self, location_id: int) -> np.ndarray:
+        """View with the hourly series of `location_id`"""
+        return self.rides[self.location_index(location_id)]
+
+    def slice_hours(
+        self,
+        from_hour: Optional[pd.Timestamp] = None,
+        to_hour: Optional[pd.Timestamp] = None,
+    ) -> 'HourlyDemandCube':
+        """View with the pickup_hours in [`from_hour`, `to_hour`)"""
+        start = 0 if from_hour is None else min(max(self.hour_index(from_hour), 0), self.n_hours)
+        stop = self.n_hours if to_hour is None else min(max(self.hour_index(to_hour), start), self.n_hours)
+        return HourlyDemandCube(
+            rides=self.rides[:, start:stop],
+            hour_origin=self.hour_origin + start * ONE_HOUR,
+            location_ids=self.location_ids,
+        )
+
+    def windows(self, window_size: int, step_size: Optional[int] = 1) -> np.ndarray:
+        """(n_locations, n_windows, window_size) strided view with the windows
+        of `window_size` consecutive hours, every `step_size` hours"""
+        return sliding_window_view(self.rides, window_size, axis=1)[:, ::step_size]
+
+    def upsert(
+        self,
+        other: 'HourlyDemandCube',
+        max_hours: Optional[int] = None,
+    ) -> 'HourlyDemandCube':
+        """New cube covering the hours and locations of both cubes, where the
+        slots of `other` overwrite those of `self`
+
+        Args:
+            other (HourlyDemandCube): newer data
+            max_hours (Optional[int]): if given, keep only the latest `max_hours`
+            hours
+
+        Returns:
+            HourlyDemandCube: slots in none of the 2 cubes have 0 rides
+        """
+        location_ids = np.union1d(self.location_ids, other.location_ids)
+        hour_end = max(self.hour_end, other.hour_end)
+        hour_origin = min(self.hour_origin, other.hour_origin)
+        if max_hours is not None:
+            hour_origin = max(hour_origin, hour_end - max_hours * ONE_HOUR)
+
+        rides = np.zeros(
+            shape=(len(location_ids), int((hour_end - hour_origin) // ONE_HOUR)),
+            dtype=np.promote_types(self.rides.dtype, other.rides.dtype),
+        )
+        for cube in (self, other):
+            cube = cube.slice_hours(hour_origin, hour_end)
+            start = int((cube.hour_origin - hour_origin) // ONE_HOUR)
+            rows = np.searchsorted(location_ids, cube.location_ids)
+            rides[rows, start:start + cube.n_hours] = cube.rides
+
+        return HourlyDemandCube(rides=rides, hour_origin=hour_origin, location_ids=location_ids)
+
+    @classmethod
+    def from_ts_data(
+        cls,
+        ts_data: pd.DataFrame,
+        from_hour: Optional[pd.Timestamp] = None,
+        to_hour: Optional[pd.Timestamp] = None,
+        location_ids: Optional[Sequence[int]] = None,
+    ) -> 'HourlyDemandCube':
+        """Builds the cube from long time-series data with columns
+        `pickup_hour`, `pickup_location_id` and `rides`. The rides of rows in
+        the same (location, hour) slot, e.g. of sub-hour pickup_hours, add up
+
+        Args:
+            ts_data (pd.DataFrame): time-series data in long format
+            from_hour (Optional[pd.Timestamp]): first pickup_hour of the cube.
+            Defaults to the earliest pickup_hour in `ts_data`.
+            to_hour (Optional[pd.Timestamp]): pickup_hour right after the last
+            one of the cube. Defaults to 1 hour after the latest in `ts_data`.
+            location_ids (Optional[Sequence[int]]): rows of the cube. Defaults
+            to the pickup_location_ids in `ts_data`.
+
+        Returns:
+            HourlyDemandCube: slots missing in `ts_data` have 0 rides, and rows
+            of `ts_data` outside of the cube are dropped
+        """
+        pickup_hours = pd.DatetimeIndex(ts_data['pickup_hour'])
+        from_hour = pickup_hours.min() if from_hour is None else pd.Timestamp(from_hour)
+        to_hour = pickup_hours.max() + ONE_HOUR if to_hour is None else pd.Timestamp(to_hour)
+        n_hours = max(int((to_hour - from_hour) // ONE_HOUR), 0)
+
+        pickup_location_ids = ts_data['pickup_location_id'].to_numpy()
+        location_ids = np.unique(pickup_location_ids) if location_ids is None \
+            else np.sort(np.asarray(location_ids))
+
+        # (location, hour) slot of every row of `ts_data` inside the cube
+        rows = np.searchsorted(location_ids, pickup_location_ids)
+        columns = ((pickup_hours - from_hour) // ONE_HOUR).to_numpy()
+        in_cube = (rows < len(location_ids)) & (columns >= 0) & (columns < n_hours)
+        in_cube[in_cube] = location_ids[rows[in_cube]] == pickup_location_ids[in_cube]
+
+        # sum the rides of each slot, without a cube of wider integers
+        slots, slot_of_row = np.unique(rows[in_cube] * n_hours + columns[in_cube], return_inverse=True)
+        rides = np.bincount(
+            slot_of_row, weights=ts_data['rides'].to_numpy()[in_cube], minlength=len(slots)
+        ).astype(np.int64)
+
+        dtype = np.uint16 if len(rides) == 0 or rides.max() <= np.iinfo(np.uint16).max else np.uint32
+        cube = np.zeros(shape=(len(location_ids), n_hours), dtype=dtype)
+        cube.flat[slots] = rides
+
+        return cls(rides=cube, hour_origin=from_hour, location_ids=location_ids)
+
+    def to_ts_data(self) -> pd.DataFrame:
+        """Time-series data in long format, sorted by pickup_location_id and
+        pickup_hour, with columns `pickup_hour`, `rides` and `pickup_location_id`"""
+        return pd.DataFrame({
+            'pickup_hour': self.pickup_hours[np.tile(np.arange(self.n_hours), self.n_locations)],
+            'rides': self.rides.ravel().astype(np.int64),
+            'pickup_location_id': np.repeat(self.location_ids, self.n_hours),
+        })
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """Saves the cube under `path`, relative to DATA_CACHE_DIR, as a `.npy`
+        array that `load` can memory-map, and a small JSON metadata file that
+        names it. Only one process should save a given `path` at a time."""
+        path = DATA_CACHE_DIR / path
+        path.mkdir(parents=True, exist_ok=True)
+        previous_rides_file = _get_rides_file(path)
+
+        # every save writes a new rides file, and replacing the metadata that
+        # names it swaps the whole cube in at once, so readers never pair the
+        # rides of one version with the hour_origin of another
+        rides_file = f'rides.{uuid.uuid4().hex}.npy'
+        with atomic_write(path / rides_file) as f:
+            np.save(f, self.rides)
+        with atomic_write(path / 'metadata.json', 'w') as f:
+            json.dump({
+                'hour_origin': self.hour_origin.isoformat(),
+                'tz': str(self.hour_origin.tz) if self.hour_origin.tz else None,
+                'location_ids': self.location_ids.tolist(),
+                'rides_file': rides_file,
+            }, f)
+
+        # the previous rides are kept for readers that loaded its metadata
+        # right before the swap
+        for old_rides_file in path.glob('rides*.npy'):
+            if old_rides_file.name not in (rides_file, previous_rides_file):
+                old_rides_file.unlink(missing_ok=True)
+
+        return path
+
+    @staticmethod
+    def exists(path: Union[str, Path]) -> bool:
+        """Whether a cube was saved under `path`, relative to DATA_CACHE_DIR"""
+        return (DATA_CACHE_DIR / path / 'metadata.json').exists()
+
+    @classmethod
+    def load(
+        cls,
+        path: Union[str, Path],
+        mmap_mode: Optional[str] = 'r',
+    ) -> 'HourlyDemandCube':
+        """Loads a cube saved with `save`. By default the rides are memory-mapped
+        read-only, so only the slices we touch are read from disk."""
+        path = DATA_CACHE_DIR / path
+
+        with open(path / 'metadata.json') as f:
+            metadata = json.load(f)
+        hour_origin = pd.Timestamp(metadata['hour_origin'])
+        if metadata['tz']:
+            hour_origin = hour_origin.tz_convert(metadata['tz'])
+
+        return cls(
+            # cubes saved before the rides files were versioned have a single one
+            rides=np.load(path / metadata.get('rides_file', 'rides.npy'), mmap_mode=mmap_mode),
+            hour_origin=hour_origin,
+            location_ids=np.asarray(metadata['location_ids']),
+        )
+
+
+def _get_rides_file(path: Path) -> Optional[str]:
+    """Name of the rides file of the cube saved in `path`, if any"""
+    if not (path / 'metadata.json').exists():
+        return None
+    with open(path / 'metadata.json') as f:
+        return json.load(f).get('rides_file', 'rides.npy')
@@ -0,0 +1,154 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from src.logger import get_logger
+
+logger = get_logger()
+
+# HTTP status codes worth retrying, because the server may recover
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class FileNotAvailableError(Exception):
+    """The server does not have the file we asked for, so retrying is pointless"""
+
+
+class IncompleteDownloadError(Exception):
+    """The connection ended before we received the whole file"""
+
+
+def download_file(
+    url: str,
+    path: Path,
+    chunk_size: int = 1024 * 1024,
+    max_retries: int = 3,
+    backoff: float = 2.0,
+    timeout: float = 60.0,
+) -> Path:
+    """Streams the file at `url` to `path`
+
+    Chunks are written to a `.part` file next to `path`, which is atomically
+    renamed to `path` once the download is complete. If a `.part` file is left
+    behind by a previous attempt, the download resumes from where it stopped
+    with an HTTP range request.
+
+    Args:
+        url (str): URL of the file to download
+        path (Path): local path where the file is saved
+        chunk_size (int): bytes written per chunk. Defaults to 1MB.
+        max_retries (int): retries after a failed attempt. Defaults to 3.
+        backoff (float): seconds to wait before the first retry,
+        doubled on every retry. Defaults to 2.0.
+        timeout (float): seconds to wait for the server. Defaults to 60.0.
+
+    Raises:
+        FileNotAvailableError: the server does not have the file
+        requests.RequestException, IncompleteDownloadError: the download kept
+        failing after `max_retries` retries
+
+    Returns:
+        Path: `path`
+    """
+    partial_path = path.with_name(path.name + '.part')
+
+    for attempt in range(max_retries + 1):
+        try:
+            _download_to_partial_file(url, partial_path, chunk_size, timeout)
+            break
+        except (requests.RequestException, IncompleteDownloadError) as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2**attempt
+            logger.info(f'Download of {url} failed ({e}), retrying in {delay:.1f} seconds...')
+            time.sleep(delay)
+
+    # readers never see a truncated file under `path`
+    os.replace(partial_path, path)
+
+    return path
+
+
+def _download_to_partial_file(
+    url: str,
+    partial_path: Path,
+    chunk_size: int,
+    timeout: float,
+) -> None:
+    """Downloads `url` into `partial_path`, resuming from its current size"""
+    downloaded_bytes = partial_path.stat().st_size if partial_path.exists() else 0
+    headers = {'Range': f'bytes={downloaded_bytes}-'} if downloaded_bytes > 0 else {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+
+        if response.status_code == 416:
+            if _get_remote_size(response) == downloaded_bytes:
+                # a previous attempt got every byte but stopped before the rename
+                return
+            # the partial file does not match the remote one, so start over
+            partial_path.unlink()
+            raise IncompleteDownloadError(f'{partial_path} could not be resumed')
+
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            response.raise_for_status()
+
+        if response.status_code not in (200, 206):
+            raise FileNotAvailableError(f'{url} is not available')
+
+        if response.status_code == 200:
+            # the server ignored the range request and sends the whole file
+            downloaded_bytes = 0
+
+        expected_bytes = response.headers.get('Content-Length')
+        expected_bytes = downloaded_bytes + int(expected_bytes) if expected_bytes else None
+
+        with open(partial_path, 'ab' if downloaded_bytes > 0 else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                downloaded_bytes += len(chunk)
+
+    if expected_bytes is not None and downloaded_bytes != expected_bytes:
+        raise IncompleteDownloadError(
+            f'Got {downloaded_bytes} of {expected_bytes} bytes from {url}'
+        )
+
+
+def _get_remote_size(response: requests.Response) -> Optional[int]:
+    """Size of the remote file from the `Content-Range: bytes */<size>`
+    header of a 416 response, None if the server does not send it"""
+    content_range = response.headers.get('Content-Range', '')
+    _, _, size = content_range.partition('/')
+    return int(size) if content_range.startswith('bytes') and size.isdigit() else None
+
+
+def download_files(
+    urls_and_paths: List[Tuple[str, Path]],
+    max_workers: int = 4,
+    **kwargs,
+) -> Dict[Path, Optional[Exception]]:
+    """Downloads several files concurrently, with at most `max_workers`
+    downloads in flight
+
+    Args:
+        urls_and_paths (List[Tuple[str, Path]]): (url, path) pairs to download
+        max_workers (int): maximum concurrent downloads. Defaults to 4.
+        **kwargs: forwarded to `download_file`
+
+    Returns:
+        Dict[Path, Optional[Exception]]: for every path, `None` if it was
+        downloaded, or the exception that made its download fail
+    """
+    if not urls_and_paths:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            path: executor.submit(download_file, url, path, **kwargs)
+            for url, path in urls_and_paths
+        }
+
+    return {path: future.exception() for path, future in futures.items()}
@@ -2,11 +2,12 @@ from typing import Optional, List
 from dataclasses import dataclass
 
 import hsfs
-import hopsworks
 import pandas as pd
 
 import src.config as config
+import src.hopsworks_session as hopsworks_session
 from src.paths import DATA_CACHE_DIR
+from src.instrumentation import instrumented
 from src.logger import get_logger
 
 logger = get_logger()
@@ -29,16 +30,13 @@ class FeatureViewConfig:
     feature_group: FeatureGroupConfig
 
 def get_feature_store() -> hsfs.feature_store.FeatureStore:
-    """Connects to Hopsworks and returns a pointer to the feature store
+    """Connects to Hopsworks, once per process, and returns a pointer to the
+    feature store
 
     Returns:
         hsfs.feature_store.FeatureStore: pointer to the feature store
     """
-    project = hopsworks.login(
-        project=config.HOPSWORKS_PROJECT_NAME,
-        api_key_value=config.HOPSWORKS_API_KEY
-    )
-    return project.get_feature_store()
+    return hopsworks_session.get_feature_store()
 
 # TODO: remove this function, and use get_or_create_feature_group instead
 def get_feature_group(
@@ -55,10 +53,7 @@ def get_feature_group(
     Returns:
         hsfs.feature_group.FeatureGroup: pointer to the feature group
     """
-    return get_feature_store().get_feature_group(
-        name=name,
-        version=version,
-    )
+    return hopsworks_session.get_feature_group(name, version)
 
 def get_or_create_feature_group(
     feature_group_metadata: FeatureGroupConfig
@@ -73,15 +68,13 @@ def get_or_create_feature_group(
     Returns:
         hsfs.feature_group.FeatureGroup: pointer to the feature group
     """
-    project = get_feature_store()
-    feature_group = project.get_or_create_feature_group(
-        name=feature_group_metadata.name,
-        version=feature_group_metadata.version,
+    feature_group = hopsworks_session.get_feature_group(
+        feature_group_metadata.name,
+        feature_group_metadata.version,
         description=feature_group_metadata.description,
         primary_key=feature_group_metadata.primary_key,
         event_time=feature_group_metadata.event_time,
         online_enabled=feature_group_metadata.online_enabled
-        
     )
     return feature_group
 
@@ -90,31 +83,30 @@ def get_or_create_feature_view(
 ) -> hsfs.feature_view.FeatureView:
     """"""
 
-    feature_store = get_feature_store()
-
-    feature_group = feature_store.get_feature_group(
-        name=feature_view_metadata.feature_group.name,
-        version=feature_view_metadata.feature_group.version
-    )
-
-    try:
-        feature_store.create_feature_view(
-            name=feature_view_metadata.name,
-            version=feature_view_metadata.version,
-            query=feature_group.select_all()
+    def create_feature_view(feature_store: hsfs.feature_store.FeatureStore):
+        feature_group = hopsworks_session.get_feature_group(
+            feature_view_metadata.feature_group.name,
+            feature_view_metadata.feature_group.version
         )
-    except:
-        logger.info("Feature view already exists, skipping creation.")
-    
-    feature_store = get_feature_store()
-    feature_view = feature_store.get_feature_view(
-        name=feature_view_metadata.name,
-        version=feature_view_metadata.version,
+        try:
+            feature_store.create_feature_view(
+                name=feature_view_metadata.name,
+                version=feature_view_metadata.version,
+                query=feature_group.select_all()
+            )
+        except:
+            logger.info("Feature view already exists, skipping creation.")
+
+    feature_view = hopsworks_session.get_feature_view(
+        feature_view_metadata.name,
+        feature_view_metadata.version,
+        create=create_feature_view,
     )
 
     return feature_view
 
 
+@instrumented('save_features')
 def feature_group_insert(ts_data: pd.DataFrame, file_name: str = 'feature_group.parquet'):
     """"""
     if config.SAVE_FEATURE_GROUP == 'local':
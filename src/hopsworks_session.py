@@ -0,0 +1,116 @@
+"""
+Process-wide Hopsworks session.
+
+Logs in to Hopsworks once per process and caches the project, the feature
+store, the model registry, and the feature groups and views by name and
+version, so a pipeline run pays for a single login however many pointers it
+needs. Call `invalidate` when a session expires or a feature group or view is
+re-created, and the next call fetches it again.
+
+    feature_store = get_feature_store()
+    feature_view = get_feature_view('time_series_hourly_feature_view', 1)
+"""
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import hopsworks
+
+import src.config as config
+from src.logger import get_logger
+
+logger = get_logger()
+
+_lock = threading.RLock()
+
+# function called to log in, `hopsworks.login` unless replaced with `set_login`
+_login: Optional[Callable] = None
+
+_project = None
+_feature_store = None
+_model_registry = None
+_feature_groups: Dict[Tuple[str, int], Any] = {}
+_feature_views: Dict[Tuple[str, int], Any] = {}
+
+
+def set_login(login: Optional[Callable]) -> None:
+    """Logs in with `login(project=..., api_key_value=...)` instead of
+    `hopsworks.login`, e.g. with a stub client, and drops the current session.
+    `None` goes back to `hopsworks.login`"""
+    global _login
+    with _lock:
+        _login = login
+        invalidate()
+
+
+def get_project():
+    """Hopsworks project, logging in on the first call only"""
+    global _project
+    with _lock:
+        if _project is None:
+            logger.info('Logging in to Hopsworks')
+            _project = (_login or hopsworks.login)(
+                project=config.HOPSWORKS_PROJECT_NAME,
+                api_key_value=config.HOPSWORKS_API_KEY
+            )
+        return _project
+
+
+def get_feature_store():
+    global _feature_store
+    with _lock:
+        if _feature_store is None:
+            _feature_store = get_project().get_feature_store()
+        return _feature_store
+
+
+def get_model_registry():
+    global _model_registry
+    with _lock:
+        if _model_registry is None:
+            _model_registry = get_project().get_model_registry()
+        return _model_registry
+
+
+def get_feature_group(name: str, version: int, **create_kwargs):
+    """Feature group `name` and `version`. With `create_kwargs`, e.g.
+    `description` or `primary_key`, it is created if it does not exist"""
+    with _lock:
+        key = (name, version)
+        if key not in _feature_groups:
+            feature_store = get_feature_store()
+            if create_kwargs:
+                _feature_groups[key] = feature_store.get_or_create_feature_group(
+                    name=name, version=version, **create_kwargs
+                )
+            else:
+                _feature_groups[key] = feature_store.get_feature_group(name=name, version=version)
+        return _feature_groups[key]
+
+
+def get_feature_view(name: str, version: int, create: Optional[Callable] = None):
+    """Feature view `name` and `version`. If given, `create(feature_store)` is
+    called before fetching it, the first time only"""
+    with _lock:
+        key = (name, version)
+        if key not in _feature_views:
+            feature_store = get_feature_store()
+            if create is not None:
+                create(feature_store)
+            _feature_views[key] = feature_store.get_feature_view(name=name, version=version)
+        return _feature_views[key]
+
+
+def invalidate(name: Optional[str] = None, version: Optional[int] = None) -> None:
+    """Drops the cached feature groups and views called `name` (and with
+    `version`, if given), or the whole session if `name` is not given"""
+    global _project, _feature_store, _model_registry
+    with _lock:
+        if name is None:
+            _project = _feature_store = _model_registry = None
+            _feature_groups.clear()
+            _feature_views.clear()
+            return
+
+        for cache in (_feature_groups, _feature_views):
+            for key in [key for key in cache if key[0] == name and version in (None, key[1])]:
+                del cache[key]
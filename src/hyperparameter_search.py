@@ -0,0 +1,290 @@
+"""
+Hyperparameter search with time-based cross-validation.
+
+The features go once into a float32 `TrainingMatrix`, with the temporal
+features already added, and LightGBM bins every fold once for all trials,
+see `FoldDatasets`. Every fit stops early on its validation fold, and the
+validation MAE is reported to Optuna as it trains, so the pruner can stop
+unpromising trials. The best parameters include the `n_estimators` found by
+early stopping.
+
+The training data may also be `TrainingShards`, too large for memory, which
+LightGBM bins a batch of rows at a time.
+
+With several workers, the matrix is memory-mapped by every worker process,
+and the trials of all workers go to one Optuna study in a journal file, so
+each worker's sampler sees the others' results:
+
+    best_params = search_hyperparameters(train_data, n_trials=40, n_workers=4)
+"""
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+import lightgbm as lgb
+import numpy as np
+import optuna
+from sklearn.metrics import mean_absolute_error
+
+import src.config as config
+from src.training_matrix import TrainingMatrix, TrainingShards, predict_booster
+from src.logger import get_logger
+
+try:
+    from optuna.storages.journal import JournalFileBackend
+except ImportError:
+    # optuna < 4
+    from optuna.storages import JournalFileStorage as JournalFileBackend
+
+logger = get_logger()
+
+STUDY_NAME = 'hyperparameter_search'
+
+# LightGBM parameters used to bin a Dataset. Trials that set them differently
+# need datasets of their own
+DATASET_PARAMS = (
+    'max_bin', 'max_bin_by_feature', 'min_data_in_bin', 'bin_construct_sample_cnt',
+    'subsample_for_bin', 'data_random_seed', 'use_missing', 'zero_as_missing',
+    'linear_tree', 'enable_bundle', 'forcedbins_filename',
+)
+
+# boosting rounds between two reports of the validation MAE to the pruner
+REPORT_PERIOD = 10
+
+
+def suggest_hyperparameters(trial: optuna.trial.Trial) -> dict:
+    """Hyperparameters of the LGBMRegressor to try in `trial`"""
+    return {
+        "metric": 'mae',
+        "verbose": -1,
+        "num_leaves": trial.suggest_int("num_leaves", 2, 256),
+        "feature_fraction": trial.suggest_float("feature_fraction", 0.2, 1.0),
+        "bagging_fraction": trial.suggest_float("bagging_fraction", 0.2, 1.0),
+        "min_child_samples": trial.suggest_int("min_child_samples", 3, 100),
+    }
+
+
+class FoldDatasets:
+    """
+    Binned LightGBM datasets of the `TimeSeriesSplit` folds of a matrix, or
+    of shards.
+
+    The folds are the same in every trial, so they are binned once, and
+    again only for trials that change the `DATASET_PARAMS`. The datasets are
+    built with `feature_pre_filter=False`, so trials can change
+    `min_child_samples` without LightGBM dropping features for all of them.
+    """
+    def __init__(self, matrix: Union[TrainingMatrix, TrainingShards], n_splits: int):
+        self.matrix = matrix
+        self.n_splits = n_splits
+        self._folds: Dict[Tuple, List[Tuple[lgb.Dataset, lgb.Dataset, Union[TrainingMatrix, TrainingShards]]]] = {}
+
+    def get(self, hyperparams: dict) -> List[Tuple[lgb.Dataset, lgb.Dataset, Union[TrainingMatrix, TrainingShards]]]:
+        """(train_set, val_set, val_data) of every fold, binned with the
+        dataset parameters in `hyperparams`"""
+        dataset_params = get_dataset_params(hyperparams)
+        key = tuple(sorted(dataset_params.items()))
+        if key not in self._folds:
+            folds = []
+            for train_data, val_data in self.matrix.split(self.n_splits):
+                train_set = lgb.Dataset(
+                    train_data.X, train_data.y, feature_name=self.matrix.feature_names,
+                    params=dataset_params, free_raw_data=True,
+                ).construct()
+                val_set = lgb.Dataset(
+                    val_data.X, val_data.y, reference=train_set, params=dataset_params, free_raw_data=True,
+                ).construct()
+                folds.append((train_set, val_set, val_data))
+            self._folds[key] = folds
+        return self._folds[key]
+
+
+def get_pruner(name: str) -> optuna.pruners.BasePruner:
+    """Pruner called `name` in HYPERPARAMETER_SEARCH_PRUNER"""
+    if name == 'median':
+        # leaves the first trials and rounds alone, as there is nothing to
+        # compare them with yet
+        return optuna.pruners.MedianPruner(n_startup_trials=3, n_warmup_steps=2 * REPORT_PERIOD)
+    elif name == 'successive_halving':
+        return optuna.pruners.SuccessiveHalvingPruner()
+    elif name == 'none':
+        return optuna.pruners.NopPruner()
+    raise ValueError(f"Unknown pruner {name!r}, use 'median', 'successive_halving' or 'none'")
+
+
+def get_dataset_params(hyperparams: dict) -> dict:
+    """The parameters of `hyperparams` used to bin a Dataset"""
+    dataset_params = {key: hyperparams[key] for key in DATASET_PARAMS if key in hyperparams}
+    dataset_params['feature_pre_filter'] = False
+    dataset_params['verbose'] = hyperparams.get('verbose', -1)
+    return dataset_params
+
+
+def search_hyperparameters(
+    train_data: Union[TrainingMatrix, TrainingShards],
+    n_trials: int,
+    n_workers: Optional[int] = 1,
+    n_splits: int = 2,
+    pruner: Optional[str] = None,
+    fixed_params: Optional[dict] = None,
+) -> dict:
+    """
+    Best hyperparameters after `n_trials` trials, by average validation MAE
+    over `n_splits` `TimeSeriesSplit` folds, with `n_estimators` set to the
+    average number of rounds early stopping kept in the folds of the best
+    trial. `pruner` defaults to HYPERPARAMETER_SEARCH_PRUNER. `fixed_params`
+    are used by all trials, and returned with the best hyperparameters.
+
+    With `n_workers` > 1, or None for one per CPU, the trials are split over
+    that many processes. LightGBM threads are split between the workers too,
+    so they do not compete for the same cores. The training data is shared,
+    but every worker holds the binned datasets and trees of its own trials.
+    Shards are copied to a temporary directory for the workers, one at a time.
+    """
+    pruner = pruner or config.HYPERPARAMETER_SEARCH_PRUNER
+    n_workers = n_workers or os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, n_trials))
+    if n_workers == 1:
+        folds = FoldDatasets(train_data, n_splits)
+        study = optuna.create_study(direction='minimize', pruner=get_pruner(pruner))
+        study.optimize(lambda trial: _objective(trial, folds, 0, fixed_params), n_trials=n_trials)
+        return _get_best_params(study, fixed_params)
+
+    n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+    with tempfile.TemporaryDirectory() as search_dir:
+        train_data.save(Path(search_dir) / 'matrix')
+        storage_file = str(Path(search_dir) / 'study.log')
+        optuna.create_study(
+            study_name=STUDY_NAME, storage=_get_storage(storage_file), direction='minimize',
+            pruner=get_pruner(pruner),
+        )
+
+        logger.info(f'Running {n_trials} trials on {n_workers} workers')
+        # spawned workers do not inherit the OpenMP state of this process,
+        # which can deadlock LightGBM in forked ones
+        with ProcessPoolExecutor(
+            max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _run_trials, type(train_data), search_dir, storage_file,
+                    n_trials // n_workers + (i < n_trials % n_workers), n_splits, n_threads, pruner,
+                    fixed_params,
+                )
+                for i in range(n_workers)
+            ]
+            for future in futures:
+                future.result()
+
+        study = optuna.load_study(study_name=STUDY_NAME, storage=_get_storage(storage_file))
+        return _get_best_params(study, fixed_params)
+
+
+def find_best_hyperparameters(
+    train_data: Union[TrainingMatrix, TrainingShards],
+    n_trials: Optional[int] = 10,
+    n_workers: Optional[int] = 1,
+) -> dict:
+    """
+    Given a set of hyper-parameters, it trains a model and computes an average
+    validation error based on a TimeSeriesSplit, `n_trials` times. With
+    `n_workers` > 1, the trials run in that many processes, see
+    `search_hyperparameters`
+    """
+    # LightGBM samples shards in memory to bin them, see STREAMING_SUBSAMPLE_FOR_BIN
+    fixed_params = {'subsample_for_bin': config.STREAMING_SUBSAMPLE_FOR_BIN} \
+        if isinstance(train_data, TrainingShards) else None
+    best_params = search_hyperparameters(
+        train_data, n_trials=n_trials, n_workers=n_workers, fixed_params=fixed_params,
+    )
+    logger.info(f'{best_params=}')
+
+    return best_params
+
+
+def _run_trials(
+    data_type: Type[Union[TrainingMatrix, TrainingShards]],
+    search_dir: str,
+    storage_file: str,
+    n_trials: int,
+    n_splits: int,
+    n_threads: int,
+    pruner: str,
+    fixed_params: Optional[dict],
+) -> None:
+    """Runs `n_trials` trials of the study in `storage_file`, in a worker"""
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    folds = FoldDatasets(data_type.load(Path(search_dir) / 'matrix'), n_splits)
+    # pruners are not stored with the study
+    study = optuna.load_study(
+        study_name=STUDY_NAME, storage=_get_storage(storage_file), pruner=get_pruner(pruner),
+    )
+    study.optimize(lambda trial: _objective(trial, folds, n_threads, fixed_params), n_trials=n_trials)
+
+
+def _objective(
+    trial: optuna.trial.Trial,
+    folds: FoldDatasets,
+    n_threads: int,
+    fixed_params: Optional[dict] = None,
+) -> float:
+    """Average validation MAE over the folds, training on the binned datasets
+    the model `get_pipeline(**hyperparams).fit` would, until the validation
+    MAE stops improving"""
+    hyperparams = {**suggest_hyperparameters(trial), **(fixed_params or {})}
+    params = {
+        'objective': 'regression',
+        'num_threads': n_threads,
+        **hyperparams,
+        **get_dataset_params(hyperparams),
+    }
+
+    scores = []
+    n_estimators = []
+    for fold, (train_set, val_set, val_data) in enumerate(folds.get(hyperparams)):
+        booster = lgb.train(
+            params, train_set,
+            num_boost_round=config.MAX_N_ESTIMATORS,
+            valid_sets=[val_set],
+            callbacks=[
+                lgb.early_stopping(config.EARLY_STOPPING_ROUNDS, verbose=False),
+                _report_to_pruner(trial, step_offset=fold * config.MAX_N_ESTIMATORS),
+            ],
+        )
+        # predicts with the best iteration
+        scores.append(mean_absolute_error(val_data.y, predict_booster(booster, val_data, num_threads=n_threads)))
+        n_estimators.append(booster.best_iteration)
+
+    trial.set_user_attr('n_estimators', int(round(np.mean(n_estimators))))
+    return np.array(scores).mean()
+
+
+def _report_to_pruner(trial: optuna.trial.Trial, step_offset: int):
+    """LightGBM callback reporting the validation MAE to Optuna every
+    REPORT_PERIOD rounds, and stopping the trial if the pruner says so. Steps
+    of later folds start at `step_offset`"""
+    def callback(env: lgb.callback.CallbackEnv) -> None:
+        if (env.iteration + 1) % REPORT_PERIOD:
+            return
+        mae = env.evaluation_result_list[0][2]
+        trial.report(mae, step_offset + env.iteration)
+        if trial.should_prune():
+            raise optuna.TrialPruned(f'Pruned at round {env.iteration + 1} with {mae=:.4f}')
+    return callback
+
+
+def _get_best_params(study: optuna.study.Study, fixed_params: Optional[dict] = None) -> dict:
+    best_trial = study.best_trial
+    return {
+        **best_trial.params,
+        'n_estimators': best_trial.user_attrs['n_estimators'],
+        **(fixed_params or {}),
+    }
+
+
+def _get_storage(storage_file: str) -> optuna.storages.JournalStorage:
+    return optuna.storages.JournalStorage(JournalFileBackend(storage_file))
@@ -1,4 +1,5 @@
 from datetime import datetime, timedelta
+from typing import Optional, Tuple
 
 import hopsworks
 # from hsfs.feature_store import FeatureStore
@@ -7,20 +8,23 @@ import numpy as np
 from src.logger import get_logger
 
 import src.config as config
+import src.hopsworks_session as hopsworks_session
 from src.feature_store_api import get_or_create_feature_view
 from src.config import FEATURE_VIEW_METADATA
+from src.demand_cube import HourlyDemandCube
+from src.rolling_window import RollingWindow
 from src.paths import DATA_CACHE_DIR
+from src.predictions_store import load_predictions
+from src.instrumentation import instrumented
 
 logger = get_logger()
 
 
 def get_hopsworks_project() -> hopsworks.project.Project:
 
-    return hopsworks.login(
-        project=config.HOPSWORKS_PROJECT_NAME,
-        api_key_value=config.HOPSWORKS_API_KEY
-    )
+    return hopsworks_session.get_project()
 
+@instrumented('predict')
 def get_model_predictions(model, features: pd.DataFrame) -> pd.DataFrame:
     """"""
     # past_rides_columns = [c for c in features.columns if c.startswith('rides_')]
@@ -33,6 +37,7 @@ def get_model_predictions(model, features: pd.DataFrame) -> pd.DataFrame:
     return results
 
 
+@instrumented('load_batch_of_features_from_store')
 def load_batch_of_features_from_store(
     current_date: pd.Timestamp,    
 ) -> pd.DataFrame:
@@ -43,23 +48,61 @@ def load_batch_of_features_from_store(
         to get the batch of features
 
     Returns:
-        pd.DataFrame: 4 columns:
-            - `pickup_hour`
-            - `rides`
-            - `pickup_location_id`
-            - `pickpu_ts`
+        pd.DataFrame: one row per `pickup_location_id`, with the rides of the
+        `config.N_FEATURES` hours before `current_date` and the columns
+        `pickup_hour` and `pickup_location_id`
     """
-    n_features = config.N_FEATURES
+    # warm path: the rolling window moved forward by the feature pipeline
+    features = _load_batch_of_features_from_rolling_window(current_date)
+    if features is not None:
+        return features
 
-    data_from = current_date - timedelta(days=config.CUTOFF_DATE)
-    data_to = current_date - timedelta(hours=1)    
-    
     if config.SAVE_FEATURE_GROUP == 'local':
         local_file = DATA_CACHE_DIR / 'feature_group.parquet'
         features = pd.read_parquet(local_file)
         # features = ts_data.drop(columns=['target_rides_next_hour'])
         logger.info(f'Loaded batch of features from local files at {local_file}')
         return features
+
+    return load_batches_of_features_from_store(current_date, current_date + timedelta(hours=1))
+
+
+@instrumented('load_batches_of_features_from_store')
+def load_batches_of_features_from_store(
+    from_date: pd.Timestamp,
+    to_date: pd.Timestamp,
+) -> pd.DataFrame:
+    """Fetches the batches of features for every hour in [`from_date`, `to_date`)
+
+    The time-series data is loaded once, and the features of all hours are cut
+    from it as sliding windows of `config.N_FEATURES` hours, in a single pass.
+    In local mode, the time-series data is the one kept by the incremental
+    feature pipeline.
+
+    Returns:
+        pd.DataFrame: one row per `pickup_hour` and `pickup_location_id`, sorted
+        by both, with the same columns as `load_batch_of_features_from_store`
+    """
+    n_features = config.N_FEATURES
+    n_hours = int((to_date - from_date) // timedelta(hours=1))
+
+    # the features of the last hour end right before it
+    data_from = from_date - timedelta(hours=n_features)
+    data_to = to_date - timedelta(hours=1)
+    n_ts_hours = n_features + n_hours - 1
+
+    if config.SAVE_FEATURE_GROUP == 'local':
+        if not HourlyDemandCube.exists(config.TS_DATA_CUBE):
+            raise FileNotFoundError(
+                'No local time-series data found. Run the feature pipeline with --incremental first.'
+            )
+        ts_store = HourlyDemandCube.load(config.TS_DATA_CUBE).slice_hours(data_from, data_to)
+        if ts_store.n_hours < n_ts_hours or ts_store.hour_origin != data_from:
+            raise ValueError(
+                f'Local time-series data only covers {ts_store.hour_origin} to '
+                f'{ts_store.hour_end}, but the features need {data_from} to {data_to}'
+            )
+        logger.info(f'Loaded time-series data from local files at {config.TS_DATA_CUBE}')
     elif config.SAVE_FEATURE_GROUP == 'feature_store':
         logger.info('Loading batch of features from the feature store')
         feature_view = get_or_create_feature_view(FEATURE_VIEW_METADATA)
@@ -69,38 +112,101 @@ def load_batch_of_features_from_store(
             start_time=data_from - timedelta(days=1),
             end_time=data_to + timedelta(days=1)
         )
-    
-    # filter data to the time period we are interested in
-    pickup_ts_from = int(data_from.timestamp() * 1000)
-    pickup_ts_to = int(data_to.timestamp() * 1000)
-    ts_data['pickup_ts'] = ts_data['pickup_hour'].astype(int) // 10**6
-    ts_data = ts_data[ts_data.pickup_ts.between(pickup_ts_from, pickup_ts_to)].copy()
-
-    # sort data by location and time
-    ts_data.sort_values(by=['pickup_location_id', 'pickup_hour'], inplace=True)
-
-    # validate we are not missing data in the feature store
-    location_ids = ts_data['pickup_location_id'].unique()
-    #assert len(ts_data) == config.N_FEATURES * len(location_ids), \
-    #   "Time-series data is not complete. Make sure your feature pipeline is up and runnning."
-
-    # transpose time-series data as a feature vector, for each `pickup_location_id`
-    x = np.ndarray(shape=(len(location_ids), n_features), dtype=np.float32)
-    for i, location_id in enumerate(location_ids):
-        ts_data_i = ts_data.loc[ts_data.pickup_location_id == location_id, :]
-        ts_data_i = ts_data_i.sort_values(by=['pickup_hour'])
-        x[i, :] = ts_data_i['rides'].values
+
+        # transpose time-series data as a feature vector, for each `pickup_location_id`
+        rides, location_ids, missing = _pivot_ts_data(ts_data, data_from, n_ts_hours)
+        _warn_missing_hours(missing, data_from)
+        ts_store = HourlyDemandCube(rides=rides, hour_origin=data_from, location_ids=location_ids)
+
+    # one (locations, n_features) matrix per hour, stacked, in a single copy
+    x = np.empty((n_hours, ts_store.n_locations, n_features), dtype=np.float32)
+    x[...] = ts_store.windows(n_features).transpose(1, 0, 2)
 
     # numpy arrays to Pandas dataframes
     features = pd.DataFrame(
-        x,
+        x.reshape(-1, n_features),
         columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(n_features))]
     )
+    features['pickup_hour'] = np.repeat(
+        pd.date_range(from_date, periods=n_hours, freq='H'), ts_store.n_locations
+    )
+    features['pickup_location_id'] = np.tile(ts_store.location_ids, n_hours)
+
+    return features
+
+
+def _load_batch_of_features_from_rolling_window(
+    current_date: pd.Timestamp,
+) -> Optional[pd.DataFrame]:
+    """Batch of features for `current_date` read from the local rolling window,
+    or `None` if there is none or it does not end right before `current_date`"""
+    if not RollingWindow.exists(config.ROLLING_WINDOW):
+        return None
+
+    window = RollingWindow.load(config.ROLLING_WINDOW)
+    x = window.get_features(current_date) if window.n_hours == config.N_FEATURES else None
+    if x is None:
+        logger.info(f'Rolling window ends at {window.hour_end}, not at {current_date}')
+        return None
+
+    features = pd.DataFrame(
+        x,
+        columns=[f'rides_previous_{i+1}_hour' for i in reversed(range(window.n_hours))]
+    )
     features['pickup_hour'] = current_date
-    features['pickup_location_id'] = location_ids
-    features.sort_values(by=['pickup_location_id'], inplace=True)
+    features['pickup_location_id'] = window.location_ids
+    logger.info(f'Loaded batch of features from the rolling window at {config.ROLLING_WINDOW}')
 
     return features
+
+
+def _warn_missing_hours(missing: np.ndarray, from_hour: pd.Timestamp) -> None:
+    """Validates we are not missing data in the feature store"""
+    if not missing.any():
+        return
+
+    missing_hours = pd.date_range(from_hour, periods=missing.shape[1], freq='H')[missing.any(axis=0)]
+    logger.warning(
+        f'Time-series data is not complete: {missing.sum()} (location, hour) pairs '
+        f'are missing in {len(missing_hours)} hours, from {missing_hours[0]} to '
+        f'{missing_hours[-1]}. They are filled with 0 rides. Make sure your feature '
+        'pipeline is up and running.'
+    )
+
+
+def _pivot_ts_data(
+    ts_data: pd.DataFrame,
+    from_hour: pd.Timestamp,
+    n_hours: int,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scatters the rides of `ts_data` in the `n_hours` hours from `from_hour` into
+    a (locations, hours) float32 matrix, in a single pass
+
+    Returns:
+        - the matrix, with 0s where `ts_data` has no row
+        - the sorted `pickup_location_id` of each row of the matrix
+        - a boolean matrix of the same shape, True where `ts_data` has no row
+    """
+    # hour of each row, relative to `from_hour`, using Unix milliseconds
+    pickup_ts = ts_data['pickup_hour'].astype(int).to_numpy() // 10**6
+    pickup_ts_from = int(from_hour.timestamp() * 1000)
+    hour_index = (pickup_ts - pickup_ts_from) // (3600 * 1000)
+
+    # keep only the rows in the time period we are interested in
+    in_window = (hour_index >= 0) & (hour_index < n_hours)
+    hour_index = hour_index[in_window]
+    location_ids, location_index = np.unique(
+        ts_data['pickup_location_id'].to_numpy()[in_window], return_inverse=True
+    )
+
+    x = np.zeros((len(location_ids), n_hours), dtype=np.float32)
+    x[location_index, hour_index] = ts_data['rides'].to_numpy()[in_window]
+
+    missing = np.ones(x.shape, dtype=bool)
+    missing[location_index, hour_index] = False
+
+    return x, location_ids, missing
     
 
 def load_model_from_registry():
@@ -114,8 +220,7 @@ def load_model_from_registry():
         logger.info(f'Loaded model from local file at {model_dir}')
     elif config.SAVE_FEATURE_GROUP == 'feature_store':
         logger.info('Loading model from the model registry')
-        project = get_hopsworks_project()
-        model_registry = project.get_model_registry()
+        model_registry = hopsworks_session.get_model_registry()
 
         model = model_registry.get_model(
             name=config.MODEL_NAME,
@@ -149,18 +254,22 @@ def load_predictions_from_store(
             - `predicted_demand`
             - `pickup_hour`
     """
-    from src.config import FEATURE_VIEW_PREDICTIONS_METADATA
-    from src.feature_store_api import get_or_create_feature_view
+    print(f'Fetching predictions for `pickup_hours` between {from_pickup_hour}  and {to_pickup_hour}')
+    if config.SAVE_FEATURE_GROUP == 'local':
+        # the local store only reads the partitions in the range
+        predictions = load_predictions(from_pickup_hour, to_pickup_hour)
+    else:
+        from src.config import FEATURE_VIEW_PREDICTIONS_METADATA
+        from src.feature_store_api import get_or_create_feature_view
 
-    # get pointer to the feature view
-    predictions_fv = get_or_create_feature_view(FEATURE_VIEW_PREDICTIONS_METADATA)
+        # get pointer to the feature view
+        predictions_fv = get_or_create_feature_view(FEATURE_VIEW_PREDICTIONS_METADATA)
 
-    # get data from the feature view
-    print(f'Fetching predictions for `pickup_hours` between {from_pickup_hour}  and {to_pickup_hour}')
-    predictions = predictions_fv.get_batch_data(
-        start_time=from_pickup_hour - timedelta(days=1),
-        end_time=to_pickup_hour + timedelta(days=1)
-    )
+        # get data from the feature view
+        predictions = predictions_fv.get_batch_data(
+            start_time=from_pickup_hour - timedelta(days=1),
+            end_time=to_pickup_hour + timedelta(days=1)
+        )
     
     # make sure datetimes are UTC aware
     predictions['pickup_hour'] = pd.to_datetime(predictions['pickup_hour'], utc=True)
@@ -0,0 +1,173 @@
+"""
+Per-stage metrics of the pipelines: wall time, peak RSS and rows.
+
+Wrap a stage with the `stage` context manager or the `instrumented`
+decorator, and call `write_metrics` at the end of the run:
+
+    @instrumented('load_raw_data')
+    def load_raw_data(...) -> pd.DataFrame:
+        ...
+
+    with stage('predict') as record:
+        predictions = model.predict(features)
+        record['rows'] = len(predictions)
+
+    write_metrics('inference_pipeline')
+
+`write_metrics` appends one JSON line per stage to
+METRICS_DIR/<pipeline>.jsonl, to graph the runs over time, and replaces
+METRICS_DIR/<pipeline>.prom with the stages of the last run in the
+Prometheus text format, e.g. for the node_exporter textfile collector.
+"""
+import functools
+import json
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+from src.atomic_write import atomic_write
+from src.paths import METRICS_DIR
+from src.logger import get_logger
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+logger = get_logger()
+
+METRIC_PREFIX = 'taxi_demand_stage'
+
+_lock = threading.Lock()
+_records: List[Dict] = []
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Dict]:
+    """Records the wall time and peak RSS of the code in the `with` block as
+    stage `name`. Set `rows` on the yielded record to count rows too"""
+    record = {
+        'stage': name,
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'rows': None,
+    }
+    peak_rss_before = _get_peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        yield record
+        record['ok'] = True
+    except BaseException:
+        record['ok'] = False
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['peak_rss_mb'] = _get_peak_rss_mb()
+        # the peak RSS of the process never goes down, so this is how much the
+        # stage raised it, 0 if it stayed below the previous peak
+        record['peak_rss_increase_mb'] = \
+            None if peak_rss_before is None else record['peak_rss_mb'] - peak_rss_before
+        with _lock:
+            _records.append(record)
+
+
+def instrumented(name: str) -> Callable:
+    """Decorator recording every call as stage `name`, see `stage`. The rows
+    are those of the returned DataFrame or array (the first one, if a tuple
+    is returned), or else of the first argument"""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                result = function(*args, **kwargs)
+                record['rows'] = _count_rows(result)
+                if record['rows'] is None and args:
+                    record['rows'] = _count_rows(args[0])
+            return result
+        return wrapper
+    return decorator
+
+
+def get_records() -> List[Dict]:
+    """Stages recorded since the last `write_metrics`"""
+    with _lock:
+        return list(_records)
+
+
+def write_metrics(pipeline: str, metrics_dir: Optional[Path] = None) -> Optional[Path]:
+    """Writes the stages recorded so far as a run of `pipeline` and starts a
+    new run. Returns the JSON lines file, or None if nothing was recorded"""
+    with _lock:
+        records = list(_records)
+        _records.clear()
+    if not records:
+        return None
+
+    metrics_dir = Path(metrics_dir or METRICS_DIR)
+    metrics_dir.mkdir(parents=True, exist_ok=True)
+    run_id = uuid.uuid4().hex
+
+    jsonl_file = metrics_dir / f'{pipeline}.jsonl'
+    with open(jsonl_file, 'a') as f:
+        for record in records:
+            f.write(json.dumps({'run_id': run_id, 'pipeline': pipeline, **record}) + '\n')
+
+    prom_file = metrics_dir / f'{pipeline}.prom'
+    # replaced at once, so the collector never reads half a file
+    with atomic_write(prom_file, 'w') as f:
+        f.write(_to_prometheus(pipeline, records))
+
+    logger.info(f'Saved metrics of {len(records)} stages to {jsonl_file}')
+    return jsonl_file
+
+
+def _to_prometheus(pipeline: str, records: List[Dict]) -> str:
+    """Records in the Prometheus text format. Stages that ran several times
+    are added up, except for the peak RSS, which is the maximum"""
+    stages: Dict[str, Dict] = {}
+    for record in records:
+        totals = stages.setdefault(record['stage'], {
+            'seconds': 0.0, 'rows': 0, 'peak_rss_mb': 0.0, 'calls': 0, 'failures': 0,
+        })
+        totals['seconds'] += record['seconds']
+        totals['rows'] += record['rows'] or 0
+        totals['peak_rss_mb'] = max(totals['peak_rss_mb'], record['peak_rss_mb'] or 0.0)
+        totals['calls'] += 1
+        totals['failures'] += not record['ok']
+
+    lines = []
+    for metric, description in [
+        ('seconds', 'Wall time of the stage in the last run'),
+        ('rows', 'Rows returned by the stage in the last run'),
+        ('peak_rss_mb', 'Peak RSS of the process at the end of the stage, in MiB'),
+        ('calls', 'Times the stage ran in the last run'),
+        ('failures', 'Times the stage raised an error in the last run'),
+    ]:
+        lines.append(f'# HELP {METRIC_PREFIX}_{metric} {description}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_{metric} gauge')
+        for name, totals in stages.items():
+            lines.append(
+                f'{METRIC_PREFIX}_{metric}{{pipeline="{pipeline}",stage="{name}"}} {totals[metric]}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+def _get_peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+def _count_rows(result) -> Optional[int]:
+    if isinstance(result, tuple):
+        result = result[0] if result else None
+    if hasattr(result, 'shape') and len(getattr(result, 'shape')) > 0:
+        return int(result.shape[0])
+    return None
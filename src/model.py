@@ -1,6 +1,6 @@
 import pandas as pd
 from sklearn.preprocessing import FunctionTransformer
-from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.base import BaseEstimator, RegressorMixin, TransformerMixin
 from sklearn.pipeline import make_pipeline, Pipeline
 
 import lightgbm as lgb
@@ -42,6 +42,34 @@ class TemporalFeaturesEngineer(BaseEstimator, TransformerMixin):
         
         return X_.drop(columns=['pickup_hour'])
 
+
+class BoosterRegressor(BaseEstimator, RegressorMixin):
+    """
+    Scikit-learn regressor around a LightGBM booster trained outside of
+    scikit-learn, e.g. from shards of features too large for memory. It ends
+    the pipeline of `get_pipeline` in place of its LGBMRegressor, and exposes
+    the booster as `booster_` too.
+    """
+    def __init__(self, booster: lgb.Booster = None):
+        self.booster = booster
+
+    @property
+    def booster_(self) -> lgb.Booster:
+        return self.booster
+
+    def fit(self, X, y=None):
+        # the booster is trained already
+        return self
+
+    def __sklearn_is_fitted__(self) -> bool:
+        return self.booster is not None
+
+    def predict(self, X):
+        if isinstance(X, pd.DataFrame):
+            X = X[self.booster.feature_name()]
+        return self.booster.predict(X)
+
+
 def get_pipeline(**hyperparams) -> Pipeline:
 
     # sklearn transform
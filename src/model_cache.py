@@ -0,0 +1,145 @@
+"""
+Local cache of the models downloaded from the model registry, one directory
+per model name and version in MODEL_CACHE_DIR.
+
+Entries are downloaded into a temporary directory and renamed into place once
+complete, so concurrent jobs never read a half-written `model.pkl`. Only the
+`config.MODEL_CACHE_SIZE` most recently used versions are kept.
+
+The latest version of each model is cached too, so jobs running within
+`config.MODEL_VERSION_TTL_SECONDS` of each other skip the registry lookup.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import src.config as config
+from src.atomic_write import atomic_write
+from src.paths import MODELS_DIR
+from src.logger import get_logger
+
+logger = get_logger()
+
+MODEL_CACHE_DIR = MODELS_DIR / 'registry_cache'
+
+# latest version of every (model name, status) looked up in the registry
+VERSIONS_FILE = MODEL_CACHE_DIR / 'latest_versions.json'
+
+
+def get_cached_model_dir(model_name: str, version: str) -> Optional[Path]:
+    """Directory of the cached `version` of `model_name`, or `None` if it is
+    not in the cache"""
+    model_dir = _get_model_dir(model_name, version)
+    if not (model_dir / 'model.pkl').exists():
+        return None
+
+    # mark it as the most recently used entry
+    os.utime(model_dir)
+    return model_dir
+
+
+def add_model_to_cache(
+    model_name: str,
+    version: str,
+    download: Callable[[Path], None],
+) -> Path:
+    """
+    Runs `download(output_dir)`, which must write the `model.pkl` of `version`
+    to `output_dir`, and atomically moves the result into the cache. Then
+    evicts the least recently used entries.
+
+    Returns:
+        Path: directory of the cached model
+    """
+    model_dir = _get_model_dir(model_name, version)
+    model_dir.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f'.{model_dir.name}.', dir=model_dir.parent))
+    try:
+        download(tmp_dir)
+        if not (tmp_dir / 'model.pkl').exists():
+            raise FileNotFoundError(f'No model.pkl in the download of {model_name} version {version}')
+
+        try:
+            os.rename(tmp_dir, model_dir)
+        except OSError:
+            # another job cached the same version in the meantime
+            if not (model_dir / 'model.pkl').exists():
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    logger.info(f'Cached {model_name} version {version} at {model_dir}')
+    os.utime(model_dir)
+    evict_models(keep=model_dir)
+
+    return model_dir
+
+
+def evict_models(
+    max_models: Optional[int] = None,
+    keep: Optional[Path] = None,
+) -> List[Path]:
+    """
+    Deletes the least recently used models until at most `max_models` are
+    left (default `config.MODEL_CACHE_SIZE`), never deleting `keep`, and
+    returns the deleted directories
+    """
+    max_models = config.MODEL_CACHE_SIZE if max_models is None else max_models
+
+    model_dirs = [
+        model_dir for model_dir in MODEL_CACHE_DIR.glob('*/*')
+        if model_dir.is_dir() and not model_dir.name.startswith('.')
+    ]
+    model_dirs.sort(key=lambda model_dir: model_dir.stat().st_mtime, reverse=True)
+
+    evicted = []
+    for model_dir in model_dirs[max_models:]:
+        if model_dir == keep:
+            continue
+        # rename it first, so no job loads it while it is being deleted
+        trash_dir = model_dir.with_name(f'.{model_dir.name}.evicted.{os.getpid()}')
+        try:
+            os.rename(model_dir, trash_dir)
+        except OSError:
+            # already evicted by another job
+            continue
+        shutil.rmtree(trash_dir, ignore_errors=True)
+        evicted.append(model_dir)
+        logger.info(f'Evicted {model_dir} from the model cache')
+
+    return evicted
+
+
+def get_cached_version(model_name: str, status: str, max_age_seconds: float) -> Optional[str]:
+    """Latest version of `model_name` with `status`, if it was looked up less
+    than `max_age_seconds` ago"""
+    entry = _load_versions().get(f'{model_name}/{status}')
+    if entry is None or time.time() - entry['looked_up_at'] > max_age_seconds:
+        return None
+    return entry['version']
+
+
+def save_version(model_name: str, status: str, version: str) -> None:
+    """Records `version` as the latest version of `model_name` with `status`"""
+    versions = _load_versions()
+    versions[f'{model_name}/{status}'] = {'version': version, 'looked_up_at': time.time()}
+
+    MODEL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with atomic_write(VERSIONS_FILE, 'w') as f:
+        json.dump(versions, f)
+
+
+def _load_versions() -> dict:
+    if not VERSIONS_FILE.exists():
+        return {}
+    with open(VERSIONS_FILE) as f:
+        return json.load(f)
+
+
+def _get_model_dir(model_name: str, version: str) -> Path:
+    return MODEL_CACHE_DIR / model_name / str(version)
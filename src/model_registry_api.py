@@ -1,50 +1,67 @@
 import os
+from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Tuple, Union
 import pickle
 
 import comet_ml
 from comet_ml import API
 from dotenv import load_dotenv
-import hopsworks
-from sklearn.pipeline import Pipeline
 import pandas as pd
 # import joblib
 
 import src.config as config
+import src.hopsworks_session as hopsworks_session
+from src.atomic_write import atomic_write
+from src.model_cache import (
+    add_model_to_cache,
+    get_cached_model_dir,
+    get_cached_version,
+    save_version,
+)
 from src.paths import MODELS_DIR, PARENT_DIR
+from src.tree_model import TreeModel, export_pipeline
+from src.instrumentation import instrumented
 from src.logger import get_logger
 
+if TYPE_CHECKING:
+    from sklearn.pipeline import Pipeline
+
 logger = get_logger()
 
 load_dotenv(PARENT_DIR / '.env')
 
-COMET_ML_API_KEY = os.environ["COMET_ML_API_KEY"]
-COMET_ML_WORKSPACE = os.environ["COMET_ML_WORKSPACE"]
-COMET_ML_PROJECT_NAME = os.environ['COMET_ML_PROJECT_NAME']
-
 
 def get_model_registry() -> None:
-    """Connects to Hopsworks and returns a pointer to the feature store
-
-    Returns:
-        hsfs.feature_store.FeatureStore: pointer to the feature store
+    """Connects to Hopsworks, once per process, and returns a pointer to the
+    model registry
     """
-    project = hopsworks.login(
-        project=config.HOPSWORKS_PROJECT_NAME,
-        api_key_value=config.HOPSWORKS_API_KEY
-    )
-    return project.get_model_registry()
+    return hopsworks_session.get_model_registry()
 
 def push_model_to_registry(
-    model: Pipeline,
+    model: 'Pipeline',
     model_name: str,
+    validation_features: Optional[pd.DataFrame] = None,
 ) -> int:
-    """"""
-    # save the model to disk
+    """
+    Pushes `model` to the registry, together with its export to
+    `src.tree_model`, which the inference pipeline loads without unpickling it.
+    The export is checked against `model.predict(validation_features)`, and
+    skipped if it does not match.
+    """
+    # save the model to disk, atomically so a concurrent job never reads it
+    # half-written
     model_file = MODELS_DIR / 'model.pkl'
-    with open(model_file, "wb") as f:
+    with atomic_write(model_file) as f:
         pickle.dump(model, f)
 
+    tree_model_file = MODELS_DIR / 'model.npz'
+    try:
+        export_pipeline(model, tree_model_file, validation_features=validation_features)
+    except (NotImplementedError, ValueError) as e:
+        logger.warning(f'Could not export the model to {tree_model_file}: {e}')
+        tree_model_file = None
+
     # Get the stale experiment from the global context to grab the API key and experiment ID.
     stale_experiment = comet_ml.get_global_experiment()
     
@@ -57,6 +74,8 @@ def push_model_to_registry(
     # log model as an experiment artifact
     logger.info(f"Starting logging model to Comet ML")
     experiment.log_model(model_name, str(model_file))
+    if tree_model_file is not None:
+        experiment.log_model(model_name, str(tree_model_file))
     logger.info(f"Finished logging model {model_name}")
     
     # TODO: get status dinamically
@@ -67,41 +86,94 @@ def push_model_to_registry(
     # end the experiment
     experiment.end()
 
-    # get model version of the latest production model
-    return get_latest_model_version(model_name, status='Production')
+    # get model version of the latest production model, skipping the cached
+    # lookup since we just registered a new one
+    return get_latest_model_version(model_name, status='Production', max_age_seconds=0)
 
 
-def get_latest_model_version(model_name: str, status: str) -> str:
+def get_latest_model_version(
+    model_name: str,
+    status: str,
+    api: Optional[API] = None,
+    max_age_seconds: Optional[float] = None,
+) -> str:
     """
     Returns the latest model version from the registry with the given `status`
+
+    The version looked up by a previous call is reused if it is less than
+    `max_age_seconds` old (default `config.MODEL_VERSION_TTL_SECONDS`). Pass 0
+    to always ask the registry.
     """
+    if max_age_seconds is None:
+        max_age_seconds = config.MODEL_VERSION_TTL_SECONDS
+
+    model_version = get_cached_version(model_name, status, max_age_seconds)
+    if model_version is not None:
+        return model_version
+
     # find all model versions from the given `model_name` registry and `status`
-    api = API(COMET_ML_API_KEY)
-    model_details = api.get_registry_model_details(COMET_ML_WORKSPACE, model_name)['versions']
+    api = api or API(os.environ['COMET_ML_API_KEY'])
+    model_details = api.get_registry_model_details(os.environ['COMET_ML_WORKSPACE'], model_name)['versions']
     model_versions = [md['version'] for md in model_details if md['status'] == status]
     
-    # return the latest model version
-    return max(model_versions)
+    # return the latest model version, comparing '1.10.0' > '1.9.0' as numbers
+    model_version = max(model_versions, key=_parse_version)
+    save_version(model_name, status, model_version)
 
+    return model_version
 
-def get_latest_model_from_registry(model_name: str, status: str) -> Pipeline:
-    """Returns the latest model from the registry"""
-    
+
+@instrumented('load_model')
+def get_latest_model_from_registry(
+    model_name: str,
+    status: str,
+    api: Optional[API] = None,
+    native: bool = True,
+) -> Union['Pipeline', TreeModel]:
+    """Returns the latest model from the registry
+
+    The model is only downloaded if its version is not in the local model
+    cache yet, see `src.model_cache`. If `native` and the model was exported to
+    `src.tree_model` when pushed, that export is returned instead of the
+    pickled pipeline. Both have the same `predict`.
+    """
     # get model version to download
-    model_version = get_latest_model_version(model_name, status)
-
-    # download model from registry
-    api = API(COMET_ML_API_KEY)
-    api.download_registry_model(
-        COMET_ML_WORKSPACE,
-        registry_name=model_name,
-        version=model_version,
-        output_path=MODELS_DIR,
-        expand=True
-    )
+    model_version = get_latest_model_version(model_name, status, api)
+
+    model_dir = get_cached_model_dir(model_name, model_version)
+    if model_dir is None:
+        # download model from registry
+        logger.info(f'Downloading {model_name} version {model_version} from the registry')
+        api = api or API(os.environ['COMET_ML_API_KEY'])
+        model_dir = add_model_to_cache(
+            model_name,
+            model_version,
+            lambda output_path: api.download_registry_model(
+                os.environ['COMET_ML_WORKSPACE'],
+                registry_name=model_name,
+                version=model_version,
+                output_path=str(output_path),
+                expand=True
+            ),
+        )
+    else:
+        logger.info(f'Found {model_name} version {model_version} in the local model cache')
 
     # load model from local file to memory
-    with open(MODELS_DIR / 'model.pkl', "rb") as f:
-        model = pickle.load(f)
+    if native and (model_dir / 'model.npz').exists():
+        return _load_model(str(model_dir / 'model.npz'))
+    return _load_model(str(model_dir / 'model.pkl'))
+
+
+@lru_cache(maxsize=config.MODEL_CACHE_SIZE)
+def _load_model(model_file: str) -> Union['Pipeline', TreeModel]:
+    """Loads `model_file`. Cached entries never change, so a long-running
+    process can keep the loaded models in memory"""
+    if model_file.endswith('.npz'):
+        return TreeModel.load(model_file)
+    with open(model_file, "rb") as f:
+        return pickle.load(f)
+
 
-    return model
\ No newline at end of file
+def _parse_version(version: str) -> Tuple:
+    return tuple((int(part), '') if part.isdigit() else (-1, part) for part in version.split('.'))
@@ -7,6 +7,7 @@ RAW_DATA_DIR = PARENT_DIR / 'data' / 'raw'
 TRANSFORMED_DATA_DIR = PARENT_DIR / 'data' / 'transformed'
 DATA_CACHE_DIR = PARENT_DIR / 'data' / 'cache'
 MODELS_DIR = PARENT_DIR / 'models'
+METRICS_DIR = PARENT_DIR / 'data' / 'metrics'
 
 if not Path(DATA_DIR).exists():
     os.mkdir(DATA_DIR)
@@ -21,4 +22,7 @@ if not Path(DATA_CACHE_DIR).exists():
     os.mkdir(DATA_CACHE_DIR)
 
 if not Path(MODELS_DIR).exists():
-    os.mkdir(MODELS_DIR)
\ No newline at end of file
+    os.mkdir(MODELS_DIR)
+
+if not Path(METRICS_DIR).exists():
+    os.mkdir(METRICS_DIR)
\ No newline at end of file
@@ -0,0 +1,247 @@
+"""
+Long-running prediction service. It keeps the production model and the
+predictions for the most recent batches of features in memory, so requests
+are answered without touching the feature store or the model registry:
+
+    GET  /predict?location_id=43&hour=2024-01-10T10:00:00
+    GET  /predict?location_id=43,48,50
+    POST /predict  {"location_ids": [43, 48], "hour": "2024-01-10T10:00:00"}
+    GET  /health
+
+`hour` defaults to the most recent hour loaded. A background thread loads the
+features of every new hour, and reloads the model when a new production
+version appears in the registry, looked up at most every
+`config.MODEL_VERSION_TTL_SECONDS`.
+"""
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+import src.config as config
+from src.inference import get_model_predictions, load_batch_of_features_from_store
+from src.logger import get_logger
+
+logger = get_logger()
+
+
+class PredictionService:
+    """
+    In-memory predictions of the production model for the last `max_hours`
+    batches of features
+
+    Args:
+        load_features: returns the batch of features for a given hour, see
+        `src.inference.load_batch_of_features_from_store`
+        load_model: given the version currently served, returns the
+        (version, model) to serve instead, or `None` if it did not change
+    """
+    def __init__(
+        self,
+        load_features: Callable[[pd.Timestamp], pd.DataFrame] = load_batch_of_features_from_store,
+        load_model: Optional[Callable[[Optional[str]], Optional[Tuple[str, object]]]] = None,
+        max_hours: int = 24,
+    ):
+        self._load_features = load_features
+        self._load_model = load_model or _load_production_model
+        self._max_hours = max_hours
+
+        self.model_version = None
+        self._model = None
+        self._features = OrderedDict()
+
+        # pickup_hour -> {pickup_location_id: predicted_demand}. Refreshes
+        # replace it as a whole, so requests never see a half-updated state
+        self._predictions = OrderedDict()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, current_date: pd.Timestamp) -> None:
+        """Reloads the model if there is a new version, and loads the features
+        and predictions of `current_date` if they are not in memory yet"""
+        current_date = _to_hour(current_date)
+
+        with self._refresh_lock:
+            new_model = self._load_model(self.model_version)
+            if new_model is not None:
+                logger.info(f'Serving model version {new_model[0]}, previously {self.model_version}')
+                self.model_version, self._model = new_model
+
+            if current_date not in self._features:
+                logger.info(f'Loading batch of features for {current_date}')
+                self._features[current_date] = self._load_features(current_date)
+                while len(self._features) > self._max_hours:
+                    self._features.popitem(last=False)
+
+            if new_model is None and current_date in self._predictions:
+                return
+
+            predictions = OrderedDict()
+            for pickup_hour, features in self._features.items():
+                if new_model is None and pickup_hour in self._predictions:
+                    predictions[pickup_hour] = self._predictions[pickup_hour]
+                else:
+                    predictions[pickup_hour] = _predict(self._model, features)
+            self._predictions = predictions
+
+    def predict(
+        self,
+        location_ids: List[int],
+        hour: Optional[pd.Timestamp] = None,
+    ) -> List[Dict]:
+        """
+        Predicted demand for `location_ids` at `hour`, the most recent hour
+        loaded by default
+
+        Raises:
+            KeyError: if `hour` or any of `location_ids` is not in memory
+        """
+        predictions = self._predictions
+        hour = next(reversed(predictions), None) if hour is None else _to_hour(hour)
+        if hour not in predictions:
+            raise KeyError(f'hour {hour}')
+
+        results = []
+        for location_id in location_ids:
+            if location_id not in predictions[hour]:
+                raise KeyError(f'location {location_id}')
+            results.append({
+                'pickup_location_id': location_id,
+                'pickup_hour': hour.isoformat(),
+                'predicted_demand': predictions[hour][location_id],
+                'model_version': self.model_version,
+            })
+
+        return results
+
+    def health(self) -> Dict:
+        return {
+            'model_version': self.model_version,
+            'pickup_hours': [hour.isoformat() for hour in self._predictions],
+        }
+
+
+def serve(
+    service: PredictionService,
+    host: str = '0.0.0.0',
+    port: int = 8000,
+) -> ThreadingHTTPServer:
+    """HTTP server answering with `service`, call `serve_forever()` to start it"""
+    handler = type('Handler', (_PredictionRequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def start_reloading(service: PredictionService, interval_seconds: float) -> threading.Event:
+    """Refreshes `service` with the current hour every `interval_seconds`, in a
+    background thread, until the returned event is set. Failed refreshes are
+    logged, and the service keeps answering with what it has in memory."""
+    def reload():
+        while not stop.wait(interval_seconds):
+            try:
+                service.refresh(pd.Timestamp(datetime.utcnow()))
+            except Exception:
+                logger.exception('Failed to refresh the prediction service')
+
+    stop = threading.Event()
+    threading.Thread(target=reload, name='prediction-service-reload', daemon=True).start()
+    return stop
+
+
+class _PredictionRequestHandler(BaseHTTPRequestHandler):
+
+    # keep connections open between requests, and send the headers and the
+    # body without waiting for the client to acknowledge the headers
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    service: PredictionService = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            return self._send(200, self.service.health())
+        if url.path != '/predict':
+            return self._send(404, {'error': f'Unknown path {url.path}'})
+
+        query = parse_qs(url.query)
+        try:
+            location_ids = [
+                int(location_id)
+                for value in query.get('location_id', [])
+                for location_id in value.split(',')
+            ]
+            hour = query['hour'][0] if 'hour' in query else None
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+
+        self._predict(location_ids, hour)
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/predict':
+            return self._send(404, {'error': f'Unknown path {self.path}'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            location_ids = [int(location_id) for location_id in body['location_ids']]
+            hour = body.get('hour')
+        except (ValueError, KeyError, TypeError) as e:
+            return self._send(400, {'error': f'Invalid request body: {e}'})
+
+        self._predict(location_ids, hour)
+
+    def _predict(self, location_ids: List[int], hour: Optional[str]):
+        if not location_ids:
+            return self._send(400, {'error': 'Missing location_id'})
+        try:
+            predictions = self.service.predict(location_ids, hour)
+        except KeyError as e:
+            return self._send(404, {'error': f'No prediction for {e.args[0]}'})
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+
+        self._send(200, {'predictions': predictions})
+
+    def _send(self, status: int, content: Dict):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # one log line per request would cost more than answering it
+        pass
+
+
+def _predict(model, features: pd.DataFrame) -> Dict[int, float]:
+    predictions = get_model_predictions(model, features)
+    return dict(zip(
+        predictions['pickup_location_id'].tolist(),
+        predictions['predicted_demand'].tolist(),
+    ))
+
+
+def _load_production_model(current_version: Optional[str]) -> Optional[Tuple[str, object]]:
+    """Latest production model from the registry, if its version is not
+    `current_version`"""
+    # imported here, so the service can run with another model loader
+    # without the model registry credentials
+    from src.model_registry_api import get_latest_model_from_registry, get_latest_model_version
+
+    # the registry is only asked once the cached version is older than
+    # config.MODEL_VERSION_TTL_SECONDS, not on every reload
+    model_version = get_latest_model_version(config.MODEL_NAME, 'Production')
+    if model_version == current_version:
+        return None
+    return model_version, get_latest_model_from_registry(config.MODEL_NAME, 'Production')
+
+
+def _to_hour(date) -> pd.Timestamp:
+    """Naive UTC timestamp of the hour of `date`"""
+    date = pd.Timestamp(date)
+    if date.tz is not None:
+        date = date.tz_convert(None)
+    return date.floor('H')
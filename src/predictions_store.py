@@ -0,0 +1,77 @@
+"""
+Local store of model predictions, used when SAVE_FEATURE_GROUP is 'local'.
+
+Every pickup_hour is written to its own Parquet partition in PREDICTIONS_DIR,
+so new predictions never overwrite older hours, and re-running an hour only
+replaces that hour. Partitions are named after their hour, so reading a range
+opens only the partitions of the hours inside it, and there is no shared index
+that concurrent writers would have to update.
+"""
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+from src.atomic_write import atomic_write
+from src.paths import DATA_CACHE_DIR
+from src.logger import get_logger
+
+logger = get_logger()
+
+PREDICTIONS_DIR = DATA_CACHE_DIR / 'predictions'
+
+
+def save_predictions(predictions: pd.DataFrame) -> List[Path]:
+    """Writes `predictions` to one partition per hour of pickup_hour, replacing
+    the partitions of those hours if they exist, and returns their paths"""
+    PREDICTIONS_DIR.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    # floored, so all the predictions of an hour end up in its one partition
+    pickup_hours = _to_naive_utc(pd.to_datetime(predictions['pickup_hour'])).dt.floor('H')
+    for pickup_hour, predictions_one_hour in predictions.groupby(pickup_hours.to_numpy()):
+        path = PREDICTIONS_DIR / f'{_get_partition_key(pd.Timestamp(pickup_hour))}.parquet'
+        with atomic_write(path) as f:
+            predictions_one_hour.to_parquet(f, index=False)
+        paths.append(path)
+
+    logger.info(f'Saved predictions for {len(paths)} pickup_hours to {PREDICTIONS_DIR}')
+    return paths
+
+
+def load_predictions(
+    from_pickup_hour: datetime,
+    to_pickup_hour: datetime,
+) -> pd.DataFrame:
+    """
+    Predictions with `from_pickup_hour` <= pickup_hour <= `to_pickup_hour`,
+    sorted by pickup_hour and pickup_location_id. Only the partitions of those
+    hours are read.
+    """
+    pickup_hours = pd.date_range(
+        _to_naive_utc(pd.Timestamp(from_pickup_hour)).ceil('H'),
+        _to_naive_utc(pd.Timestamp(to_pickup_hour)).floor('H'),
+        freq='H',
+    )
+    # hours without predictions have no partition
+    paths = [PREDICTIONS_DIR / f'{_get_partition_key(pickup_hour)}.parquet' for pickup_hour in pickup_hours]
+    paths = [path for path in paths if path.exists()]
+    if not paths:
+        return pd.DataFrame(columns=['pickup_location_id', 'predicted_demand', 'pickup_hour', 'pickup_ts'])
+
+    predictions = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+    return predictions.sort_values(by=['pickup_hour', 'pickup_location_id'], ignore_index=True)
+
+
+def _get_partition_key(pickup_hour: pd.Timestamp) -> str:
+    """Name of the partition of `pickup_hour`. Keys sort like the hours"""
+    return f'pickup_hour={pickup_hour:%Y-%m-%dT%H}'
+
+
+def _to_naive_utc(dates):
+    """Partitions are keyed by UTC hours, without time zone"""
+    if isinstance(dates, pd.Series):
+        return dates.dt.tz_convert(None) if dates.dt.tz is not None else dates
+    return dates.tz_convert(None) if dates.tz is not None else dates
+
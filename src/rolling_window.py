@@ -0,0 +1,129 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.atomic_write import atomic_write
+from src.demand_cube import HourlyDemandCube, ONE_HOUR
+from src.paths import DATA_CACHE_DIR
+
+
+@dataclass
+class RollingWindow:
+    """Ring buffer with the rides of the last `n_hours` hours per location,
+    the only history the model needs at inference time.
+
+    Column `(head + j) % n_hours` of `rides` holds the rides at
+    `hour_end - n_hours + j hours`, so moving the window forward by one hour
+    overwrites a single column instead of shifting the whole array, and the
+    batch of features is one roll of it.
+    """
+    rides: np.ndarray
+    head: int
+    hour_end: pd.Timestamp
+    location_ids: np.ndarray
+    # hours before `valid_from` were never filled in
+    valid_from: pd.Timestamp
+
+    @property
+    def n_hours(self) -> int:
+        return self.rides.shape[1]
+
+    @property
+    def hour_origin(self) -> pd.Timestamp:
+        """Oldest pickup_hour in the window"""
+        return self.hour_end - self.n_hours * ONE_HOUR
+
+    @classmethod
+    def from_cube(cls, cube: HourlyDemandCube, n_hours: int) -> 'RollingWindow':
+        """Window with the last `n_hours` hours of `cube`"""
+        window = cls(
+            rides=np.zeros((cube.n_locations, n_hours), dtype=np.float32),
+            head=0,
+            hour_end=cube.hour_end,
+            location_ids=cube.location_ids,
+            valid_from=cube.hour_origin,
+        )
+        return window.update(cube)
+
+    def update(self, cube: HourlyDemandCube) -> 'RollingWindow':
+        """Moves the window forward to the end of `cube`, if it is newer, and
+        writes the hours of `cube` inside the window, in place
+
+        Hours re-processed by the feature pipeline are overwritten, and hours
+        that roll into the window without being in `cube` have 0 rides.
+        """
+        if not np.isin(cube.location_ids, self.location_ids).all():
+            self._add_locations(cube.location_ids)
+
+        if cube.hour_end > self.hour_end:
+            n_new_hours = int((cube.hour_end - self.hour_end) // ONE_HOUR)
+            if cube.hour_origin > self.hour_end:
+                # the hours in between are missing
+                self.valid_from = cube.hour_origin
+
+            # the columns of the oldest hours are reused for the newest ones
+            self.rides[:, (self.head + np.arange(min(n_new_hours, self.n_hours))) % self.n_hours] = 0
+            self.head = (self.head + n_new_hours) % self.n_hours
+            self.hour_end = cube.hour_end
+
+        cube = cube.slice_hours(self.hour_origin, self.hour_end)
+        start = int((cube.hour_origin - self.hour_origin) // ONE_HOUR)
+        columns = (self.head + start + np.arange(cube.n_hours)) % self.n_hours
+        rows = np.searchsorted(self.location_ids, cube.location_ids)
+        self.rides[np.ix_(rows, columns)] = cube.rides
+
+        return self
+
+    def get_features(self, current_date: pd.Timestamp) -> Optional[np.ndarray]:
+        """(n_locations, n_hours) float32 matrix with the rides of the `n_hours`
+        hours before `current_date`, oldest first, or `None` if the window does
+        not end right before `current_date` or is not filled in yet"""
+        if self.hour_end != pd.Timestamp(current_date) or self.valid_from > self.hour_origin:
+            return None
+        return np.concatenate([self.rides[:, self.head:], self.rides[:, :self.head]], axis=1)
+
+    def _add_locations(self, location_ids: np.ndarray) -> None:
+        """Adds rows with 0 rides for the `location_ids` not in the window yet"""
+        all_location_ids = np.union1d(self.location_ids, location_ids)
+        rides = np.zeros((len(all_location_ids), self.n_hours), dtype=self.rides.dtype)
+        rides[np.searchsorted(all_location_ids, self.location_ids)] = self.rides
+        self.rides = rides
+        self.location_ids = all_location_ids
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """Saves the window to the `.npz` file `path`, relative to DATA_CACHE_DIR"""
+        path = DATA_CACHE_DIR / path
+
+        # a single file, replaced at once, so readers never see the rides of
+        # one version with the head of another
+        with atomic_write(path) as f:
+            np.savez(
+                f,
+                rides=self.rides,
+                head=self.head,
+                location_ids=self.location_ids,
+                hour_end=self.hour_end.isoformat(),
+                valid_from=self.valid_from.isoformat(),
+            )
+
+        return path
+
+    @staticmethod
+    def exists(path: Union[str, Path]) -> bool:
+        """Whether a window was saved to `path`, relative to DATA_CACHE_DIR"""
+        return (DATA_CACHE_DIR / path).exists()
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'RollingWindow':
+        """Loads a window saved with `save`"""
+        with np.load(DATA_CACHE_DIR / path) as window:
+            return cls(
+                rides=window['rides'],
+                head=int(window['head']),
+                hour_end=pd.Timestamp(str(window['hour_end'])),
+                location_ids=window['location_ids'],
+                valid_from=pd.Timestamp(str(window['valid_from'])),
+            )
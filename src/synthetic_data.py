@@ -0,0 +1,97 @@
+"""
+Seeded generator of synthetic raw ride files, with the same layout as the
+NYC TLC yellow taxi Parquet files, so the data pipeline can be run and
+benchmarked offline.
+"""
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# relative demand for each hour of the day, quiet at night and peaking in the evening
+HOURLY_PROFILE = np.array([
+    0.5, 0.35, 0.25, 0.15, 0.15, 0.25, 0.6, 0.9, 1.1, 1.1, 1.1, 1.15,
+    1.2, 1.2, 1.25, 1.3, 1.35, 1.5, 1.6, 1.5, 1.35, 1.3, 1.1, 0.8,
+])
+
+
+def generate_rides(
+    year: int,
+    month: int,
+    n_locations: int = 265,
+    rides_per_location_per_hour: float = 2.0,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Generates the rides of one month, with TLC column names and dtypes
+
+    Every location gets its own average demand, modulated by the hour of the
+    day, and the number of rides per location and hour is Poisson distributed.
+    The output only depends on (`year`, `month`, `seed`) and the sizes, so
+    each month can be generated on its own.
+
+    Returns:
+        pd.DataFrame: columns `tpep_pickup_datetime`, `tpep_dropoff_datetime`,
+        `PULocationID`, `DOLocationID`, `passenger_count`, `trip_distance` and
+        `fare_amount`, in no particular order like the real files
+    """
+    rng = np.random.default_rng([seed, year, month])
+
+    month_start = pd.Timestamp(year=year, month=month, day=1)
+    n_hours = int((month_start + pd.offsets.MonthBegin(1) - month_start) / pd.Timedelta(hours=1))
+    hours = pd.date_range(month_start, periods=n_hours, freq='H')
+
+    # a few busy locations and a long tail of quiet ones
+    location_demand = rng.lognormal(mean=0.0, sigma=1.0, size=n_locations)
+    location_demand *= rides_per_location_per_hour / location_demand.mean()
+    rates = np.outer(HOURLY_PROFILE[hours.hour], location_demand)
+    n_rides = rng.poisson(rates).ravel()
+
+    # rides are laid out hour by hour, location by location
+    hour_offsets = np.repeat(np.repeat(np.arange(n_hours), n_locations), n_rides)
+    location_ids = np.repeat(np.tile(np.arange(1, n_locations + 1), n_hours), n_rides)
+    n = len(location_ids)
+
+    pickup_seconds = hour_offsets.astype(np.int64) * 3600 + rng.integers(0, 3600, n)
+    pickup_datetime = month_start.to_datetime64() + pickup_seconds.astype('timedelta64[s]')
+    trip_seconds = rng.gamma(shape=2.0, scale=400.0, size=n).astype(np.int64)
+    trip_distance = np.round(trip_seconds / 3600 * rng.uniform(5, 20, n), 2)
+
+    rides = pd.DataFrame({
+        'tpep_pickup_datetime': pickup_datetime.astype('datetime64[ns]'),
+        'tpep_dropoff_datetime': (pickup_datetime + trip_seconds.astype('timedelta64[s]')).astype('datetime64[ns]'),
+        'PULocationID': location_ids.astype(np.int64),
+        'DOLocationID': rng.integers(1, n_locations + 1, n),
+        'passenger_count': rng.integers(1, 5, n).astype(np.float64),
+        'trip_distance': trip_distance,
+        'fare_amount': np.round(3.0 + 2.5 * trip_distance, 2),
+    })
+
+    return rides.iloc[rng.permutation(n)].reset_index(drop=True)
+
+
+def write_raw_data_files(
+    data_dir: Path,
+    year: int,
+    months: List[int],
+    n_locations: int = 265,
+    rides_per_location_per_hour: float = 2.0,
+    seed: int = 0,
+) -> List[Path]:
+    """
+    Writes one synthetic `rides_{year}-{month}.parquet` file per month to
+    `data_dir`, the file names `src.data.load_raw_data` expects, and returns
+    their paths
+    """
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for month in months:
+        rides = generate_rides(year, month, n_locations, rides_per_location_per_hour, seed)
+        path = data_dir / f'rides_{year}-{month:02d}.parquet'
+        rides.to_parquet(path, index=False, row_group_size=100_000)
+        paths.append(path)
+
+    return paths
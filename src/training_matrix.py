@@ -0,0 +1,453 @@
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from sklearn.model_selection import TimeSeriesSplit
+from sklearn.pipeline import Pipeline
+
+import src.config as config
+from src.atomic_write import atomic_write
+from src.data import get_feature_and_target_windows
+from src.model import BoosterRegressor
+from src.tree_model import TEMPORAL_FEATURES
+
+# rows converted at a time when writing the matrix, to bound the memory used
+CHUNK_SIZE = 10_000
+
+
+class _TrainingRows:
+    """Splits of `TrainingMatrix` and `TrainingShards`, whose rows are sorted
+    by pickup_hour"""
+    feature_names: List[str]
+    pickup_hours: np.ndarray
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self), len(self.feature_names)
+
+    def split_by_date(self, cutoff_date: datetime) -> Tuple['_TrainingRows', '_TrainingRows']:
+        """Rows before and from `cutoff_date`, as views. Rows must be sorted
+        by pickup_hour, like those of `from_ts_data`"""
+        cutoff_date = _to_naive_utc(pd.DatetimeIndex([cutoff_date]))[0]
+        cutoff = int(np.searchsorted(self.pickup_hours, cutoff_date, side='left'))
+        assert (self.pickup_hours[:cutoff] < cutoff_date).all() and \
+            (self.pickup_hours[cutoff:] >= cutoff_date).all(), 'Rows are not sorted by pickup_hour'
+        return self[:cutoff], self[cutoff:]
+
+    def split(self, n_splits: int) -> Iterator[Tuple['_TrainingRows', '_TrainingRows']]:
+        """Training and validation rows of every `TimeSeriesSplit` fold, as
+        views. The folds are ranges of rows, so no row is copied"""
+        for train_index, val_index in TimeSeriesSplit(n_splits=n_splits).split(self.pickup_hours):
+            yield self[_to_slice(train_index)], self[_to_slice(val_index)]
+
+
+@dataclass
+class TrainingMatrix(_TrainingRows):
+    """
+    Model inputs as one C-contiguous float32 matrix, with the columns
+    LightGBM sees after `src.model.TemporalFeaturesEngineer`, the target, and
+    the pickup_hour of every row, as naive UTC datetime64. Slices of rows are
+    views of it, and LightGBM trains on them without converting or copying.
+
+    If saved to `.npy` files, processes that `load` the same directory
+    memory-map it, so they share the page cache instead of each holding a
+    pickled copy.
+    """
+    X: np.ndarray
+    y: np.ndarray
+    feature_names: List[str]
+    pickup_hours: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.y)
+
+    @classmethod
+    def from_ts_data(
+        cls,
+        ts_data: pd.DataFrame,
+        n_features: int,
+        step_size: int,
+    ) -> 'TrainingMatrix':
+        """
+        Same examples as `transform_ts_data_into_features_and_target`, written
+        straight into the matrix, without building the DataFrame, and sorted
+        by pickup_hour, so splitting them by date gives views.
+        """
+        windows = _Windows(ts_data, n_features, step_size)
+        X = np.empty((len(windows), len(windows.feature_names)), dtype=np.float32)
+        y = np.empty(len(windows), dtype=np.float32)
+        windows.fill(X, y, slice(None))
+
+        return cls(X=X, y=y, feature_names=windows.feature_names, pickup_hours=windows.pickup_hours)
+
+    @classmethod
+    def from_frame(
+        cls,
+        features: pd.DataFrame,
+        target: pd.Series,
+        directory: Optional[Union[str, Path]] = None,
+    ) -> 'TrainingMatrix':
+        """Matrix with `features` and `target`, in memory, or written to
+        `directory` and memory-mapped"""
+        columns = [c for c in features.columns if c != 'pickup_hour']
+        feature_names = columns + list(TEMPORAL_FEATURES)
+        shape = (len(features), len(feature_names))
+
+        if directory is None:
+            X = np.empty(shape, dtype=np.float32)
+        else:
+            directory = Path(directory)
+            directory.mkdir(parents=True, exist_ok=True)
+            X = np.lib.format.open_memmap(directory / 'X.npy', mode='w+', dtype=np.float32, shape=shape)
+
+        for start in range(0, len(features), CHUNK_SIZE):
+            chunk = features.iloc[start:start + CHUNK_SIZE]
+            X[start:start + len(chunk), :len(columns)] = chunk[columns].to_numpy(np.float32)
+            pickup_hour = pd.to_datetime(chunk['pickup_hour'])
+            for i, name in enumerate(TEMPORAL_FEATURES):
+                X[start:start + len(chunk), len(columns) + i] = TEMPORAL_FEATURES[name](pickup_hour)
+
+        matrix = cls(
+            X=X,
+            y=np.asarray(target, dtype=np.float32),
+            feature_names=feature_names,
+            pickup_hours=_to_naive_utc(pd.to_datetime(features['pickup_hour'])),
+        )
+        if directory is None:
+            return matrix
+
+        X.flush()
+        return matrix.save(directory)
+
+    def save(self, directory: Union[str, Path]) -> 'TrainingMatrix':
+        """Writes the matrix to `directory` and returns it memory-mapped"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        # `from_frame` already wrote X there
+        if not _is_saved_in(self.X, directory / 'X.npy'):
+            # to a new file, as X may be a slice of the one it replaces
+            with atomic_write(directory / 'X.npy') as f:
+                np.lib.format.write_array_header_1_0(f, {
+                    'descr': np.lib.format.dtype_to_descr(np.dtype(np.float32)),
+                    'fortran_order': False,
+                    'shape': self.X.shape,
+                })
+                for start in range(0, len(self), CHUNK_SIZE):
+                    f.write(np.ascontiguousarray(self.X[start:start + CHUNK_SIZE], dtype=np.float32).tobytes())
+
+        # y is memory-mapped from there too if the matrix was loaded from it
+        with atomic_write(directory / 'y.npy') as f:
+            np.save(f, self.y)
+        np.save(directory / 'pickup_hours.npy', self.pickup_hours)
+        # written last, see `exists`
+        with open(directory / 'feature_names.txt', 'w') as f:
+            f.write('\n'.join(self.feature_names))
+
+        return self.load(directory)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path]) -> 'TrainingMatrix':
+        """Memory-maps, read-only, a matrix written with `save`"""
+        directory = Path(directory)
+        with open(directory / 'feature_names.txt') as f:
+            feature_names = f.read().split('\n')
+        return cls(
+            X=np.load(directory / 'X.npy', mmap_mode='r'),
+            y=np.load(directory / 'y.npy', mmap_mode='r'),
+            feature_names=feature_names,
+            pickup_hours=np.load(directory / 'pickup_hours.npy'),
+        )
+
+    @staticmethod
+    def exists(directory: Union[str, Path]) -> bool:
+        return os.path.exists(Path(directory) / 'feature_names.txt')
+
+    def __getitem__(self, rows: slice) -> 'TrainingMatrix':
+        """Matrix with a range of rows, as views"""
+        return TrainingMatrix(
+            X=self.X[rows], y=self.y[rows], feature_names=self.feature_names,
+            pickup_hours=self.pickup_hours[rows],
+        )
+
+    def to_frame(self, rows: slice = slice(None)) -> pd.DataFrame:
+        """`rows` as the features DataFrame the pipeline of `src.model` takes,
+        e.g. to check a model on a sample. Copies them"""
+        n_columns = len(self.feature_names) - len(TEMPORAL_FEATURES)
+        features = pd.DataFrame(self.X[rows, :n_columns], columns=self.feature_names[:n_columns])
+        features['pickup_hour'] = self.pickup_hours[rows]
+        return features
+
+
+@dataclass
+class TrainingShards(_TrainingRows):
+    """
+    Training data too large to hold in memory, as `.npy` shards of consecutive
+    rows, with the same rows and columns as `TrainingMatrix.from_ts_data`.
+
+    `write` generates the shards one at a time from the time-series data, and
+    the shards are memory-mapped. LightGBM reads them through `X`, a batch of
+    rows at a time, so the raw features never are in memory at once. Only the
+    target and the pickup_hour of every row are.
+    """
+    shards: List[np.ndarray]
+    y: np.ndarray
+    feature_names: List[str]
+    pickup_hours: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.y)
+
+    @property
+    def X(self) -> List['_ShardSequence']:
+        """The shards, as a list of sequences `lgb.Dataset` reads as one"""
+        return [_ShardSequence(shard) for shard in self.shards]
+
+    @classmethod
+    def write(
+        cls,
+        ts_data: pd.DataFrame,
+        n_features: int,
+        step_size: int,
+        directory: Union[str, Path],
+        shard_size: Optional[int] = None,
+    ) -> 'TrainingShards':
+        """Writes the examples of `ts_data` to `directory`, in shards of
+        `shard_size` rows, TRAINING_SHARD_SIZE by default, and returns them"""
+        shard_size = shard_size or config.TRAINING_SHARD_SIZE
+        directory = Path(directory)
+        _clear_shards(directory)
+
+        windows = _Windows(ts_data, n_features, step_size)
+        y = np.empty(len(windows), dtype=np.float32)
+        for i, start in enumerate(range(0, len(windows), shard_size)):
+            rows = slice(start, min(start + shard_size, len(windows)))
+            X = np.lib.format.open_memmap(
+                directory / f'X-{i:05d}.npy', mode='w+', dtype=np.float32,
+                shape=(rows.stop - rows.start, len(windows.feature_names)),
+            )
+            windows.fill(X, y[rows], rows)
+            X.flush()
+            del X
+
+        _write_shards_metadata(directory, y, windows.pickup_hours, windows.feature_names)
+        return cls.load(directory)
+
+    def save(self, directory: Union[str, Path]) -> 'TrainingShards':
+        """Writes the shards to another `directory`, one at a time, and
+        returns them memory-mapped"""
+        directory = Path(directory)
+        _clear_shards(directory)
+
+        for i, shard in enumerate(self.shards):
+            X = np.lib.format.open_memmap(
+                directory / f'X-{i:05d}.npy', mode='w+', dtype=np.float32, shape=shard.shape,
+            )
+            for start in range(0, len(shard), CHUNK_SIZE):
+                X[start:start + CHUNK_SIZE] = shard[start:start + CHUNK_SIZE]
+            X.flush()
+            del X
+
+        _write_shards_metadata(directory, self.y, self.pickup_hours, self.feature_names)
+        return self.load(directory)
+
+    @classmethod
+    def load(cls, directory: Union[str, Path]) -> 'TrainingShards':
+        """Memory-maps, read-only, the shards written with `write` or `save`"""
+        directory = Path(directory)
+        with open(directory / 'feature_names.txt') as f:
+            feature_names = f.read().split('\n')
+        return cls(
+            shards=[np.load(shard_file, mmap_mode='r') for shard_file in sorted(directory.glob('X-*.npy'))],
+            y=np.load(directory / 'y.npy'),
+            feature_names=feature_names,
+            pickup_hours=np.load(directory / 'pickup_hours.npy'),
+        )
+
+    @staticmethod
+    def exists(directory: Union[str, Path]) -> bool:
+        return os.path.exists(Path(directory) / 'feature_names.txt')
+
+    def __getitem__(self, rows: slice) -> 'TrainingShards':
+        """Shards with a range of rows, as views"""
+        start, stop, step = rows.indices(len(self))
+        assert step == 1, 'Only ranges of consecutive rows are supported'
+        shards = []
+        offset = 0
+        for shard in self.shards:
+            shard_start, shard_stop = max(start - offset, 0), min(stop - offset, len(shard))
+            if shard_start < shard_stop:
+                shards.append(shard[shard_start:shard_stop])
+            offset += len(shard)
+        return TrainingShards(
+            shards=shards, y=self.y[start:stop], feature_names=self.feature_names,
+            pickup_hours=self.pickup_hours[start:stop],
+        )
+
+    def to_matrix(self) -> TrainingMatrix:
+        """The rows in memory, e.g. of a sample of `self[rows]`. Copies them"""
+        X = np.concatenate(self.shards) if self.shards \
+            else np.empty((0, len(self.feature_names)), dtype=np.float32)
+        return TrainingMatrix(
+            X=X, y=np.array(self.y), feature_names=self.feature_names,
+            pickup_hours=np.array(self.pickup_hours),
+        )
+
+    def to_frame(self, rows: slice = slice(None)) -> pd.DataFrame:
+        """See `TrainingMatrix.to_frame`. Copies only `rows`"""
+        return self[rows].to_matrix().to_frame()
+
+
+class _ShardSequence(lgb.Sequence):
+    """A memory-mapped shard, which LightGBM reads CHUNK_SIZE rows at a time"""
+    batch_size = CHUNK_SIZE
+
+    def __init__(self, shard: np.ndarray):
+        self.shard = shard
+
+    def __getitem__(self, idx):
+        # LightGBM samples single rows to bin the features, and only takes
+        # them as float64. Batches of rows it takes as they are
+        if isinstance(idx, slice):
+            return self.shard[idx]
+        return np.asarray(self.shard[idx], dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.shard)
+
+
+class _Windows:
+    """The examples of time-series data, as windows of its rides, in order of
+    pickup_hour, to write them to matrices a range of rows at a time"""
+
+    def __init__(self, ts_data: pd.DataFrame, n_features: int, step_size: int):
+        rides, window_starts, example_rows, location_ids = \
+            get_feature_and_target_windows(ts_data, n_features, step_size)
+        pickup_hours = _to_naive_utc(pd.to_datetime(ts_data['pickup_hour']).take(example_rows))
+
+        # stable, so examples of the same hour stay in order of location
+        order = np.argsort(pickup_hours, kind='stable')
+        self.window_starts = window_starts[order]
+        self.pickup_hours = pickup_hours[order]
+        self.location_ids = location_ids[order]
+
+        self.n_features = n_features
+        self.windows = sliding_window_view(rides, n_features + 1)
+        self.feature_names = [f'rides_previous_{i+1}_hour' for i in reversed(range(n_features))] \
+            + ['pickup_location_id'] + list(TEMPORAL_FEATURES)
+
+    def __len__(self) -> int:
+        return len(self.window_starts)
+
+    def fill(self, X: np.ndarray, y: np.ndarray, rows: slice) -> None:
+        """Writes the examples in `rows` to `X` and `y`, CHUNK_SIZE at a time"""
+        n_features = self.n_features
+        window_starts = self.window_starts[rows]
+        pickup_hours = self.pickup_hours[rows]
+        for start in range(0, len(window_starts), CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            x_and_y = self.windows[window_starts[chunk]]
+            X[chunk, :n_features] = x_and_y[:, :n_features]
+            y[chunk] = x_and_y[:, n_features]
+            X[chunk, n_features] = self.location_ids[rows][chunk]
+            for i, name in enumerate(TEMPORAL_FEATURES):
+                X[chunk, n_features + 1 + i] = TEMPORAL_FEATURES[name](pd.Series(pickup_hours[chunk]))
+
+
+def fit_pipeline(pipeline: Pipeline, data: _TrainingRows) -> Pipeline:
+    """Fits a pipeline of `src.model.get_pipeline` on a `TrainingMatrix` or
+    `TrainingShards`, without going through DataFrames. Its feature
+    engineering steps learn nothing, and the data already has their output,
+    so only the regressor is fitted. The fitted pipeline predicts from
+    DataFrames of features as usual.
+
+    The LGBMRegressor only fits arrays, so for shards a booster is trained
+    with its parameters, and replaces it as a `BoosterRegressor`"""
+    regressor = pipeline[-1]
+    if isinstance(data, TrainingMatrix):
+        regressor.fit(data.X, data.y, feature_name=data.feature_names)
+        return pipeline
+
+    # LightGBM takes the regressor's parameter names as aliases of its own
+    params = {
+        key: value for key, value in regressor.get_params().items()
+        if value is not None and key not in ('n_estimators', 'class_weight', 'importance_type')
+    }
+    params.setdefault('objective', 'regression')
+    train_set = lgb.Dataset(data.X, data.y, feature_name=data.feature_names, params=params)
+    booster = lgb.train(params, train_set, num_boost_round=regressor.n_estimators)
+    booster.free_dataset()
+
+    pipeline.steps[-1] = (pipeline.steps[-1][0], BoosterRegressor(booster))
+    return pipeline
+
+
+def predict_pipeline(pipeline: Pipeline, data: _TrainingRows) -> np.ndarray:
+    """Predictions of a pipeline fitted with `fit_pipeline` for the rows of
+    `data`, also without going through DataFrames"""
+    # the booster, as the regressor would warn that the matrix has no column names
+    return predict_booster(pipeline[-1].booster_, data)
+
+
+def predict_booster(booster: lgb.Booster, data: _TrainingRows, **kwargs) -> np.ndarray:
+    """`booster.predict` for the rows of `data`, one shard at a time for
+    `TrainingShards`"""
+    if isinstance(data, TrainingMatrix):
+        return booster.predict(data.X, **kwargs)
+    if not data.shards:
+        return np.empty(0)
+    return np.concatenate([booster.predict(shard, **kwargs) for shard in data.shards])
+
+
+def _is_saved_in(X: np.ndarray, path: Path) -> bool:
+    """Whether `X` is the whole array in the .npy file `path`, memory-mapped.
+    A slice of it keeps the file name, but not its shape, or is not contiguous"""
+    if not (isinstance(X, np.memmap) and X.filename is not None and Path(X.filename) == path.resolve()):
+        return False
+    return X.flags['C_CONTIGUOUS'] and X.shape == np.load(path, mmap_mode='r').shape
+
+
+def _clear_shards(directory: Path) -> None:
+    """Creates `directory`, or removes the shards in it"""
+    directory.mkdir(parents=True, exist_ok=True)
+    # first, so the directory does not `exist` until it is written again
+    if os.path.exists(directory / 'feature_names.txt'):
+        os.remove(directory / 'feature_names.txt')
+    for shard_file in directory.glob('X-*.npy'):
+        os.remove(shard_file)
+
+
+def _write_shards_metadata(
+    directory: Path,
+    y: np.ndarray,
+    pickup_hours: np.ndarray,
+    feature_names: List[str],
+) -> None:
+    np.save(directory / 'y.npy', y)
+    np.save(directory / 'pickup_hours.npy', pickup_hours)
+    # written last, see `exists`
+    with open(directory / 'feature_names.txt', 'w') as f:
+        f.write('\n'.join(feature_names))
+
+
+def _to_naive_utc(pickup_hours) -> np.ndarray:
+    """datetime64[ns] array of `pickup_hours` in UTC, without time zone"""
+    if isinstance(pickup_hours, pd.Series):
+        pickup_hours = pd.DatetimeIndex(pickup_hours)
+    if pickup_hours.tz is not None:
+        pickup_hours = pickup_hours.tz_convert(None)
+    return pickup_hours.to_numpy(dtype='datetime64[ns]')
+
+
+def _to_slice(index: np.ndarray) -> slice:
+    """The range of rows in `index`, which must be consecutive"""
+    if len(index) == 0:
+        return slice(0, 0)
+    assert index[-1] - index[0] + 1 == len(index), 'Fold rows are not consecutive'
+    return slice(int(index[0]), int(index[-1]) + 1)
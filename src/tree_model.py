@@ -0,0 +1,256 @@
+"""
+Array-based export of the pipelines built by `src.model.get_pipeline`, and a
+NumPy evaluator for it.
+
+Scoring the exported model needs neither scikit-learn nor LightGBM, nor
+unpickling the pipeline, so it loads in milliseconds:
+
+    export_pipeline(pipeline, MODELS_DIR / 'model.npz')
+    model = TreeModel.load(MODELS_DIR / 'model.npz')
+    predictions = model.predict(features)
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from src.atomic_write import atomic_write
+
+# columns `src.model.TemporalFeaturesEngineer` derives from `pickup_hour`
+TEMPORAL_FEATURES = {
+    'hour': lambda pickup_hour: pickup_hour.dt.hour,
+    'day_of_week': lambda pickup_hour: pickup_hour.dt.dayofweek,
+}
+
+# LightGBM missing value types, see `TreeModel`
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+MISSING_TYPES = {'None': MISSING_NONE, 'Zero': MISSING_ZERO, 'NaN': MISSING_NAN}
+
+# LightGBM treats values this close to 0 as 0
+ZERO_THRESHOLD = 1e-35
+
+# objectives whose raw scores go through exp() to get the predictions
+EXP_OBJECTIVES = ('poisson', 'gamma', 'tweedie')
+
+
+@dataclass
+class TreeModel:
+    """
+    Trees of a LightGBM regressor as flat arrays, one entry per node of all
+    trees. Leaves are nodes too, whose children are themselves, so every row
+    can walk `max_depth` steps down every tree in lockstep.
+
+    Like LightGBM, a numerical split sends a row left if its value is
+    <= `threshold`. Missing values go to the `default_left` side if the
+    split's missing type is NaN, and are treated as 0 otherwise. With missing
+    type Zero, zeros go to the `default_left` side too.
+    """
+    feature_names: List[str]
+    roots: np.ndarray
+    split_feature: np.ndarray
+    threshold: np.ndarray
+    missing_type: np.ndarray
+    default_left: np.ndarray
+    left_child: np.ndarray
+    right_child: np.ndarray
+    leaf_value: np.ndarray
+    max_depth: int
+    average_output: bool = False
+    exp_output: bool = False
+
+    def predict(self, features: pd.DataFrame) -> np.ndarray:
+        """Same predictions as the exported pipeline's `predict(features)`"""
+        X = self._get_feature_matrix(features)
+
+        # bound the (rows, trees) matrices of a batch to ~4M entries
+        batch_size = max(1, 2**22 // max(len(self.roots), 1))
+        predictions = np.concatenate([
+            self._predict_raw(X[start:start + batch_size])
+            for start in range(0, len(X), batch_size)
+        ]) if len(X) else np.zeros(0)
+
+        if self.average_output:
+            predictions /= len(self.roots)
+        if self.exp_output:
+            predictions = np.exp(predictions)
+        return predictions
+
+    def _predict_raw(self, X: np.ndarray) -> np.ndarray:
+        """Sum of the leaf values of every row of `X` over all trees"""
+        n_rows, n_features = X.shape
+
+        # children of node i at 2*i (right) and 2*i + 1 (left), so the next
+        # node is a single lookup
+        children = np.stack([self.right_child, self.left_child], axis=1).ravel().astype(np.intp)
+        split_feature = self.split_feature.astype(np.intp)
+
+        # missing values only need special care if there can be any
+        missing_zero = self.missing_type == MISSING_ZERO
+        missing_nan = self.missing_type == MISSING_NAN
+        check_missing = np.isnan(X).any() or missing_zero.any()
+
+        # node of every (row, tree), moved one level down per step
+        nodes = np.tile(self.roots.astype(np.intp), (n_rows, 1))
+        row_offsets = (np.arange(n_rows) * n_features)[:, None]
+        X = X.ravel()
+        for _ in range(self.max_depth):
+            value = X[row_offsets + split_feature[nodes]]
+            go_left = value <= self.threshold[nodes]
+
+            if check_missing:
+                is_nan = np.isnan(value)
+                is_missing = (missing_nan[nodes] & is_nan) | \
+                    (missing_zero[nodes] & ((np.abs(value) <= ZERO_THRESHOLD) | is_nan))
+                # NaN that is not treated as missing is compared as 0
+                go_left = np.where(is_nan & ~is_missing, 0.0 <= self.threshold[nodes], go_left)
+                go_left = np.where(is_missing, self.default_left[nodes], go_left)
+
+            nodes = children[2 * nodes + go_left]
+
+        return self.leaf_value[nodes].sum(axis=1)
+
+    def _get_feature_matrix(self, features: pd.DataFrame) -> np.ndarray:
+        """Model inputs, in the order the booster was trained with"""
+        X = np.empty((len(features), len(self.feature_names)), dtype=np.float64)
+
+        temporal = [i for i, name in enumerate(self.feature_names) if name in TEMPORAL_FEATURES]
+        other = [i for i, name in enumerate(self.feature_names) if name not in TEMPORAL_FEATURES]
+        X[:, other] = features[[self.feature_names[i] for i in other]].to_numpy(np.float64)
+        if temporal:
+            pickup_hour = pd.to_datetime(features['pickup_hour'])
+            for i in temporal:
+                X[:, i] = TEMPORAL_FEATURES[self.feature_names[i]](pickup_hour).to_numpy(np.float64)
+
+        return X
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """Saves the model as a single `.npz` file, atomically"""
+        path = Path(path)
+        with atomic_write(path) as f:
+            np.savez(
+                f,
+                feature_names=np.array(self.feature_names),
+                roots=self.roots,
+                split_feature=self.split_feature,
+                threshold=self.threshold,
+                missing_type=self.missing_type,
+                default_left=self.default_left,
+                left_child=self.left_child,
+                right_child=self.right_child,
+                leaf_value=self.leaf_value,
+                max_depth=self.max_depth,
+                average_output=self.average_output,
+                exp_output=self.exp_output,
+            )
+        return path
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'TreeModel':
+        with np.load(path) as model:
+            return cls(
+                feature_names=model['feature_names'].tolist(),
+                roots=model['roots'],
+                split_feature=model['split_feature'],
+                threshold=model['threshold'],
+                missing_type=model['missing_type'],
+                default_left=model['default_left'],
+                left_child=model['left_child'],
+                right_child=model['right_child'],
+                leaf_value=model['leaf_value'],
+                max_depth=int(model['max_depth']),
+                average_output=bool(model['average_output']),
+                exp_output=bool(model['exp_output']),
+            )
+
+
+def export_pipeline(
+    pipeline,
+    path: Union[str, Path],
+    validation_features: Optional[pd.DataFrame] = None,
+    tolerance: float = 1e-6,
+) -> TreeModel:
+    """
+    Exports the trained `pipeline` from `src.model.get_pipeline` to `path`
+
+    Args:
+        pipeline: fitted sklearn Pipeline ending with an LGBMRegressor
+        path: `.npz` file to write
+        validation_features: if given and not empty, the export fails unless
+        the exported model reproduces `pipeline.predict` on them within
+        `tolerance`
+
+    Raises:
+        NotImplementedError: if the booster has splits the evaluator does not
+        support, e.g. categorical ones
+        ValueError: if the exported model does not match the pipeline
+    """
+    booster = pipeline[-1].booster_
+    model_dump = booster.dump_model()
+    if model_dump.get('num_tree_per_iteration', 1) != 1:
+        raise NotImplementedError('Only single-output boosters can be exported')
+
+    nodes: Dict[str, list] = {key: [] for key in (
+        'split_feature', 'threshold', 'missing_type', 'default_left',
+        'left_child', 'right_child', 'leaf_value',
+    )}
+    roots = []
+    max_depth = 0
+
+    def add(node: dict, depth: int) -> int:
+        """Appends `node` and its subtree, and returns its index"""
+        nonlocal max_depth
+        max_depth = max(max_depth, depth)
+
+        index = len(nodes['split_feature'])
+        if 'leaf_value' in node:
+            # rows that reached a leaf stay there
+            for key, value in (
+                ('split_feature', 0), ('threshold', np.inf), ('missing_type', MISSING_NONE),
+                ('default_left', True), ('left_child', index), ('right_child', index),
+                ('leaf_value', node['leaf_value']),
+            ):
+                nodes[key].append(value)
+            return index
+
+        if node['decision_type'] != '<=':
+            raise NotImplementedError(f"Unsupported split type {node['decision_type']}")
+        for key, value in (
+            ('split_feature', node['split_feature']), ('threshold', node['threshold']),
+            ('missing_type', MISSING_TYPES[node['missing_type']]),
+            ('default_left', node['default_left']), ('left_child', None), ('right_child', None),
+            ('leaf_value', 0.0),
+        ):
+            nodes[key].append(value)
+        nodes['left_child'][index] = add(node['left_child'], depth + 1)
+        nodes['right_child'][index] = add(node['right_child'], depth + 1)
+        return index
+
+    for tree in model_dump['tree_info']:
+        roots.append(add(tree['tree_structure'], 0))
+
+    objective = model_dump.get('objective', '').split(' ')[0]
+    model = TreeModel(
+        feature_names=booster.feature_name(),
+        roots=np.array(roots, dtype=np.int32),
+        split_feature=np.array(nodes['split_feature'], dtype=np.int32),
+        threshold=np.array(nodes['threshold'], dtype=np.float64),
+        missing_type=np.array(nodes['missing_type'], dtype=np.int8),
+        default_left=np.array(nodes['default_left'], dtype=bool),
+        left_child=np.array(nodes['left_child'], dtype=np.int32),
+        right_child=np.array(nodes['right_child'], dtype=np.int32),
+        leaf_value=np.array(nodes['leaf_value'], dtype=np.float64),
+        max_depth=max_depth,
+        average_output=bool(model_dump.get('average_output', False)),
+        exp_output=objective in EXP_OBJECTIVES,
+    )
+
+    if validation_features is not None and len(validation_features) > 0:
+        expected = pipeline.predict(validation_features)
+        max_error = np.abs(model.predict(validation_features) - expected).max()
+        if max_error > tolerance * max(1.0, np.abs(expected).max()):
+            raise ValueError(f'Exported model differs from the pipeline by up to {max_error}')
+
+    model.save(path)
+    return model
@@ -0,0 +1,7 @@
+import os
+
+# src.config and the model registry read these, and the tests never reach
+# Hopsworks or Comet
+for name in ('HOPSWORKS_PROJECT_NAME', 'HOPSWORKS_API_KEY', 'COMET_ML_API_KEY', 'COMET_ML_WORKSPACE'):
+    os.environ.setdefault(name, 'test')
+os.environ.setdefault('SAVE_FEATURE_GROUP', 'local')
@@ -0,0 +1,29 @@
+import pytest
+
+from src.atomic_write import atomic_write
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'file.json'
+    path.write_text('old')
+
+    with atomic_write(path, 'w') as f:
+        f.write('new')
+        # not visible until the block exits
+        assert path.read_text() == 'old'
+
+    assert path.read_text() == 'new'
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_atomic_write_keeps_old_content_on_error(tmp_path):
+    path = tmp_path / 'file.json'
+    path.write_text('old')
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(path, 'w') as f:
+            f.write('partial')
+            raise RuntimeError
+
+    assert path.read_text() == 'old'
+    assert list(tmp_path.iterdir()) == [path]
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import add_missing_slots
+
+
+def add_missing_slots_baseline(ts_data: pd.DataFrame) -> pd.DataFrame:
+    """The per-location loop `add_missing_slots` replaced, as the reference"""
+    location_ids = range(1, ts_data['pickup_location_id'].max() + 1)
+
+    full_range = pd.date_range(ts_data['pickup_hour'].min(),
+                               ts_data['pickup_hour'].max(),
+                               freq='H')
+    output = pd.DataFrame()
+
+    for location_id in location_ids:
+
+        # keep only rides for this 'location_id'
+        ts_data_i = ts_data.loc[ts_data.pickup_location_id == location_id, ['pickup_hour', 'rides']]
+
+        if ts_data_i.empty:
+            # add a dummy entry with a 0
+            ts_data_i = pd.DataFrame.from_dict([
+                {'pickup_hour': ts_data['pickup_hour'].max(), 'rides': 0}
+            ])
+
+        ts_data_i.set_index('pickup_hour', inplace=True)
+        ts_data_i.index = pd.DatetimeIndex(ts_data_i.index)
+        ts_data_i = ts_data_i.reindex(full_range, fill_value=0)
+
+        # add back `location_id` columns
+        ts_data_i['pickup_location_id'] = location_id
+
+        output = pd.concat([output, ts_data_i])
+
+    # move the pickup_hour from the index to a dataframe column
+    output = output.reset_index().rename(columns={'index': 'pickup_hour'})
+
+    return output
+
+
+def make_sparse_ts_data(seed: int, n_locations: int = 12, n_hours: int = 72) -> pd.DataFrame:
+    """Hourly rides of random (location, hour) slots, with some locations
+    below `n_locations` missing entirely"""
+    rng = np.random.default_rng(seed)
+    hours = pd.date_range('2024-01-01', periods=n_hours, freq='H')
+    slots = pd.MultiIndex.from_product([range(1, n_locations + 1), hours]).to_frame(index=False)
+    slots.columns = ['pickup_location_id', 'pickup_hour']
+    missing_locations = rng.choice(np.arange(1, n_locations), size=3, replace=False)
+    slots = slots[~slots['pickup_location_id'].isin(missing_locations)]
+    ts_data = slots.sample(frac=0.3, random_state=seed).reset_index(drop=True)
+    ts_data['rides'] = rng.integers(1, 20, len(ts_data))
+    return ts_data[['pickup_hour', 'pickup_location_id', 'rides']]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_add_missing_slots_matches_baseline(seed):
+    ts_data = make_sparse_ts_data(seed)
+
+    expected = add_missing_slots_baseline(ts_data)
+    output = add_missing_slots(ts_data)
+
+    assert list(output.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(output.reset_index(drop=True), expected)
+
+
+def test_add_missing_slots_fills_locations_without_rides():
+    ts_data = pd.DataFrame({
+        'pickup_hour': pd.to_datetime(['2024-01-01 00:00', '2024-01-01 05:00']),
+        'pickup_location_id': [1, 3],
+        'rides': [4, 7],
+    })
+
+    output = add_missing_slots(ts_data)
+
+    # 6 hours for each of the 3 locations, and no dummy row for location 2
+    assert len(output) == 3 * 6
+    location_2 = output[output['pickup_location_id'] == 2]
+    assert len(location_2) == 6
+    assert (location_2['rides'] == 0).all()
+    pd.testing.assert_frame_equal(output.reset_index(drop=True), add_missing_slots_baseline(ts_data))
+
+
+def test_add_missing_slots_empty_input():
+    ts_data = pd.DataFrame({
+        'pickup_hour': pd.to_datetime([]),
+        'pickup_location_id': pd.Series([], dtype=np.int64),
+        'rides': pd.Series([], dtype=np.int64),
+    })
+
+    output = add_missing_slots(ts_data)
+
+    assert output.empty
+    assert list(output.columns) == ['pickup_hour', 'rides', 'pickup_location_id']
@@ -0,0 +1,51 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.demand_cube import HourlyDemandCube
+
+
+def test_from_ts_data_sums_rows_of_the_same_slot():
+    ts_data = pd.DataFrame({
+        'pickup_hour': pd.to_datetime([
+            '2024-01-01 00:00', '2024-01-01 00:00', '2024-01-01 00:30',
+            '2024-01-01 01:00', '2024-01-01 01:00', '2024-01-01 02:00',
+        ]),
+        'pickup_location_id': [1, 1, 1, 2, 2, 1],
+        'rides': [1, 2, 4, 40_000, 40_000, 3],
+    })
+    cube = HourlyDemandCube.from_ts_data(ts_data)
+
+    # wider integers, as the sum of location 2 does not fit in uint16
+    assert cube.rides.dtype == np.uint32
+    np.testing.assert_array_equal(cube.location(1), [7, 0, 3])
+    np.testing.assert_array_equal(cube.location(2), [0, 80_000, 0])
+
+
+def test_save_and_load(tmp_path, monkeypatch):
+    monkeypatch.setattr('src.demand_cube.DATA_CACHE_DIR', tmp_path)
+    cubes = [
+        HourlyDemandCube(
+            rides=np.full((3, 4 + i), i, dtype=np.uint16),
+            hour_origin=pd.Timestamp('2024-01-01', tz='UTC') + i * pd.Timedelta(hours=1),
+            location_ids=np.array([1, 2, 3 + i]),
+        )
+        for i in range(3)
+    ]
+
+    for cube in cubes:
+        previous_metadata = json.loads((tmp_path / 'cube' / 'metadata.json').read_text()) \
+            if HourlyDemandCube.exists('cube') else None
+        cube.save('cube')
+
+        loaded = HourlyDemandCube.load('cube')
+        np.testing.assert_array_equal(loaded.rides, cube.rides)
+        assert loaded.hour_origin == cube.hour_origin
+        np.testing.assert_array_equal(loaded.location_ids, cube.location_ids)
+
+    # a reader that got the metadata of the previous version right before the
+    # last save still finds the rides of that version
+    previous_rides = np.load(tmp_path / 'cube' / previous_metadata['rides_file'])
+    np.testing.assert_array_equal(previous_rides, cubes[-2].rides)
+    assert len(list((tmp_path / 'cube').glob('rides*.npy'))) == 2
@@ -0,0 +1,113 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import pytest
+import requests
+
+from src.download import FileNotAvailableError, IncompleteDownloadError, download_file
+
+CONTENT = bytes(range(256)) * 400
+
+
+class FakeFileServer(BaseHTTPRequestHandler):
+    """Serves CONTENT at /file with Range requests, after answering the first
+    requests with the status codes in `statuses`"""
+    statuses: List[int] = []
+    truncate: bool = False
+    ranges: List[Optional[str]] = []
+
+    def do_GET(self):
+        self.ranges.append(self.headers.get('Range'))
+        if self.statuses:
+            self.send_error(self.statuses.pop(0))
+            return
+        if self.path != '/file':
+            self.send_error(404)
+            return
+
+        start = int(self.headers['Range'][len('bytes='):].rstrip('-')) if self.headers['Range'] else 0
+        if start >= len(CONTENT):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(CONTENT)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = CONTENT[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        # a connection that drops halfway
+        self.wfile.write(body[:len(body) // 2] if self.truncate else body)
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FakeFileServer.statuses, FakeFileServer.truncate, FakeFileServer.ranges = [], False, []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeFileServer)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_download(server, tmp_path):
+    path = download_file(f'{server}/file', tmp_path / 'file', chunk_size=1000)
+
+    assert path.read_bytes() == CONTENT
+    assert not (tmp_path / 'file.part').exists()
+
+
+def test_download_resumes_partial_file(server, tmp_path):
+    (tmp_path / 'file.part').write_bytes(CONTENT[:1234])
+
+    download_file(f'{server}/file', tmp_path / 'file')
+
+    assert FakeFileServer.ranges == ['bytes=1234-']
+    assert (tmp_path / 'file').read_bytes() == CONTENT
+
+
+def test_download_keeps_complete_partial_file_on_416(server, tmp_path):
+    (tmp_path / 'file.part').write_bytes(CONTENT)
+
+    download_file(f'{server}/file', tmp_path / 'file', max_retries=0)
+
+    assert FakeFileServer.ranges == [f'bytes={len(CONTENT)}-']
+    assert (tmp_path / 'file').read_bytes() == CONTENT
+    assert not (tmp_path / 'file.part').exists()
+
+
+def test_download_retries_server_errors(server, tmp_path):
+    FakeFileServer.statuses = [503, 500]
+
+    download_file(f'{server}/file', tmp_path / 'file', max_retries=2, backoff=0)
+
+    assert len(FakeFileServer.ranges) == 3
+    assert (tmp_path / 'file').read_bytes() == CONTENT
+
+
+def test_download_missing_file(server, tmp_path):
+    with pytest.raises(FileNotAvailableError):
+        download_file(f'{server}/missing', tmp_path / 'file', backoff=0)
+
+    # not retried
+    assert len(FakeFileServer.ranges) == 1
+    assert not (tmp_path / 'file').exists()
+
+
+def test_download_leaves_no_truncated_file(server, tmp_path):
+    FakeFileServer.truncate = True
+
+    with pytest.raises((requests.RequestException, IncompleteDownloadError)):
+        download_file(f'{server}/file', tmp_path / 'file', chunk_size=1024, max_retries=1, backoff=0)
+
+    # the second attempt resumed from the bytes of the first
+    assert FakeFileServer.ranges == [None, f'bytes={len(CONTENT) // 2}-']
+    assert not (tmp_path / 'file').exists()
+    assert CONTENT.startswith((tmp_path / 'file.part').read_bytes())
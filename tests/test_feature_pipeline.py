@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from scripts import feature_pipeline
+from src import config
+from src.rolling_window import RollingWindow
+
+N_FEATURES = 6
+N_LOCATIONS = 4
+FIRST_RUN = pd.Timestamp('2024-03-01 00:00')
+# hourly runs, and a skipped one, as after a failed run
+RUNS = [FIRST_RUN + pd.Timedelta(hours=i) for i in range(12) if i != 5]
+
+
+@pytest.fixture
+def rides() -> pd.DataFrame:
+    """Rides around the runs, a fifth of which reach the warehouse up to an
+    hour after their pickup, so within config.LATE_DATA_LOOKBACK_HOURS"""
+    rng = np.random.default_rng(0)
+    hours = pd.date_range(FIRST_RUN - pd.Timedelta(days=2), RUNS[-1], freq='H')
+    n_rides = rng.poisson(3, size=(len(hours), N_LOCATIONS))
+    pickup_datetime = np.repeat(np.repeat(hours.to_numpy(), N_LOCATIONS), n_rides.ravel()) \
+        + rng.integers(0, 3600, n_rides.sum()).astype('timedelta64[s]')
+    is_late = rng.random(n_rides.sum()) < 0.2
+    return pd.DataFrame({
+        'pickup_datetime': pickup_datetime,
+        'pickup_location_id': np.repeat(np.tile(np.arange(1, N_LOCATIONS + 1), len(hours)), n_rides.ravel()),
+        'arrived_at': pickup_datetime
+            + np.where(is_late, rng.integers(0, 3600, n_rides.sum()), 0).astype('timedelta64[s]'),
+    })
+
+
+def get_features(rides: pd.DataFrame, current_date: pd.Timestamp) -> np.ndarray:
+    """(location, hour) rides of the N_FEATURES hours before `current_date`,
+    counted from the rides only"""
+    hours = pd.date_range(current_date - pd.Timedelta(hours=N_FEATURES), periods=N_FEATURES, freq='H')
+    counts = rides.groupby([rides['pickup_location_id'], rides['pickup_datetime'].dt.floor('H')]).size()
+    return counts.unstack(fill_value=0) \
+        .reindex(index=np.arange(1, N_LOCATIONS + 1), columns=hours, fill_value=0) \
+        .to_numpy(np.float32)
+
+
+def test_run_incremental_matches_full_recompute(rides, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'SAVE_FEATURE_GROUP', 'local')
+    monkeypatch.setattr(config, 'N_FEATURES', N_FEATURES)
+    monkeypatch.setattr(config, 'CUTOFF_DATE', 1)
+    monkeypatch.setattr(config, 'LATE_DATA_LOOKBACK_HOURS', 3)
+    monkeypatch.setattr('src.demand_cube.DATA_CACHE_DIR', tmp_path)
+    monkeypatch.setattr('src.rolling_window.DATA_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(feature_pipeline, 'WATERMARK_FILE', tmp_path / 'watermark.json')
+
+    now = {}
+
+    def fetch_ride_events_from_data_warehouse(from_date, to_date):
+        """The rides in [from_date, to_date) in the warehouse at the time of the run"""
+        arrived = rides[(rides['pickup_datetime'] >= from_date) & (rides['pickup_datetime'] < to_date)
+                        & (rides['arrived_at'] <= now['date'])]
+        return arrived[['pickup_datetime', 'pickup_location_id']].reset_index(drop=True)
+
+    inserted = {}
+    monkeypatch.setattr(feature_pipeline, 'fetch_ride_events_from_data_warehouse', fetch_ride_events_from_data_warehouse)
+    monkeypatch.setattr(feature_pipeline, 'feature_group_insert', lambda features: inserted.update({now['date']: features}))
+
+    for current_date in RUNS:
+        now['date'] = current_date
+        feature_pipeline.run_incremental(current_date.to_pydatetime())
+
+        # the full recompute sees the same rides, those in the warehouse by now
+        expected = get_features(rides[rides['arrived_at'] <= current_date], current_date)
+        features = inserted[current_date]
+        assert (features['pickup_hour'] == current_date).all()
+        np.testing.assert_array_equal(features['pickup_location_id'], np.arange(1, N_LOCATIONS + 1))
+        np.testing.assert_array_equal(
+            features[[f'rides_previous_{i + 1}_hour' for i in reversed(range(N_FEATURES))]].to_numpy(),
+            expected,
+        )
+        np.testing.assert_array_equal(
+            RollingWindow.load(config.ROLLING_WINDOW).get_features(current_date), expected,
+        )
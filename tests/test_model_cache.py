@@ -0,0 +1,109 @@
+import pickle
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+import src.model_cache as model_cache
+import src.model_registry_api as model_registry_api
+from src import config
+
+MODEL_NAME = 'taxi_demand_predictor'
+
+
+class StubAPI:
+    """Stand-in for `comet_ml.API` with a registry of `versions`, whose
+    downloads are pickled strings, or fail if `fail_downloads`"""
+
+    def __init__(self, versions):
+        self.versions = versions
+        self.fail_downloads = False
+        self.lookups = 0
+        self.downloads = []
+
+    def get_registry_model_details(self, workspace, registry_name):
+        self.lookups += 1
+        return {'versions': [{'version': version, 'status': 'Production'} for version in self.versions]}
+
+    def download_registry_model(self, workspace, registry_name, version, output_path, expand):
+        self.downloads.append(version)
+        with open(Path(output_path) / 'model.pkl', 'wb') as f:
+            if self.fail_downloads:
+                f.write(b'half a model')
+                raise ConnectionError('connection reset')
+            pickle.dump(f'model {version}', f)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Time of `src.model_cache`, moved forward by hand"""
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(model_cache, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_cache, 'MODEL_CACHE_DIR', tmp_path)
+    monkeypatch.setattr(model_cache, 'VERSIONS_FILE', tmp_path / 'latest_versions.json')
+    monkeypatch.setattr(config, 'MODEL_CACHE_SIZE', 2)
+    model_registry_api._load_model.cache_clear()
+    yield tmp_path
+    model_registry_api._load_model.cache_clear()
+
+
+def get_model(api: StubAPI):
+    return model_registry_api.get_latest_model_from_registry(MODEL_NAME, status='Production', api=api)
+
+
+def test_cache_hit_does_not_download(clock):
+    api = StubAPI(['1.0.0'])
+
+    assert get_model(api) == 'model 1.0.0'
+    # another process, with nothing loaded in memory
+    model_registry_api._load_model.cache_clear()
+    assert get_model(api) == 'model 1.0.0'
+
+    assert api.downloads == ['1.0.0']
+
+
+def test_least_recently_used_version_is_evicted(clock, cache_dir):
+    api = StubAPI([])
+    for version in ['1.0.0', '2.0.0', '1.0.0', '3.0.0']:
+        # a new version is registered, or the previous one is back in production
+        api.versions = [version]
+        clock.now += config.MODEL_VERSION_TTL_SECONDS + 1
+        assert get_model(api) == f'model {version}'
+
+    assert api.downloads == ['1.0.0', '2.0.0', '3.0.0']
+    # 2.0.0 was used less recently than 1.0.0
+    assert sorted(path.name for path in (cache_dir / MODEL_NAME).iterdir()) == ['1.0.0', '3.0.0']
+
+
+def test_version_is_looked_up_again_after_the_ttl(clock):
+    api = StubAPI(['1.0.0'])
+
+    assert get_model(api) == 'model 1.0.0'
+    api.versions.append('1.1.0')
+    clock.now += config.MODEL_VERSION_TTL_SECONDS - 1
+    assert get_model(api) == 'model 1.0.0'
+    assert api.lookups == 1
+
+    clock.now += 2
+    assert get_model(api) == 'model 1.1.0'
+    assert api.lookups == 2
+
+
+def test_failed_download_leaves_nothing_in_the_cache(clock, cache_dir):
+    api = StubAPI(['1.0.0'])
+    api.fail_downloads = True
+
+    with pytest.raises(ConnectionError):
+        get_model(api)
+
+    assert list((cache_dir / MODEL_NAME).iterdir()) == []
+
+    # and the next attempt downloads it again
+    api.fail_downloads = False
+    assert get_model(api) == 'model 1.0.0'
+    assert api.downloads == ['1.0.0', '1.0.0']
@@ -0,0 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import src.predictions_store as predictions_store
+from src.predictions_store import load_predictions, save_predictions
+
+FIRST_HOUR = pd.Timestamp('2024-03-01 00:00')
+
+
+@pytest.fixture(autouse=True)
+def predictions_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(predictions_store, 'PREDICTIONS_DIR', tmp_path / 'predictions')
+    return tmp_path / 'predictions'
+
+
+def make_predictions(from_hour: int, to_hour: int, predicted_demand: float = 1.0) -> pd.DataFrame:
+    """Predictions of 3 locations for the hours in [from_hour, to_hour) after FIRST_HOUR"""
+    pickup_hours = pd.date_range(FIRST_HOUR + pd.Timedelta(hours=from_hour), periods=to_hour - from_hour, freq='H')
+    predictions = pd.DataFrame({
+        'pickup_location_id': np.tile([3, 1, 2], len(pickup_hours)),
+        'predicted_demand': predicted_demand + np.arange(3 * len(pickup_hours), dtype=float),
+        'pickup_hour': np.repeat(pickup_hours, 3),
+    })
+    predictions['pickup_ts'] = predictions['pickup_hour'].astype('int64') // 10**6
+    return predictions
+
+
+def test_range_across_partitions():
+    # saved by several runs, and in no particular order
+    predictions = make_predictions(0, 48)
+    for from_hour, to_hour in [(24, 48), (0, 10), (10, 24)]:
+        save_predictions(predictions[predictions['pickup_hour'].between(
+            FIRST_HOUR + pd.Timedelta(hours=from_hour), FIRST_HOUR + pd.Timedelta(hours=to_hour - 1),
+        )])
+
+    # bounds in the middle of hours are rounded inwards, and aware ones are in UTC
+    loaded = load_predictions(
+        pd.Timestamp('2024-03-01 05:30', tz='UTC'), pd.Timestamp('2024-03-02 02:15', tz='Europe/Paris'),
+    )
+
+    expected = predictions[predictions['pickup_hour'].between('2024-03-01 06:00', '2024-03-02 01:00')]
+    pd.testing.assert_frame_equal(
+        loaded, expected.sort_values(by=['pickup_hour', 'pickup_location_id'], ignore_index=True),
+    )
+
+
+def test_range_with_missing_hours():
+    save_predictions(make_predictions(0, 3))
+    save_predictions(make_predictions(5, 8))
+
+    loaded = load_predictions(FIRST_HOUR + pd.Timedelta(hours=2), FIRST_HOUR + pd.Timedelta(hours=6))
+    assert list(loaded['pickup_hour'].unique()) == list(FIRST_HOUR + pd.to_timedelta([2, 5, 6], unit='h'))
+
+    assert load_predictions(FIRST_HOUR + pd.Timedelta(hours=3), FIRST_HOUR + pd.Timedelta(hours=4)).empty
+
+
+def test_overwritten_hour(predictions_dir):
+    save_predictions(make_predictions(0, 3))
+    # the second run of hour 1 replaces its predictions, and only those
+    save_predictions(make_predictions(1, 2, predicted_demand=100.0))
+
+    loaded = load_predictions(FIRST_HOUR, FIRST_HOUR + pd.Timedelta(hours=2))
+
+    assert len(list(predictions_dir.glob('*.parquet'))) == 3
+    np.testing.assert_array_equal(
+        loaded.groupby('pickup_hour')['predicted_demand'].sum(),
+        [1 + 2 + 3, 100 + 101 + 102, 7 + 8 + 9],
+    )
+
+
+def test_concurrent_writers():
+    # e.g. a backfill and the hourly run
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda hour: save_predictions(make_predictions(hour, hour + 1)), range(24)))
+
+    loaded = load_predictions(FIRST_HOUR, FIRST_HOUR + pd.Timedelta(hours=23))
+    assert loaded['pickup_hour'].nunique() == 24
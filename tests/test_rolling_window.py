@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.demand_cube import HourlyDemandCube, ONE_HOUR
+from src.rolling_window import RollingWindow
+
+N_HOURS = 5
+HOUR_ORIGIN = pd.Timestamp('2024-01-01')
+
+
+@pytest.fixture
+def cube() -> HourlyDemandCube:
+    """All the rides of 4 locations over 2 days, that runs of the feature
+    pipeline see slices of"""
+    rng = np.random.default_rng(0)
+    return HourlyDemandCube(
+        rides=rng.integers(0, 50, size=(4, 48)).astype(np.uint16),
+        hour_origin=HOUR_ORIGIN,
+        location_ids=np.array([3, 10, 11, 42]),
+    )
+
+
+def hours(from_hour: int, to_hour: int) -> dict:
+    return {'from_hour': HOUR_ORIGIN + from_hour * ONE_HOUR, 'to_hour': HOUR_ORIGIN + to_hour * ONE_HOUR}
+
+
+def assert_features_match_cube(window: RollingWindow, cube: HourlyDemandCube) -> None:
+    """The features of the window are the window of `cube` of the same hours"""
+    expected = cube.windows(N_HOURS)[:, cube.hour_index(window.hour_origin)]
+    rows = np.searchsorted(cube.location_ids, window.location_ids)
+    np.testing.assert_array_equal(window.get_features(window.hour_end), expected[rows])
+
+
+def test_from_cube(cube):
+    window = RollingWindow.from_cube(cube.slice_hours(**hours(0, 10)), n_hours=N_HOURS)
+
+    assert window.hour_end == HOUR_ORIGIN + 10 * ONE_HOUR
+    assert_features_match_cube(window, cube)
+    assert window.get_features(window.hour_end + ONE_HOUR) is None
+
+
+@pytest.mark.parametrize('lookback_hours', [0, 3, N_HOURS + 2])
+def test_update_hour_by_hour(cube, lookback_hours):
+    window = RollingWindow.from_cube(cube.slice_hours(**hours(0, 10)), n_hours=N_HOURS)
+
+    # each run re-processes `lookback_hours` hours before the new one
+    for hour_end in range(11, 40):
+        window.update(cube.slice_hours(**hours(hour_end - 1 - lookback_hours, hour_end)))
+        assert_features_match_cube(window, cube)
+
+
+@pytest.mark.parametrize('n_new_hours', [2, N_HOURS - 1, N_HOURS, N_HOURS + 1, 3 * N_HOURS + 2])
+def test_update_after_skipped_runs(cube, n_new_hours):
+    window = RollingWindow.from_cube(cube.slice_hours(**hours(0, 10)), n_hours=N_HOURS)
+
+    # the next run catches up on all the hours since the previous one, in
+    # which location 10 had no rides
+    cube.rides[1, 10:10 + n_new_hours] = 0
+    catch_up = cube.slice_hours(**hours(10, 10 + n_new_hours))
+    window.update(HourlyDemandCube(catch_up.rides[[0, 2, 3]], catch_up.hour_origin, cube.location_ids[[0, 2, 3]]))
+    assert window.hour_end == HOUR_ORIGIN + (10 + n_new_hours) * ONE_HOUR
+    assert_features_match_cube(window, cube)
+
+    window.update(cube.slice_hours(**hours(10 + n_new_hours, 11 + n_new_hours)))
+    assert_features_match_cube(window, cube)
+
+
+def test_update_with_missing_hours(cube):
+    window = RollingWindow.from_cube(cube.slice_hours(**hours(0, 10)), n_hours=N_HOURS)
+
+    # hours 10 and 11 were never processed, so the window is not valid until
+    # they roll out of it
+    window.update(cube.slice_hours(**hours(12, 13)))
+    assert window.get_features(window.hour_end) is None
+    for hour_end in range(14, 12 + N_HOURS):
+        window.update(cube.slice_hours(**hours(hour_end - 1, hour_end)))
+        assert window.get_features(window.hour_end) is None
+
+    window.update(cube.slice_hours(**hours(12 + N_HOURS - 1, 12 + N_HOURS)))
+    assert_features_match_cube(window, cube)
+
+
+def test_update_reprocessed_hours(cube):
+    window = RollingWindow.from_cube(cube.slice_hours(**hours(0, 20)), n_hours=N_HOURS)
+
+    # late rides changed hours already in the window, and one before it
+    corrected = HourlyDemandCube(cube.rides.copy(), cube.hour_origin, cube.location_ids)
+    corrected.rides[:, 14:18] += 7
+    window.update(corrected.slice_hours(**hours(14, 18)))
+
+    assert window.hour_end == HOUR_ORIGIN + 20 * ONE_HOUR
+    assert_features_match_cube(window, corrected)
+
+
+def test_update_new_locations(cube):
+    first_locations = cube.location_ids[[0, 2]]
+    window = RollingWindow.from_cube(
+        HourlyDemandCube(cube.rides[[0, 2], :10], HOUR_ORIGIN, first_locations), n_hours=N_HOURS,
+    )
+
+    # locations 10 and 42 have their first rides at hour 10
+    cube.rides[[1, 3], :10] = 0
+    window.update(cube.slice_hours(**hours(10, 11)))
+
+    np.testing.assert_array_equal(window.location_ids, cube.location_ids)
+    assert_features_match_cube(window, cube)
+
+    # and the next runs only have rides in some of the locations
+    for hour_end in range(12, 20):
+        rows = [hour_end % 4, (hour_end + 1) % 4]
+        cube.rides[[row for row in range(4) if row not in rows], hour_end - 1] = 0
+        window.update(HourlyDemandCube(
+            cube.rides[np.sort(rows), hour_end - 1:hour_end],
+            HOUR_ORIGIN + (hour_end - 1) * ONE_HOUR,
+            cube.location_ids[np.sort(rows)],
+        ))
+        assert_features_match_cube(window, cube)
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data import transform_ts_data_into_features_and_target
+from src.model import get_pipeline
+from src.training_matrix import TrainingMatrix, TrainingShards, fit_pipeline, predict_pipeline
+
+N_FEATURES = 24
+STEP_SIZE = 5
+# small, and not a divisor of the number of rows, so the last shard is partial
+SHARD_SIZE = 37
+
+
+@pytest.fixture(scope='module')
+def ts_data() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    n_locations = 4
+    pickup_hours = pd.date_range('2024-01-01', periods=24 * 10, freq='H', tz='UTC')
+    ts_data = pd.DataFrame({
+        'pickup_hour': np.tile(pickup_hours, n_locations),
+        'rides': rng.poisson(5, len(pickup_hours) * n_locations),
+        'pickup_location_id': np.repeat(np.arange(1, n_locations + 1), len(pickup_hours)),
+    })
+    ts_data['pickup_ts'] = ts_data['pickup_hour'].astype('int64') // 10**6
+    return ts_data
+
+
+@pytest.fixture(scope='module')
+def matrix(ts_data) -> TrainingMatrix:
+    return TrainingMatrix.from_ts_data(ts_data, N_FEATURES, STEP_SIZE)
+
+
+@pytest.fixture(scope='module')
+def shards(ts_data, tmp_path_factory) -> TrainingShards:
+    return TrainingShards.write(
+        ts_data, N_FEATURES, STEP_SIZE, tmp_path_factory.mktemp('shards'), shard_size=SHARD_SIZE,
+    )
+
+
+def test_matrix_matches_features_and_target(ts_data, matrix):
+    features, target = transform_ts_data_into_features_and_target(ts_data, N_FEATURES, STEP_SIZE)
+
+    # the matrix has the same examples, sorted by pickup_hour
+    order = np.argsort(pd.to_datetime(features['pickup_hour']).dt.tz_convert(None).to_numpy(), kind='stable')
+    features = features.iloc[order].reset_index(drop=True)
+    pd.testing.assert_frame_equal(
+        matrix.to_frame().drop(columns='pickup_hour'),
+        features.drop(columns='pickup_hour').astype(np.float32),
+    )
+    np.testing.assert_array_equal(matrix.y, np.asarray(target, dtype=np.float32)[order])
+
+
+def test_shards_match_matrix(matrix, shards):
+    assert [len(shard) for shard in shards.shards[:-1]] == [SHARD_SIZE] * (len(shards.shards) - 1)
+    assert 0 < len(shards.shards[-1]) < SHARD_SIZE
+    assert shards.shape == matrix.shape
+    assert shards.feature_names == matrix.feature_names
+
+    loaded = shards.to_matrix()
+    np.testing.assert_array_equal(loaded.X, matrix.X)
+    np.testing.assert_array_equal(loaded.y, matrix.y)
+    np.testing.assert_array_equal(loaded.pickup_hours, matrix.pickup_hours)
+
+
+@pytest.mark.parametrize('rows', [
+    slice(None),
+    slice(0, SHARD_SIZE),
+    slice(SHARD_SIZE - 3, SHARD_SIZE + 3),
+    slice(5, 3 * SHARD_SIZE + 1),
+    slice(-10, None),
+    slice(20, 20),
+])
+def test_shards_getitem(matrix, shards, rows):
+    sliced = shards[rows].to_matrix()
+
+    np.testing.assert_array_equal(sliced.X, matrix.X[rows])
+    np.testing.assert_array_equal(sliced.y, matrix.y[rows])
+    np.testing.assert_array_equal(sliced.pickup_hours, matrix.pickup_hours[rows])
+
+
+def test_shards_split_by_date(matrix, shards):
+    # an hour whose rows are in the middle of a shard
+    cutoff_date = pd.Timestamp(matrix.pickup_hours[SHARD_SIZE + SHARD_SIZE // 2], tz='UTC')
+    matrix_train, matrix_test = matrix.split_by_date(cutoff_date)
+    shards_train, shards_test = shards.split_by_date(cutoff_date)
+
+    assert 0 < len(matrix_train) < len(matrix)
+    assert len(shards_train.shards[-1]) < SHARD_SIZE
+    for shards_rows, matrix_rows in ((shards_train, matrix_train), (shards_test, matrix_test)):
+        np.testing.assert_array_equal(shards_rows.to_matrix().X, matrix_rows.X)
+        np.testing.assert_array_equal(shards_rows.y, matrix_rows.y)
+
+
+def test_shards_split(matrix, shards):
+    for (shards_train, shards_val), (matrix_train, matrix_val) in zip(shards.split(3), matrix.split(3)):
+        np.testing.assert_array_equal(shards_train.to_matrix().X, matrix_train.X)
+        np.testing.assert_array_equal(shards_val.to_matrix().X, matrix_val.X)
+
+
+def test_fit_and_predict_pipeline_on_shards_match_matrix(matrix, shards):
+    hyperparams = {'n_estimators': 15, 'num_leaves': 7, 'min_child_samples': 5, 'verbose': -1}
+    matrix_pipeline = fit_pipeline(get_pipeline(**hyperparams), matrix)
+    shards_pipeline = fit_pipeline(get_pipeline(**hyperparams), shards)
+
+    assert shards_pipeline[-1].booster_.num_trees() == matrix_pipeline[-1].booster_.num_trees()
+    predictions = predict_pipeline(shards_pipeline, shards)
+    np.testing.assert_array_equal(predictions, predict_pipeline(matrix_pipeline, matrix))
+    # and from DataFrames of features, as in the inference pipeline
+    np.testing.assert_allclose(shards_pipeline.predict(shards.to_frame()), predictions)
+
+
+@pytest.mark.parametrize('rows', [slice(None, 50), slice(30, None), slice(10, 60), slice(None)])
+def test_save_slice_of_matrix_loaded_from_the_same_directory(matrix, tmp_path, rows):
+    matrix.save(tmp_path)
+    expected = matrix[rows]
+
+    # the slice still maps X.npy of the whole matrix
+    saved = TrainingMatrix.load(tmp_path)[rows].save(tmp_path)
+
+    loaded = TrainingMatrix.load(tmp_path)
+    for matrix_ in (saved, loaded):
+        np.testing.assert_array_equal(matrix_.X, expected.X)
+        np.testing.assert_array_equal(matrix_.y, expected.y)
+        np.testing.assert_array_equal(matrix_.pickup_hours, expected.pickup_hours)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.model import get_pipeline
+from src.tree_model import MISSING_NAN, MISSING_ZERO, TreeModel, export_pipeline
+
+N_FEATURES = 8
+N_ROWS = 2000
+
+
+def make_features(rng: np.random.Generator, n_rows: int) -> pd.DataFrame:
+    features = pd.DataFrame(
+        rng.poisson(5, size=(n_rows, N_FEATURES)).astype(np.float32),
+        columns=[f'rides_previous_{i + 1}_hour' for i in reversed(range(N_FEATURES))],
+    )
+    features['pickup_hour'] = pd.Timestamp('2024-01-01') \
+        + pd.to_timedelta(rng.integers(0, 24 * 14, n_rows), unit='h')
+    features['pickup_location_id'] = rng.integers(1, 266, n_rows)
+    return features
+
+
+def make_target(features: pd.DataFrame) -> np.ndarray:
+    """Depends on the rides, and on both temporal features"""
+    rides = features.filter(like='rides_previous_').fillna(0).to_numpy()
+    pickup_hour = features['pickup_hour']
+    return rides[:, -1] + 0.5 * rides[:, -2] + (pickup_hour.dt.hour >= 17) * 4.0 \
+        + (pickup_hour.dt.dayofweek >= 5) * 3.0
+
+
+def with_missing_values(rng: np.random.Generator, features: pd.DataFrame, value: float) -> pd.DataFrame:
+    """`features` with `value` in about a fifth of the rides of the last 3 hours"""
+    features = features.copy()
+    for column in [f'rides_previous_{i}_hour' for i in (1, 2, 3)]:
+        features.loc[rng.random(len(features)) < 0.2, column] = value
+    return features
+
+
+def fit_and_export(features: pd.DataFrame, tmp_path, **hyperparams):
+    pipeline = get_pipeline(n_estimators=40, num_leaves=15, min_child_samples=5, verbose=-1, **hyperparams)
+    pipeline.fit(features, make_target(features))
+    model = export_pipeline(pipeline, tmp_path / 'model.npz')
+    return pipeline, model
+
+
+def assert_same_predictions(pipeline, model: TreeModel, features: pd.DataFrame, tmp_path) -> None:
+    expected = pipeline.predict(features)
+    np.testing.assert_allclose(model.predict(features), expected, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(TreeModel.load(tmp_path / 'model.npz').predict(features), expected, rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize('objective', ['regression', 'poisson'])
+def test_predict_matches_pipeline(tmp_path, objective):
+    rng = np.random.default_rng(0)
+    pipeline, model = fit_and_export(make_features(rng, N_ROWS), tmp_path, objective=objective)
+
+    assert_same_predictions(pipeline, model, make_features(rng, 500), tmp_path)
+
+
+def test_predict_matches_pipeline_on_temporal_features(tmp_path):
+    rng = np.random.default_rng(1)
+    pipeline, model = fit_and_export(make_features(rng, N_ROWS), tmp_path)
+
+    importance = dict(zip(pipeline[-1].booster_.feature_name(), pipeline[-1].booster_.feature_importance()))
+    assert importance['hour'] > 0 and importance['day_of_week'] > 0
+
+    # the same rides at every hour of a week
+    features = make_features(rng, 1).loc[np.zeros(24 * 7, dtype=int)].reset_index(drop=True)
+    features['pickup_hour'] = pd.date_range('2024-03-04', periods=24 * 7, freq='H')
+    assert_same_predictions(pipeline, model, features, tmp_path)
+
+
+def test_predict_matches_pipeline_with_nan(tmp_path):
+    rng = np.random.default_rng(2)
+    pipeline, model = fit_and_export(with_missing_values(rng, make_features(rng, N_ROWS), np.nan), tmp_path)
+    assert (model.missing_type == MISSING_NAN).any()
+
+    # NaN in features that had some in training, and in some that had none
+    features = with_missing_values(rng, make_features(rng, 500), np.nan)
+    features.loc[rng.random(500) < 0.2, 'rides_previous_8_hour'] = np.nan
+    assert_same_predictions(pipeline, model, features, tmp_path)
+
+
+def test_predict_matches_pipeline_with_zero_as_missing(tmp_path):
+    rng = np.random.default_rng(3)
+    pipeline, model = fit_and_export(
+        with_missing_values(rng, make_features(rng, N_ROWS), 0.0), tmp_path, zero_as_missing=True,
+    )
+    assert (model.missing_type == MISSING_ZERO).any()
+
+    features = with_missing_values(rng, make_features(rng, 500), 0.0)
+    features.loc[rng.random(500) < 0.1, 'rides_previous_2_hour'] = np.nan
+    assert_same_predictions(pipeline, model, features, tmp_path)
+
+
+def test_export_pipeline_checks_validation_features(tmp_path):
+    rng = np.random.default_rng(4)
+    features = make_features(rng, N_ROWS)
+    pipeline, _ = fit_and_export(features, tmp_path)
+
+    model = export_pipeline(pipeline, tmp_path / 'model.npz', validation_features=features[:100])
+    assert len(model.roots) == 40
+
+    # nothing to check against
+    export_pipeline(pipeline, tmp_path / 'model.npz', validation_features=features[:0])
+    assert model.predict(features[:0]).shape == (0,)